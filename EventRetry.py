@@ -0,0 +1,49 @@
+import random
+import httpx
+from PodioApiWrapper import PodioAPIError
+
+"""
+Retry policy for failed queue events, by error class, as (max_attempts, base_seconds, cap_seconds).
+- 'rate_limit': Podio rate_limit errors (HTTP 420/429); the credential pool already waits, so retry patiently.
+- 'gone': the item or app no longer exists (HTTP 404/410); retrying cannot succeed.
+- 'server': Podio 5xx responses, timeouts and connection errors; usually transient.
+- 'client': other 4xx responses, e.g. permissions; retried a few times in case of a fix.
+- 'other': anything else (MongoDB errors, bugs in cleaning).
+An event that reaches max_attempts is moved to the dead-letter queue.
+"""
+RETRY_POLICIES = {
+    'rate_limit': (20, 60, 3600),
+    'gone': (1, 0, 0),
+    'server': (8, 30, 3600),
+    'client': (3, 300, 3600),
+    'other': (5, 30, 1800)
+}
+
+def classify_error(error):
+    '''
+    Returns the RETRY_POLICIES class for an exception raised while processing an event.
+    '''
+    if isinstance(error, PodioAPIError):
+        response = error.response if isinstance(error.response, dict) else {}
+        if error.status_code in (420, 429) or response.get('error') == 'rate_limit':
+            return 'rate_limit'
+        if error.status_code in (404, 410):
+            return 'gone'
+        if error.status_code >= 500:
+            return 'server'
+        return 'client'
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return 'server'
+    return 'other'
+
+def backoff_seconds(error_class, attempts, policies=RETRY_POLICIES):
+    '''
+    Exponential backoff with jitter for the given attempt number (1 = first failure):
+    base * 2^(attempts - 1), capped, then drawn uniformly from its upper half so retries spread out.
+    '''
+    max_attempts, base, cap = policies[error_class]
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+def should_dead_letter(error_class, attempts, policies=RETRY_POLICIES):
+    return attempts >= policies[error_class][0]
@@ -0,0 +1,266 @@
+import asyncio, fcntl, glob, json, os
+from collections import deque
+from datetime import datetime
+
+class IngestBuffer:
+    '''
+    Bounded in-process buffer between the webhook routes and MongoDB.
+
+    Routes `put` events and return immediately; a background task hands them to `flush` (an async callable
+    taking a list of events) in micro-batches of up to `batch_size`, waiting at most `flush_interval` seconds
+    to fill a batch. When MongoDB is slow or down the buffer applies backpressure by spilling instead of
+    growing: events that do not fit in `max_size`, and batches whose flush failed, are appended to the JSON
+    lines file at `spill_path` (flushed and fsynced). The file writes run on a thread, one batch of the events
+    spilled meanwhile at a time, so a burst of spills does not block the event loop. Spilled events are replayed
+    once the buffer is empty and the database accepts writes again, including after a restart.
+
+    Events are dicts; datetime values under 'timestamp' survive the spill file.
+
+    Each process needs its own `spill_path`. While the buffer runs it holds an exclusive lock on
+    '<spill_path>.lock'; with `adopt_spills` (a glob matching every worker's spill path) it takes over the
+    spill files of workers that are gone (their lock is free), e.g. those of its own previous process.
+    '''
+    def __init__(self, flush, max_size=10000, batch_size=500, flush_interval=0.05, spill_path=None, retry_seconds=5,
+                 adopt_spills=None):
+        self.flush = flush
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.retry_seconds = retry_seconds
+        self.adopt_spills = adopt_spills
+        self.spill_lock = None
+        self.to_spill = []
+        self.spill_task = None
+        self.spill_writes = asyncio.Lock()
+        self.events = deque()
+        self.wake = asyncio.Event()
+        self.task = None
+        self.stats = {'buffered': 0, 'flushed': 0, 'batches': 0, 'spilled': 0, 'replayed': 0, 'flush_errors': 0, 'adopted': 0}
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, event: dict):
+        '''
+        Queues one event without waiting. Returns False if the buffer was full and the event was spilled to disk.
+        '''
+        if len(self.events) >= self.max_size:
+            self.spill_later([event])
+            return False
+        self.events.append(event)
+        self.stats['buffered'] += 1
+        self.wake.set()
+        return True
+
+    def spill_later(self, events: list):
+        '''
+        Queues events for the spill writer task, starting it if it is not running.
+        '''
+        self.to_spill.extend(events)
+        if self.spill_task is None or self.spill_task.done():
+            self.spill_task = asyncio.create_task(self.write_spilled())
+        return self.spill_task
+
+    async def write_spilled(self):
+        async with self.spill_writes:
+            while self.to_spill:
+                batch, self.to_spill = self.to_spill, []
+                await asyncio.to_thread(self.spill, batch)
+        self.wake.set()  # So an idle flusher notices the spill file and replays it.
+
+    async def spill_now(self, events: list):
+        '''
+        Spills events and waits until they (and any spilled before them) are on disk.
+        '''
+        await asyncio.shield(self.spill_later(events))
+
+    def spill(self, events: list):
+        '''
+        Appends events to the spill file (blocking; run on a thread while the loop is serving requests).
+        '''
+        if not self.spill_path:
+            print(f'Ingest buffer full and no spill file configured; dropped {len(events)} events.')
+            return
+        with open(self.spill_path, 'a') as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats['spilled'] += len(events)
+
+    @staticmethod
+    def parse_spilled(line):
+        event = json.loads(line)
+        if isinstance(event.get('timestamp'), str):
+            event['timestamp'] = datetime.fromisoformat(event['timestamp'])
+        return event
+
+    @staticmethod
+    def read_offset(offset_path):
+        try:
+            with open(offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def write_offset(offset_path, offset):
+        with open(offset_path + '.tmp', 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(offset_path + '.tmp', offset_path)
+
+    async def replay_spill(self):
+        '''
+        Flushes the spill file in batches. The file is renamed before replaying so events spilled meanwhile go
+        to a fresh file. After each batch the number of events written so far is fsynced to '<spill>.replay.offset',
+        so a failed batch or a crash mid-replay resumes at that batch instead of re-applying earlier ones.
+        Returns the number of events replayed.
+        '''
+        if not self.spill_path:
+            return 0
+        replay_path = self.spill_path + '.replay'
+        offset_path = replay_path + '.offset'
+        async with self.spill_writes:  # No spill write may be in progress while the file is renamed.
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                if os.path.exists(offset_path):  # Left by a crash after the previous replay finished.
+                    os.remove(offset_path)
+                os.replace(self.spill_path, replay_path)
+        with open(replay_path) as f:
+            events = [self.parse_spilled(line) for line in f if line.strip()]
+        done = self.read_offset(offset_path)
+        for start in range(done, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            await self.flush(batch)
+            self.write_offset(offset_path, start + len(batch))
+            self.stats['replayed'] += len(batch)
+        os.remove(replay_path)
+        if os.path.exists(offset_path):
+            os.remove(offset_path)
+        print(f'Replayed {len(events) - done} spilled events' + (f' (resumed after {done}).' if done else '.'))
+        return len(events) - done
+
+    @classmethod
+    def unreplayed(cls, spill_path):
+        '''
+        Returns the events of a spill path that were never replayed: the rest of its replay file, then its spill file.
+        '''
+        events = []
+        replay_path = spill_path + '.replay'
+        if os.path.exists(replay_path):
+            with open(replay_path) as f:
+                events = [cls.parse_spilled(line) for line in f if line.strip()][cls.read_offset(replay_path + '.offset'):]
+        if os.path.exists(spill_path):
+            with open(spill_path) as f:
+                events += [cls.parse_spilled(line) for line in f if line.strip()]
+        return events
+
+    def lock_spill(self):
+        '''
+        Takes the lock that marks this buffer's spill file as owned by a live worker.
+        '''
+        if not self.spill_path or self.spill_lock:
+            return
+        self.spill_lock = open(self.spill_path + '.lock', 'a')
+        fcntl.flock(self.spill_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def adopt_orphaned_spills(self):
+        '''
+        Appends the unreplayed events of other workers' spill files (matching adopt_spills) to this buffer's
+        spill file when their worker is gone, then removes their files. Returns the number of events adopted.
+        '''
+        if not self.adopt_spills or not self.spill_path:
+            return 0
+        paths = {path.removesuffix('.replay') for path in glob.glob(self.adopt_spills) + glob.glob(self.adopt_spills + '.replay')}
+        adopted = 0
+        for path in sorted(paths - {self.spill_path}):
+            with open(path + '.lock', 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:  # Its worker is still running.
+                    continue
+                events = self.unreplayed(path)
+                if events:
+                    self.spill(events)
+                for leftover in (path + '.replay.offset', path + '.replay', path, path + '.lock'):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            if events:
+                print(f'Adopted {len(events)} spilled events from {path}.')
+            adopted += len(events)
+        self.stats['adopted'] += adopted
+        return adopted
+
+    def has_spill(self):
+        return bool(self.spill_path) and (os.path.exists(self.spill_path) or os.path.exists(self.spill_path + '.replay'))
+
+    async def flush_batch(self):
+        '''
+        Flushes up to batch_size buffered events; a failed batch is spilled. Returns False on failure.
+        '''
+        batch = [self.events.popleft() for _ in range(min(self.batch_size, len(self.events)))]
+        try:
+            await self.flush(batch)
+        except asyncio.CancelledError:
+            self.events.extendleft(reversed(batch))  # Shutting down mid-flush; close() retries the batch.
+            raise
+        except Exception as e:
+            self.stats['flush_errors'] += 1
+            print(f'Failed to flush {len(batch)} events, spilling to {self.spill_path}.\n{e}')
+            await self.spill_now(batch)
+            return False
+        self.stats['flushed'] += len(batch)
+        self.stats['batches'] += 1
+        return True
+
+    async def run(self):
+        try:
+            async with self.spill_writes:
+                await asyncio.to_thread(self.adopt_orphaned_spills)
+        except OSError as e:
+            print(f'Could not adopt spill files of stopped workers.\n{e}')
+        while True:
+            if not self.events:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=self.retry_seconds if self.has_spill() else None)
+                except asyncio.TimeoutError:
+                    pass
+            if self.events and len(self.events) < self.batch_size:
+                await asyncio.sleep(self.flush_interval)  # Let a burst fill the batch.
+            if self.events:
+                if not await self.flush_batch():
+                    await asyncio.sleep(self.retry_seconds)
+            elif self.has_spill():
+                try:
+                    await self.replay_spill()
+                except Exception as e:
+                    print(f'Replaying spilled events failed, retrying in {self.retry_seconds}s.\n{e}')
+                    await asyncio.sleep(self.retry_seconds)
+
+    def start(self):
+        self.lock_spill()
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def close(self):
+        '''
+        Stops the flusher and flushes what is left; anything that cannot be written is spilled.
+        '''
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        while self.events:
+            await self.flush_batch()
+        if self.spill_task:
+            await self.spill_task
+        if self.spill_lock:
+            self.spill_lock.close()
+            self.spill_lock = None
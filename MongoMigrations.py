@@ -0,0 +1,318 @@
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+"""
+Startup migrations for the gateway's MongoDB collections.
+- INDEXES lists every index the hot paths rely on; ensure_indexes creates and verifies them.
+- HOT_QUERIES mirrors the queries issued per event; explain_hot_queries reports any that still scan the collection.
+- backfill_timestamps converts legacy string timestamps to BSON dates once (recorded in 'migrations').
+- collapse_duplicate_item_events merges pending events of one item into one before item_id_unique is built.
+- demote_duplicate_current_items leaves one current: 1 document per item before item_id_current_only is made unique.
+- A unique index that cannot be created raises MigrationError: the queue and item store rely on them.
+"""
+COMPLETED_EVENT_TTL_SECONDS = 30 * 24 * 3600
+LEGACY_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+TIMESTAMP_FIELDS = {
+    'to_do_event_queue': ['timestamp'],
+    'completed_event_queue': ['timestamp', 'completed_timestamp'],
+    'podio_items': ['timestamp']
+}
+
+class MigrationError(Exception):
+    """
+    Raised when a unique index the gateway relies on cannot be created.
+    """
+
+INDEXES = {
+    'to_do_event_queue': [
+        {
+            'name': 'item_id_unique',
+            'keys': [('item_id', ASCENDING)],
+            'unique': True,
+            'partialFilterExpression': {'item_id': {'$exists': True}}
+        },
+        {'name': 'timestamp_id', 'keys': [('timestamp', ASCENDING), ('_id', ASCENDING)]},
+        {'name': 'shard_timestamp_id', 'keys': [('shard', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)]},
+        {'name': 'shard_not_before', 'keys': [('shard', ASCENDING), ('not_before', ASCENDING)]},
+        {'name': 'app_id_timestamp_id', 'keys': [('app_id', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)]},
+        {'name': 'item_id_type', 'keys': [('item_id', ASCENDING), ('type', ASCENDING)]},
+        {'name': 'not_before', 'keys': [('not_before', ASCENDING)]}
+    ],
+    'podio_items': [
+        {'name': 'item_id_current', 'keys': [('item_id', ASCENDING), ('current', ASCENDING)]},
+        {
+            'name': 'item_id_current_only',
+            'keys': [('item_id', ASCENDING)],
+            'unique': True,
+            'partialFilterExpression': {'current': 1}
+        }
+    ],
+    'schema_refresh_queue': [
+        {'name': 'not_before', 'keys': [('not_before', ASCENDING)]}
+    ],
+    'podio_item_changes': [
+        {'name': 'item_id_version', 'keys': [('item_id', ASCENDING), ('version', ASCENDING)], 'unique': True}
+    ],
+    'sql_export_parked': [
+        {'name': 'exporter_item_id', 'keys': [('exporter', ASCENDING), ('item_id', ASCENDING)], 'unique': True}
+    ],
+    'app_schemas': [
+        {'name': 'app_id_version', 'keys': [('app_id', ASCENDING), ('version', DESCENDING)], 'unique': True}
+    ],
+    'completed_event_queue': [
+        {
+            'name': 'completed_timestamp_ttl',
+            'keys': [('completed_timestamp', ASCENDING)],
+            'expireAfterSeconds': COMPLETED_EVENT_TTL_SECONDS
+        }
+    ]
+}
+
+"""
+Indexes superseded by INDEXES; dropped on startup so they stop costing writes.
+"""
+LEGACY_INDEXES = {
+    'to_do_event_queue': ['timestamp']
+}
+
+_sample_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HOT_QUERIES = [
+    {
+        'name': 'claim_events',
+        'collection': 'to_do_event_queue',
+        'filter': {'$and': [
+            {'shard': {'$in': [0, 1]}},
+            {'$or': [{'lease_until': None}, {'lease_until': {'$lt': _sample_time}}]},
+            {'$or': [{'not_before': None}, {'not_before': {'$lte': _sample_time}}]}
+        ]},
+        'sort': {'timestamp': 1, '_id': 1}
+    },
+    {
+        'name': 'claim_app_batches',
+        'collection': 'to_do_event_queue',
+        'filter': {'$and': [
+            {'shard': {'$in': [0, 1]}},
+            {'app_id': '0', 'type': {'$in': ['item.update', 'item.create']}, 'first_seen': {'$gte': _sample_time}},
+            {'$or': [{'lease_until': None}, {'lease_until': {'$lt': _sample_time}}]},
+            {'$or': [{'not_before': None}, {'not_before': {'$lte': _sample_time}}]}
+        ]},
+        'sort': {'timestamp': 1, '_id': 1}
+    },
+    {'name': 'coalesce_update', 'collection': 'to_do_event_queue', 'filter': {'item_id': '0'}},
+    {
+        'name': 'seconds_until_next_event',
+        'collection': 'to_do_event_queue',
+        'filter': {'$and': [{'shard': {'$in': [0, 1]}}, {'lease_until': None, 'not_before': {'$ne': None}}]},
+        'sort': {'not_before': 1}
+    },
+    {'name': 'complete_item_events', 'collection': 'podio_items', 'filter': {'item_id': '0'}},
+    {'name': 'current_item', 'collection': 'podio_items', 'filter': {'item_id': '0', 'current': 1}}
+]
+
+async def ensure_indexes(db, indexes=INDEXES):
+    """
+    Creates any missing index from `indexes` and verifies each one exists with the expected keys.
+    Returns a list of problems (empty when every index is in place); raises MigrationError if a unique index
+    cannot be created (e.g. duplicates no migration cleaned up).
+    """
+    problems = []
+    for collection_name, specs in indexes.items():
+        collection = db[collection_name]
+        for spec in specs:
+            options = {key: value for key, value in spec.items() if key != 'keys'}
+            try:
+                await collection.create_index(spec['keys'], **options)
+            except OperationFailure as e:
+                if e.code == 85 and 'expireAfterSeconds' in spec:  # IndexOptionsConflict: TTL changed, update in place.
+                    await db.command({
+                        'collMod': collection_name,
+                        'index': {'name': spec['name'], 'expireAfterSeconds': spec['expireAfterSeconds']}
+                    })
+                elif spec.get('unique'):
+                    raise MigrationError(f'{collection_name}.{spec['name']}: could not create unique index ({e})') from e
+                else:
+                    problems.append(f'{collection_name}.{spec['name']}: could not create index ({e})')
+        existing = await collection.index_information()
+        for spec in specs:
+            info = existing.get(spec['name'])
+            if info is None:
+                problems.append(f'{collection_name}.{spec['name']}: missing')
+            elif [tuple(key) for key in info['key']] != [tuple(key) for key in spec['keys']]:
+                problems.append(f'{collection_name}.{spec['name']}: expected keys {spec['keys']}, found {info['key']}')
+    return problems
+
+async def drop_legacy_indexes(db, legacy_indexes=LEGACY_INDEXES):
+    """
+    Drops indexes that INDEXES has replaced, if they still exist.
+    """
+    for collection_name, names in legacy_indexes.items():
+        existing = await db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection_name].drop_index(name)
+                print(f'Dropped legacy index {collection_name}.{name}')
+
+def parse_legacy_timestamp(value):
+    """
+    Converts a legacy '%Y-%m-%d %H:%M:%S.%f' string (written in server local time) to a UTC datetime.
+    Returns None if the string does not match.
+    """
+    try:
+        return datetime.strptime(value, LEGACY_TIMESTAMP_FORMAT).astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+async def backfill_timestamps(db, fields=TIMESTAMP_FIELDS, batch_size=1000):
+    """
+    One-time conversion of string timestamps to BSON dates so they sort natively and TTL indexes apply.
+    - Runs once per database; completion is recorded in the 'migrations' collection (an upsert, so workers
+      starting together do not fail on the marker).
+    - Writes in bulk_write batches of batch_size. Returns the number of documents converted.
+    """
+    if await db.migrations.find_one({'_id': 'backfill_timestamps'}):
+        return 0
+    converted = 0
+    for collection_name, field_names in fields.items():
+        collection = db[collection_name]
+        for field in field_names:
+            operations = []
+            async for doc in collection.find({field: {'$type': 'string'}}, projection={field: 1}):
+                value = parse_legacy_timestamp(doc[field])
+                if value is None:
+                    continue
+                operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {field: value}}))
+                if len(operations) >= batch_size:
+                    converted += (await collection.bulk_write(operations, ordered=False)).modified_count
+                    operations = []
+            if operations:
+                converted += (await collection.bulk_write(operations, ordered=False)).modified_count
+    await db.migrations.update_one(
+        {'_id': 'backfill_timestamps'},
+        {'$set': {'converted': converted, 'completed_at': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    print(f'Converted {converted} string timestamps to dates.')
+    return converted
+
+async def collapse_duplicate_item_events(db):
+    """
+    One-time cleanup before the unique item_id_unique index: merges the pending events of each item_id into
+    its oldest event, the way coalescing would have.
+    - timestamp and first_seen become the earliest of the group and coalesced_events their sum.
+    - version moves past every merged event's, so a worker still holding one of them re-fetches the item,
+      and the merged event is unleased.
+    Returns the number of events removed.
+    """
+    if await db.migrations.find_one({'_id': 'collapse_duplicate_item_events'}):
+        return 0
+    pipeline = [
+        {'$match': {'item_id': {'$exists': True}}},
+        {'$sort': {'timestamp': 1, '_id': 1}},
+        {'$group': {
+            '_id': '$item_id',
+            'ids': {'$push': '$_id'},
+            'count': {'$sum': 1},
+            'timestamp': {'$min': '$timestamp'},
+            'first_seen': {'$min': {'$ifNull': ['$first_seen', '$timestamp']}},
+            'coalesced_events': {'$sum': {'$ifNull': ['$coalesced_events', 1]}},
+            'version': {'$max': {'$ifNull': ['$version', 0]}},
+            'app_id': {'$max': '$app_id'}
+        }},
+        {'$match': {'count': {'$gt': 1}}}
+    ]
+    removed = 0
+    async for group in await db.to_do_event_queue.aggregate(pipeline, allowDiskUse=True):
+        merged = {
+            'timestamp': group['timestamp'],
+            'first_seen': group['first_seen'],
+            'coalesced_events': group['coalesced_events'],
+            'version': group['version'] + 1
+        }
+        if group['app_id'] is not None:
+            merged['app_id'] = group['app_id']
+        await db.to_do_event_queue.update_one(
+            {'_id': group['ids'][0]},
+            {'$set': merged, '$unset': {'lease_until': '', 'leased_by': ''}}
+        )
+        removed += (await db.to_do_event_queue.delete_many({'_id': {'$in': group['ids'][1:]}})).deleted_count
+    await db.migrations.update_one(
+        {'_id': 'collapse_duplicate_item_events'},
+        {'$set': {'removed': removed, 'completed_at': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    if removed:
+        print(f'Collapsed {removed} duplicate pending item events.')
+    return removed
+
+async def demote_duplicate_current_items(db):
+    """
+    One-time cleanup before the unique item_id_current_only index: where concurrent writers left several
+    current: 1 documents for one item, keeps the newest (by _id) and sets the others to current: 0.
+    Returns the number of documents demoted.
+    """
+    if await db.migrations.find_one({'_id': 'demote_duplicate_current_items'}):
+        return 0
+    pipeline = [
+        {'$match': {'current': 1}},
+        {'$sort': {'_id': 1}},
+        {'$group': {'_id': '$item_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ]
+    demoted = 0
+    async for group in await db.podio_items.aggregate(pipeline, allowDiskUse=True):
+        result = await db.podio_items.update_many({'_id': {'$in': group['ids'][:-1]}}, {'$set': {'current': 0}})
+        demoted += result.modified_count
+    await db.migrations.update_one(
+        {'_id': 'demote_duplicate_current_items'},
+        {'$set': {'demoted': demoted, 'completed_at': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    if demoted:
+        print(f'Demoted {demoted} duplicate current item versions.')
+    return demoted
+
+def uses_collection_scan(plan):
+    """
+    Returns True if any stage of an explain() query plan is a COLLSCAN.
+    """
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(uses_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(uses_collection_scan(value) for value in plan)
+    return False
+
+async def explain_hot_queries(db, queries=HOT_QUERIES):
+    """
+    Explains each hot query and returns the names of those whose winning plan scans the whole collection.
+    """
+    missing = []
+    for query in queries:
+        command = {'find': query['collection'], 'filter': query['filter']}
+        if 'sort' in query:
+            command['sort'] = query['sort']
+        explained = await db.command({'explain': command, 'verbosity': 'queryPlanner'})
+        if uses_collection_scan(explained['queryPlanner']['winningPlan']):
+            missing.append(f'{query['collection']}: {query['name']}')
+    return missing
+
+async def run_migrations(db):
+    """
+    Runs every startup migration and prints a report of missing indexes and unindexed hot queries.
+    Raises MigrationError if a unique index cannot be created.
+    """
+    await backfill_timestamps(db)
+    await collapse_duplicate_item_events(db)
+    await demote_duplicate_current_items(db)
+    await drop_legacy_indexes(db)
+    problems = await ensure_indexes(db)
+    for problem in problems:
+        print(f'Index problem: {problem}')
+    unindexed = await explain_hot_queries(db)
+    for query in unindexed:
+        print(f'Hot query without index: {query}')
+    if not problems and not unindexed:
+        print('MongoDB indexes verified.')
+    return {'index_problems': problems, 'unindexed_queries': unindexed}
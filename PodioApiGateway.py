@@ -1,8 +1,23 @@
 from fastapi import FastAPI, Request
-from datetime import datetime
-from pymongo import MongoClient, DESCENDING, ASCENDING
-import httpx, asyncio, time
-import PodioAPIWorkTEMP as fs
+from fastapi.responses import PlainTextResponse
+from datetime import datetime, timedelta, timezone
+from pymongo import AsyncMongoClient, DESCENDING, ASCENDING, ReturnDocument, DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import OperationFailure, BulkWriteError
+import httpx, asyncio, glob, os, re, socket
+import PodioApiWrapper as fs
+from PodioCredentialPool import CredentialPool
+from PodioTokenCache import TokenCache
+import MongoMigrations
+import PodioItemStore
+import EventRetry
+import PodioMetrics
+from PodioMetrics import timed, MONGO_SECONDS, SPAN_SECONDS
+from PodioSyncEngine import PodioSyncEngine
+from PodioSchemaSnapshots import SchemaSnapshots
+from IngestBuffer import IngestBuffer
+from PodioSqlExport import SqlExporter
+from PodioParquetExport import ParquetExporter
+from WorkerSharding import ShardCoordinator, shard_for, assign_missing_shards
 
 """
 FastAPI application for handling Podio webhooks, event queue processing, and MongoDB interactions.
@@ -12,7 +27,7 @@ app = FastAPI()
 """
 Podio API credentials dictionary.
 - Multiple credentials are used to distribute API calls and avoid rate limits.
-- Credentials are rotated after a certain number of requests.
+- credential_pool schedules each request on the credential with the most remaining rate budget.
 """
 podio_creds = {
     1: {
@@ -45,21 +60,225 @@ podio_creds = {
 MongoDB connection string. Replace with actual connection details.
 """
 mongo_connection_string = 'mongo_db_connect_string'
+
+"""
+App-lifetime async MongoDB client (created on startup) shared by routes and workers.
+- One pooled client instead of a new MongoClient per webhook, event and loop iteration.
+- mongo_transactions is switched off on startup when the server is not a replica set member.
+"""
+mongo_client = None
+mongo_db = None
+mongo_database = 'test'
+mongo_max_pool_size = 50
+mongo_min_pool_size = 5
+mongo_max_idle_time_ms = 60000
+mongo_transactions = True
 org_id = 1234567
 base_url = 'https://api.podio.com/'
-secret_no = 1
+credential_pool = CredentialPool(podio_creds)
+
+"""
+OAuth tokens for every credential, persisted so restarts reuse them instead of re-authenticating.
+"""
+token_cache_path = 'podio_tokens.json'
+token_cache = TokenCache(base_url, path=token_cache_path)
+
+"""
+Shared, pooled HTTP client for all Podio traffic (created on startup).
+- Keep-alive/HTTP2 connections are reused across events instead of a new handshake per call.
+- podio_max_concurrency caps in-flight Podio requests per AsyncPodioAPI instance.
+"""
+http_client = None
+podio_max_connections = 20
+podio_max_keepalive_connections = 10
+podio_max_concurrency = 10
+
+"""
+Queue worker pool settings.
+- worker_concurrency: events processed concurrently by one worker.
+- claim_batch_size: most events leased per claim round, and per bulk hydration group.
+- lease_seconds: visibility timeout before an unfinished event can be claimed again.
+- idle_poll_seconds: fallback poll interval when no insert notification arrives.
+"""
+worker_concurrency = 10
+claim_batch_size = 20
+lease_seconds = 300
+idle_poll_seconds = 10
+use_change_stream = True
+worker_id = f'{socket.gethostname()}:{os.getpid()}'
+queue_notifier = asyncio.Event()
 
-async def update_podio_creds():
+def worker_path(path):
     """
-    Rotates Podio API credentials to distribute request load and avoid hitting rate limits.
+    Inserts this worker's id before the extension of `path`, for files every worker process writes on its own.
     """
-    count = 0
-    secret_no = (secret_no + 1) % len(podio_creds.keys())
-    username = podio_creds[secret_no]['user']
-    password = podio_creds[secret_no]['password']
-    client_id = podio_creds[secret_no]['client_id']
-    client_secret = podio_creds[secret_no]['client_secret']
-    return [count, secret_no, username, password, client_id, client_secret]
+    root, extension = os.path.splitext(path)
+    return f'{root}.{re.sub(r'[^A-Za-z0-9_.-]', '-', worker_id)}{extension}'
+
+"""
+Worker sharding (WorkerSharding), for running the gateway in several processes or on several hosts.
+- Queue events carry shard = crc32(item_id) % queue_shards; a worker only claims events of the shards it
+  leases, so each item is processed in order by one owner. Shards rebalance as workers start and stop.
+- Each worker sends its Podio requests with its own slice of credential_pool.
+- Schema refreshes, incremental syncs and shard backfill run only on the elected leader.
+- queue_shards must be the same on every worker; shard_lease_seconds is how long a dead worker's
+  shards and leadership stay taken.
+"""
+queue_shards = 16
+shard_lease_seconds = 30
+shard_heartbeat_seconds = 10
+shard_coordinator = None
+
+"""
+Item event coalescing.
+- Hooks for the same item_id collapse into one pending queue document and one Podio fetch.
+- coalesce_debounce_seconds: quiet period after the latest hook before the item is fetched.
+- coalesce_max_delay_seconds: upper bound on how long a busy item can be deferred.
+- queue_stats counts hooks merged into pending documents and Podio fetches saved.
+"""
+item_event_types = ['item.update', 'item.create']
+coalesce_debounce_seconds = 5
+coalesce_max_delay_seconds = 60
+queue_stats = {'events_coalesced': 0, 'fetches': 0, 'fetches_saved': 0, 'failures': {}, 'dead_lettered': 0}
+
+"""
+Webhook ingest (IngestBuffer).
+- Hook routes stamp the event, put it in an in-memory buffer and return at once; a background flusher
+  writes the buffer to to_do_event_queue with one bulk_write per micro-batch (to_do_event_queue_add_many).
+- ingest_buffer_size bounds the buffer; events beyond it, and batches MongoDB rejects, are appended to
+  this worker's spill file (ingest_spill_path with the worker id added, see worker_path) and replayed once
+  MongoDB catches up. Spill files left by stopped workers (e.g. before a restart) are taken over on startup.
+- ingest_flush_interval_seconds: how long a partial batch may wait to fill.
+"""
+ingest_buffer_size = 10000
+ingest_batch_size = 500
+ingest_flush_interval_seconds = 0.05
+ingest_spill_path = 'ingest_spill.jsonl'
+ingest_buffer = None
+
+"""
+Metrics (PodioMetrics, served at /metrics).
+- queue_stats and ingest_buffer.stats are exported as counters; queue depth and age are measured per scrape.
+- Set PodioMetrics.TRACE_SPANS = True to also print every timed span as a JSON line.
+"""
+PodioMetrics.Counter('queue_events_coalesced_total', 'Hooks merged into an existing pending event.',
+                     function=lambda: queue_stats['events_coalesced'])
+PodioMetrics.Counter('queue_fetches_total', 'Podio fetches made for queued events.', function=lambda: queue_stats['fetches'])
+PodioMetrics.Counter('queue_fetches_saved_total', 'Podio fetches avoided by coalescing and bulk hydration.',
+                     function=lambda: queue_stats['fetches_saved'])
+PodioMetrics.Counter('queue_event_failures_total', 'Failed event attempts by error class.', ['error_class'],
+                     function=lambda: queue_stats['failures'])
+PodioMetrics.Counter('queue_dead_lettered_total', 'Events moved to dead_letter_queue.', function=lambda: queue_stats['dead_lettered'])
+PodioMetrics.Counter('ingest_events_total', 'Ingest buffer events by outcome.', ['outcome'],
+                     function=lambda: ingest_buffer.stats if ingest_buffer else {})
+PodioMetrics.Gauge('ingest_buffer_events', 'Events waiting in the ingest buffer.', function=lambda: len(ingest_buffer) if ingest_buffer else 0)
+PodioMetrics.Gauge('podio_rate_budget_remaining', 'Remaining rate limit tokens per credential.', ['client_id', 'kind'],
+                   function=lambda: {(client_id, kind): remaining
+                                     for client_id, kinds in credential_pool.status().items()
+                                     for kind, remaining in kinds.items()})
+QUEUE_DEPTH = PodioMetrics.Gauge('queue_depth', 'Documents per queue collection.', ['queue'])
+QUEUE_OLDEST_AGE = PodioMetrics.Gauge('queue_oldest_event_age_seconds', 'Age of the oldest pending event.', ['queue'])
+EVENT_LAG_SECONDS = PodioMetrics.Histogram('queue_event_lag_seconds', 'Time from webhook arrival to the item being stored.',
+                                           buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+
+"""
+Bulk item hydration.
+- Claimed events that carry an app_id (hooks registered with '?app_id=<id>' on the URL) are grouped
+  by app and fetched with one get_filtered_items call per app instead of one call per item.
+- bulk_hydration_min_items: smallest group worth a filtered request.
+- bulk_hydration_slack_seconds: how far before the first hook the last_edit_on filter starts.
+- bulk_hydration_max_window_seconds: events first seen longer ago (e.g. retried with backoff) are fetched
+  one by one, since the filter would page through every edit in the app since then.
+- bulk_hydration_max_pages: filter pages read per group; items not found by then are fetched one by one.
+"""
+bulk_hydration = True
+bulk_hydration_min_items = 3
+bulk_hydration_slack_seconds = 120
+bulk_hydration_max_window_seconds = 900
+bulk_hydration_max_pages = 1
+
+"""
+Incremental sync (PodioSyncEngine).
+- Every sync_interval_seconds, items of sync_app_ids edited since each app's last_edit_on watermark are
+  re-pulled into podio_items, closing gaps left by missed webhooks.
+- sync_overlap_seconds: how far before the watermark each run starts.
+- Leave sync_app_ids empty to disable.
+"""
+sync_app_ids = []
+sync_interval_seconds = 900
+sync_overlap_seconds = 300
+
+"""
+Schema snapshots (PodioSchemaSnapshots).
+- Every schema_refresh_interval_seconds (twice daily) the org's app schemas are walked, skipping apps whose
+  ETag is unchanged, and a new version is stored in app_schemas for each app whose fields changed.
+- Set schema_refresh_interval_seconds to None to disable.
+"""
+schema_refresh_interval_seconds = 12 * 3600
+
+"""
+Typed item storage.
+- typed_item_values = True stores podio_items 'data' as { field_id: native_value } (lists, floats, dates)
+  instead of { field_id: { field_id, field_label, field_type, field_value } } with joined strings.
+- Labels and types then live only in app_schemas; converters are precompiled from those snapshots.
+- Switching modes does not rewrite existing versions; run a full sync (sync_app_ids) to convert current items.
+"""
+typed_item_values = False
+item_cleaner = None
+
+"""
+App schema refresh queue.
+- app.create/app.update hooks upsert one document per app into schema_refresh_queue; repeated hooks push
+  its not_before out by schema_refresh_debounce_seconds, capped at schema_refresh_max_delay_seconds.
+- refresh_app_schemas fetches just that app's fields, records a snapshot and recompiles the shared
+  item_cleaner, so items are cleaned with fresh metadata between full schema walks.
+"""
+app_event_types = ['app.create', 'app.update']
+schema_refresh_debounce_seconds = 30
+schema_refresh_max_delay_seconds = 300
+schema_refresh_notifier = asyncio.Event()
+
+"""
+Item history (PodioItemStore).
+- 'copies': each fetch inserts a full version and flips older versions to current: 0.
+- 'delta': one current document per item plus field-level records in podio_item_changes;
+  unchanged re-fetches are skipped. PodioItemStore.item_at reconstructs past versions in both modes.
+"""
+item_history = 'copies'
+
+"""
+Change-data export to the SQL AdHoc server (PodioSqlExport), run by the leader worker.
+- sql_export_connect: callable returning a DB-API connection, e.g. lambda: sqlite3.connect('adhoc.db') locally
+  or a pymysql connection to the MySQL 8.0 AdHoc server; None disables the export.
+- sql_export_dialect: 'sqlite' or 'mysql'.
+"""
+sql_export_connect = None
+sql_export_dialect = 'sqlite'
+
+"""
+Parquet snapshots for analytics (PodioParquetExport), run by the leader worker.
+- parquet_export_path: dataset root; None disables the export.
+- Every parquet_export_interval_seconds each app with a schema snapshot gets a partition of the items
+  changed since its previous export (a full snapshot the first time).
+"""
+parquet_export_path = None
+parquet_export_interval_seconds = 24 * 3600
+
+async def create_podio_client():
+    """
+    Returns an AsyncPodioAPI on the shared HTTP client and credential pool, cleaning items per typed_item_values.
+    All clients share item_cleaner, precompiled from the stored app schemas on first use, so a schema
+    fetched by any of them (e.g. refresh_app_schemas) applies to every worker.
+    """
+    global item_cleaner
+    podio = fs.AsyncPodioAPI.from_pool(base_url, org_id, credential_pool, client=http_client,
+                                       max_concurrency=podio_max_concurrency, token_cache=token_cache,
+                                       typed_values=typed_item_values)
+    if item_cleaner is None:
+        item_cleaner = podio.item_cleaner
+        await SchemaSnapshots(mongo_db).load_into(item_cleaner)
+    podio.item_cleaner = item_cleaner
+    return podio
 
 async def verify_hook(data):
     """
@@ -68,146 +287,623 @@ async def verify_hook(data):
     hook_id = data['hook_id']
     url = f'https://api.podio.com/hook/{hook_id}/verify/validate'
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=data)
-        return response.status_code
+    response = await http_client.post(url, json=data)
+    return response.status_code
 
-async def to_do_event_queue_add(data: dict, failed_attempts: int):
+async def schema_refresh_add(data: dict):
     """
-    Adds an event to the MongoDB 'to_do_event_queue' collection.
-    - Tracks failed attempts for retry logic.
-    - Stores a timestamp for when the event was added.
+    Requests a schema refresh for data['app_id'], debounced per app in 'schema_refresh_queue'.
     """
-    client = MongoClient(mongo_connection_string)
-    data['failed_attempts'] = failed_attempts
-    data['timestamp'] = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
+    now = datetime.now(timezone.utc)
+    update = [{'$set': {
+        'type': {'$literal': data.get('type')},
+        'requested': {'$ifNull': ['$requested', now]},
+        'events': {'$add': [{'$ifNull': ['$events', 0]}, 1]},
+        'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]},
+        'failed_attempts': {'$ifNull': ['$failed_attempts', 0]},
+        'not_before': {'$min': [
+            now + timedelta(seconds=schema_refresh_debounce_seconds),
+            {'$add': [{'$ifNull': ['$requested', now]}, schema_refresh_max_delay_seconds * 1000]}
+        ]}
+    }}]
+    await mongo_db.schema_refresh_queue.update_one({'_id': str(data['app_id'])}, update, upsert=True)
+    schema_refresh_notifier.set()
+    print(f'Queued schema refresh for app {data['app_id']} ({data.get('type')}).')
 
-    db = client.test
-    collection = db.to_do_event_queue
-    collection.insert_one(data)
+async def refresh_app_schema(podio, snapshots, doc):
+    """
+    Fetches one app's fields, records a snapshot if they changed and retires the queue document,
+    unless another hook arrived meanwhile (version changed), in which case it stays queued.
+    """
+    app_id = doc['_id']
+    collection = mongo_db.schema_refresh_queue
+    try:
+        fields_info = await podio.get_app_fields_data(app_id)
+        diff = await snapshots.record(app_id, fields_info, podio.app_etags.get(app_id))
+    except Exception as e:
+        delay = EventRetry.backoff_seconds(EventRetry.classify_error(e), doc['failed_attempts'] + 1)
+        await collection.update_one({'_id': app_id}, {
+            '$set': {'not_before': datetime.now(timezone.utc) + timedelta(seconds=delay)},
+            '$inc': {'failed_attempts': 1},
+            '$unset': {'lease_until': '', 'leased_by': ''}
+        })
+        print(f'Schema refresh for app {app_id} failed, retrying in {delay:.0f}s.\n{e}')
+        return
+    deleted = await collection.delete_one({'_id': app_id, 'version': doc['version']})
+    if not deleted.deleted_count:
+        await collection.update_one({'_id': app_id}, {'$unset': {'lease_until': '', 'leased_by': ''}})
+    print(f'Refreshed schema of app {app_id}: {diff if diff else 'unchanged'}.')
+
+async def refresh_app_schemas():
+    """
+    Works through 'schema_refresh_queue', refreshing each app once its debounce has passed.
+    A failed round (e.g. MongoDB unreachable) is logged and retried after idle_poll_seconds.
+    """
+    podio = await create_podio_client()
+    snapshots = SchemaSnapshots(mongo_db)
+    collection = mongo_db.schema_refresh_queue
+    while True:
+        try:
+            schema_refresh_notifier.clear()
+            docs = await claim_events(collection, claim_batch_size)
+            if docs:
+                await asyncio.gather(*[refresh_app_schema(podio, snapshots, doc) for doc in docs])
+                continue
+            timeout = idle_poll_seconds
+            next_refresh = await seconds_until_next_event(collection)
+            if next_refresh is not None:
+                timeout = min(timeout, next_refresh)
+        except Exception as e:
+            print(f'Schema refresh queue failed, resuming in {idle_poll_seconds}s.\n{e}')
+            await asyncio.sleep(idle_poll_seconds)
+            continue
+        try:
+            await asyncio.wait_for(schema_refresh_notifier.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+async def ingest_event(data: dict):
+    """
+    Stamps a hook event with its arrival time and hands it to ingest_buffer without waiting on MongoDB.
+    """
+    data['timestamp'] = datetime.now(timezone.utc)
+    ingest_buffer.put(data)
+
+async def to_do_event_queue_add_many(events: list):
+    """
+    Writes a micro-batch of ingested events to 'to_do_event_queue' with one unordered bulk_write.
+    - Item events become coalescing upserts (coalesce_update) stamped with their arrival time; other events are inserted.
+    - Upserts that lose a race on the unique item_id index are retried once.
+    - Any other write error is permanent for that event (e.g. an insert hitting the unique item_id index),
+      so the event goes to 'dead_letter_queue' instead of failing the batch, which would only be spilled and
+      replayed into the same error.
+    """
+    collection = mongo_db.to_do_event_queue
+    operations = []
+    for data in events:
+        if data.get('type') in item_event_types and 'item_id' in data:
+            update = coalesce_update(data, 0, data['timestamp'])
+            operations.append(UpdateOne({'item_id': data['item_id']}, update, upsert=True))
+        else:
+            operations.append(InsertOne({**data, 'failed_attempts': 0, 'shard': event_shard(data)}))
+    try:
+        with timed(MONGO_SECONDS, operation='ingest_bulk_write'):
+            result = await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        retry = []
+        rejected = []
+        for error in e.details['writeErrors']:
+            if error['code'] == 11000 and isinstance(operations[error['index']], UpdateOne):
+                retry.append(operations[error['index']])
+            else:
+                rejected.append((events[error['index']], error))
+        if rejected:
+            await dead_letter_ingested(rejected)
+        if retry:
+            await collection.bulk_write(retry, ordered=False)
+        result = None
+    item_events = sum(isinstance(operation, UpdateOne) for operation in operations)
+    if result is not None:
+        queue_stats['events_coalesced'] += item_events - result.upserted_count
+    queue_notifier.set()
+    print(f'Added {len(events)} events to "to_do_event_queue".')
+
+async def dead_letter_ingested(rejected: list):
+    """
+    Moves ingested events that MongoDB refused to queue to 'dead_letter_queue' (error_class 'ingest').
+    - rejected is a list of (event, writeError) pairs from to_do_event_queue_add_many.
+    """
+    dead_lettered_at = datetime.now(timezone.utc)
+    await mongo_db.dead_letter_queue.insert_many([
+        {**data, 'error_class': 'ingest', 'last_error': error.get('errmsg'), 'dead_lettered_at': dead_lettered_at}
+        for data, error in rejected
+    ])
+    queue_stats['dead_lettered'] += len(rejected)
+    for data, error in rejected:
+        # send email to crm admin
+        print(f'ALERT: {data.get('type')} for {data.get('item_id', data.get('app_id'))} could not be queued, '
+              f'moved to dead_letter_queue: {error.get('errmsg')}')
 
-    print(f'Added {data['item_id']} to "to_do_event_queue".')
+def event_shard(data: dict):
+    """
+    The queue shard of an event: by item_id, so every event of one item goes to the same worker.
+    """
+    return shard_for(data.get('item_id', data.get('app_id')), queue_shards)
+
+def coalesce_update(data: dict, failed_attempts: int, now):
+    """
+    Builds the pipeline update that merges an item event into the pending queue document for its item_id.
+    - Each new hook bumps 'version' and 'coalesced_events' and pushes 'not_before' out by
+      coalesce_debounce_seconds, capped at coalesce_max_delay_seconds after the first hook.
+    - The worker only deletes the document if 'version' is unchanged, so hooks that arrive
+      mid-fetch trigger one more fetch instead of being lost.
+    - An item backing off after a failure (retry_at, see fail_event) is not pulled forward by new hooks.
+    """
+    fields = {key: {'$literal': value} for key, value in data.items() if key not in ('_id', 'failed_attempts', 'timestamp')}
+    return [{'$set': {
+        **fields,
+        'shard': event_shard(data),
+        'timestamp': {'$ifNull': ['$timestamp', now]},
+        'failed_attempts': {'$ifNull': ['$failed_attempts', failed_attempts]},
+        'first_seen': {'$ifNull': ['$first_seen', now]},
+        'coalesced_events': {'$add': [{'$ifNull': ['$coalesced_events', 0]}, 1]},
+        'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]},
+        'not_before': {'$max': [
+            {'$min': [
+                now + timedelta(seconds=coalesce_debounce_seconds),
+                {'$add': [{'$ifNull': ['$first_seen', now]}, coalesce_max_delay_seconds * 1000]}
+            ]},
+            {'$ifNull': ['$retry_at', now]}
+        ]}
+    }}]
+
+async def run_in_transaction(writes):
+    """
+    Runs `writes(session)` inside a transaction when the deployment supports one (replica set),
+    otherwise runs the same writes without a session.
+    """
+    if not mongo_transactions:
+        return await writes(None)
+    async with mongo_client.start_session() as session:
+        return await session.with_transaction(writes)
 
-async def complete_to_do_event_queue_docs(count, secret_no, podio_creds):
+async def complete_item_events(db, events: list):
     """
-    Processes events from 'to_do_event_queue' in MongoDB.
-    - Retrieves item details from Podio.
-    - Updates the MongoDB 'podio_items' collection with the latest data.
-    - Moves completed events to 'completed_event_queue'.
-    - Deletes processed events from 'to_do_event_queue'.
+    Stores fetched items and retires their queue events with grouped writes in one transaction.
+    - events is a list of (queue_doc, item_vals) pairs.
+    - podio_items: one ordered bulk_write marking previous versions not current and inserting the new ones
+      (PodioItemStore.store_items).
+    - completed_event_queue: one insert_many (expired by a TTL index on completed_timestamp).
+    - to_do_event_queue: one bulk_write of version-checked deletes; events whose version changed during the
+      fetch (new hooks arrived) are released for one more fetch instead, with first_seen restarted so the
+      next fetch is debounced again rather than due at once.
     """
+    items = []
+    completed_docs = []
+    delete_ops = []
+    completed_timestamp = datetime.now(timezone.utc)
+    for data, item_vals in events:
+        items.append((item_vals, data['timestamp'], data.get('app_id')))
+        completed = {key: val for key, val in data.items() if key != '_id'}
+        completed['event_id'] = data['_id']
+        completed['completed_timestamp'] = completed_timestamp
+        completed_docs.append(completed)
+        delete_ops.append(DeleteOne({'_id': data['_id'], 'version': data.get('version')}))
+    event_ids = [data['_id'] for data, item_vals in events]
+
+    async def writes(session):
+        await PodioItemStore.store_items(db, items, session=session, history=item_history)
+        await db.completed_event_queue.insert_many(completed_docs, session=session)
+        deleted = await db.to_do_event_queue.bulk_write(delete_ops, ordered=False, session=session)
+        if deleted.deleted_count < len(delete_ops):  # New hooks arrived mid-fetch; release those leases.
+            released = datetime.now(timezone.utc)
+            await db.to_do_event_queue.update_many(
+                {'_id': {'$in': event_ids}, 'leased_by': worker_id},
+                {
+                    '$set': {'first_seen': released, 'not_before': released + timedelta(seconds=coalesce_debounce_seconds)},
+                    '$unset': {'lease_until': '', 'leased_by': ''}
+                },
+                session=session
+            )
+        return deleted.deleted_count
 
-    if count == 990:
-        count, secret_no, username, password, client_id, client_secret = await update_podio_creds()
-        podio = fs.PodioAPI(base_url, org_id, username, password, client_id, client_secret)
+    with timed(MONGO_SECONDS, operation='complete_item_events'):
+        deleted_count = await run_in_transaction(writes)
+    for data, item_vals in events:
+        EVENT_LAG_SECONDS.observe((completed_timestamp - data['timestamp'].replace(tzinfo=timezone.utc)).total_seconds())
+    queue_stats['fetches_saved'] += sum(data.get('coalesced_events', 1) - 1 for data, item_vals in events)
+    print(f'{len(events)} items added to podio_items, {deleted_count} removed from to_do_queue')
+
+async def fail_event(db, data: dict, error):
+    """
+    Schedules a failed event for retry, or dead-letters it, according to EventRetry.RETRY_POLICIES.
+    - The error is classified (rate_limit, gone, server, client, other); the event keeps its place in the
+      queue order but is not claimable before 'not_before' (exponential backoff with jitter). 'retry_at'
+      keeps new hooks for the same item from pulling the retry forward.
+    - Events out of attempts move to 'dead_letter_queue' (dead_letter_event).
+    """
+    data['failed_attempts'] = data.get('failed_attempts', 0) + 1
+    error_class = EventRetry.classify_error(error)
+    queue_stats['failures'][error_class] = queue_stats['failures'].get(error_class, 0) + 1
+    if EventRetry.should_dead_letter(error_class, data['failed_attempts']) and await dead_letter_event(db, data, error_class, error):
+        return f'Dead-lettered {data['type']} for {data.get('item_id', data.get('app_id'))} ({error_class}).\n{error}'
+    delay = EventRetry.backoff_seconds(error_class, data['failed_attempts'])
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    with timed(MONGO_SECONDS, operation='fail_event'):
+        await db.to_do_event_queue.update_one(
+            {'_id': data['_id']},
+            {
+                '$set': {
+                    'failed_attempts': data['failed_attempts'],
+                    'not_before': retry_at,
+                    'retry_at': retry_at,
+                    'error_class': error_class,
+                    'last_error': str(error)
+                },
+                '$unset': {'lease_until': '', 'leased_by': ''}
+            }
+        )
+    return f'Failed to complete {data['type']} for {data.get('item_id')} ({error_class}), retry in {delay:.0f}s.\n{error}'
+
+async def dead_letter_event(db, data: dict, error_class: str, error):
+    """
+    Moves an event that ran out of attempts from 'to_do_event_queue' to 'dead_letter_queue'.
+    Returns False (and leaves the event queued) if a new hook updated it meanwhile.
+    """
+    async def writes(session):
+        deleted = await db.to_do_event_queue.delete_one({'_id': data['_id'], 'version': data.get('version')}, session=session)
+        if not deleted.deleted_count:
+            return False
+        doc = {key: value for key, value in data.items() if key not in ('_id', 'lease_until', 'leased_by')}
+        await db.dead_letter_queue.insert_one({
+            **doc,
+            'event_id': data['_id'],
+            'error_class': error_class,
+            'last_error': str(error),
+            'dead_lettered_at': datetime.now(timezone.utc)
+        }, session=session)
+        return True
+
+    moved = await run_in_transaction(writes)
+    if moved:
+        queue_stats['dead_lettered'] += 1
+        # send email to crm admin
+        print(f'ALERT: {data['type']} for {data.get('item_id', data.get('app_id'))} moved to dead_letter_queue '
+              f'after {data['failed_attempts']} attempts ({error_class}): {error}')
+    return moved
+
+async def process_event(podio, db, data: dict, item_vals=None):
+    """
+    Processes a single claimed event from the queue.
+    - Retrieves item details from Podio, unless item_vals was already hydrated in bulk.
+    - Updates the MongoDB database with the latest state and moves the event to 'completed_event_queue'
+      in one transaction (complete_item_events).
+    - On failure, schedules a retry with backoff or dead-letters the event (fail_event).
+    - Event types without a handler are dead-lettered ('unsupported') rather than left leased in the queue.
+    """
+    if data['type'] in item_event_types:
+        item_id = data['item_id']
+        try:
+            with timed(SPAN_SECONDS, span='process_event'):
+                if item_vals is None:
+                    with timed(SPAN_SECONDS, span='fetch_item'):
+                        item_vals = await podio.get_podio_item_values(item_id)
+                    queue_stats['fetches'] += 1
+                    print('item pulled from Podio.')
+                await complete_item_events(db, [(data, item_vals)])
+            result = f'Completed {data['type']} event queue for {data['item_id']}.'
+
+        except Exception as e:
+            result = await fail_event(db, data, e)
+    # elif data['type'] == 'item.delete':
+    #     item_id = data['item_id']
+    #     client = MongoClient(mongo_connection_string)
+    #     db = client.test
+    #     document_to_update = db.podio_items.find_one({'item_id': item_id}, sort=[('timestamp', -1)])
+    #     try:
+    #         timestamp = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
+    #         updated_data = {"$set": {"deleted": True, "timestamp": timestamp}}
+    #         deleted = db.podio_items.update_one({'_id': document_to_update['_id']}, updated_data)
+    #         result = f'Completed {data['type']} event queue for {data['item_id']}.'
+    #     except:
+    #         data['failed_attempts'] += 1
+    #         data['timestamp'] = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
+    #         await to_do_event_queue_add(data)
+    #         if data['failed_apptempts'] >= 10:
+    #             # send email to crm admin
+    #             pass
+    #         result = f'Failed to complete {data['type']} for {data['item_id']}.'
+
+    elif data['type'] in app_event_types:
+        # App events queued before schema_refresh_queue existed.
+        await schema_refresh_add(data)
+        await db.to_do_event_queue.delete_one({'_id': data['_id']})
+        result = f'Moved {data['type']} for {data['app_id']} to schema_refresh_queue.'
     else:
-        secrets = podio_creds[secret_no]
-        username = secrets['user']
-        password = secrets['password']
-        client_id = secrets['client_id']
-        client_secret = secrets['client_secret']
-        podio = fs.PodioAPI(base_url, org_id, username, password, client_id, client_secret)
-
-    async def process_event(data: dict, count):
-        """
-        Processes a single event from the queue.
-        - Retrieves item details from Podio.
-        - Updates the MongoDB database with the latest state.
-        - Moves completed events to 'completed_event_queue'.
-        - Handles API failures by retrying up to 10 times.
-        """
-        start = time.time()
-        if data['type'] in ['item.update', 'item.create']:
-            count += 1
-            item_id = data['item_id']
-            try:
-                item_vals = podio.get_podio_item_values(item_id)
-                print('item pulled from Podio.')
-                item_vals = {str(key): val for key, val in item_vals.items()}
-                item_vals['timestamp'] = data['timestamp']
-                item_vals['current'] = 1
-                client = MongoClient(mongo_connection_string)
-                db = client.test
-                collection = db.podio_items
-                collection.update_many(
-                    {'item_id': item_id},
-                    {'$set': {'current': 0}}
-                )
-                print('Previous matching items marked as not current.')
-                collection.insert_one(item_vals)
-                print('item added to podio_items')
-                collection = db.completed_event_queue
-                data['completed_timestamp'] = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
-                collection.insert_one(data)
-                print('item added to completed queue')
-                collection = db.to_do_event_queue
-                collection.delete_many({'item_id': item_id, 'type': 'item.update'})
-                collection.delete_many({'item_id': item_id, 'type': 'item.create'})
-                print('item removed from to_do_queue')
-                result = f'Completed {data['type']} event queue for {data['item_id']}.'
-                end = time.time()
-                total_time = end - start
-                print(f"Time taken for process_event: {total_time:.4f} seconds")
-
-            
-            except Exception as e:
-                data['failed_attempts'] += 1
-                data['timestamp'] = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
-                await to_do_event_queue_add(data, failed_attempts=data['failed_attempts'])
-                if data['failed_attempts'] >= 10:
-                    # send email to crm admin
-                    pass
-                result = f'Failed to complete {data['type']} for {data['item_id']}.\n{e}\n{data}'
-        # elif data['type'] == 'item.delete':
-        #     item_id = data['item_id']
-        #     client = MongoClient(mongo_connection_string)
-        #     db = client.test
-        #     document_to_update = db.podio_items.find_one({'item_id': item_id}, sort=[('timestamp', -1)])
-        #     try:
-        #         timestamp = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
-        #         updated_data = {"$set": {"deleted": True, "timestamp": timestamp}}
-        #         deleted = db.podio_items.update_one({'_id': document_to_update['_id']}, updated_data)
-        #         result = f'Completed {data['type']} event queue for {data['item_id']}.'
-        #     except:
-        #         data['failed_attempts'] += 1
-        #         data['timestamp'] = datetime.today().strftime('%Y-%m-%d %H:%M:%S.%f')
-        #         await to_do_event_queue_add(data)
-        #         if data['failed_apptempts'] >= 10:
-        #             # send email to crm admin
-        #             pass
-        #         result = f'Failed to complete {data['type']} for {data['item_id']}.'
-
-        # elif data['type'] in ['app.create', 'app.update']:
-        #     result = f'Passed {data['type']} for {data['app_id']}'
-        print(result)
-        return
-    
-    while True:
-        client = MongoClient(mongo_connection_string)
-        db = client.test
-        collection = db.to_do_event_queue
+        error = f'No handler for {data.get('type')} events.'
+        if await dead_letter_event(db, data, 'unsupported', error):
+            result = f'Dead-lettered unsupported {data.get('type')} event {data['_id']}.'
+        else:
+            await release_events(db.to_do_event_queue, [data])
+            result = f'Released unsupported {data.get('type')} event {data['_id']}, it changed meanwhile.'
+    print(result)
+    return
+
+async def process_event_batch(podio, db, app_id, docs: list):
+    """
+    Processes claimed item events of one app with a single bulk hydration request.
+    - All hydrated items are stored with one set of grouped writes (complete_item_events).
+    - Items not returned by the filtered request fall back to a per-item fetch in process_event.
+    """
+    since = min(doc['first_seen'] for doc in docs) - timedelta(seconds=bulk_hydration_slack_seconds)
+    try:
+        with timed(SPAN_SECONDS, span='hydrate_batch'):
+            hydrated, pages = await podio.get_items_by_ids(app_id, [doc['item_id'] for doc in docs], since, bulk_hydration_max_pages)
+        queue_stats['fetches'] += pages
+        queue_stats['fetches_saved'] += max(len(hydrated) - pages, 0)
+        print(f'Hydrated {len(hydrated)}/{len(docs)} items of app {app_id} in {pages} requests.')
+    except Exception as e:
+        hydrated = {}
+        print(f'Bulk hydration failed for app {app_id}, fetching items one by one.\n{e}')
+    found = [(doc, hydrated[str(doc['item_id'])]) for doc in docs if str(doc['item_id']) in hydrated]
+    missing = [doc for doc in docs if str(doc['item_id']) not in hydrated]
+    if found:
         try:
-            oldest_doc = collection.find_one(sort=[('timestamp', ASCENDING)])
-            print(f'Item {oldest_doc['item_id']} found in to_do_queue')
-            await process_event(oldest_doc, count)
-        except TypeError as e:
-            print('NoneType pulled from Mongo.  Sleeping')
-            await asyncio.sleep(10)
-    
+            await complete_item_events(db, found)
+        except Exception as e:
+            for doc, item_vals in found:
+                print(await fail_event(db, doc, e))
+    await asyncio.gather(*[process_event(podio, db, doc) for doc in missing])
+
+def hydration_window_start():
+    return datetime.now(timezone.utc) - timedelta(seconds=bulk_hydration_max_window_seconds)
+
+def hydratable(doc: dict, oldest):
+    """
+    True if a claimed event can join its app's bulk hydration group.
+    """
+    return (bulk_hydration and doc.get('app_id') and doc.get('first_seen') and doc['type'] in item_event_types
+            and doc['first_seen'].replace(tzinfo=timezone.utc) >= oldest)
+
+def group_for_hydration(docs: list):
+    """
+    Splits claimed events into { app_id: [docs] } groups for bulk hydration and a list of singles.
+    Events first seen more than bulk_hydration_max_window_seconds ago are always singles.
+    """
+    by_app = {}
+    singles = []
+    oldest = hydration_window_start()
+    for doc in docs:
+        if hydratable(doc, oldest):
+            by_app.setdefault(doc['app_id'], []).append(doc)
+        else:
+            singles.append(doc)
+    groups = {}
+    for app_id, app_docs in by_app.items():
+        if len(app_docs) >= bulk_hydration_min_items:
+            groups[app_id] = app_docs
+        else:
+            singles.extend(app_docs)
+    return groups, singles
+
+def shard_filter(shards):
+    return [] if shards is None else [{'shard': {'$in': list(shards)}}]
+
+def claimable_filter(now, shards=None, match=None):
+    """
+    The filter for events (of `shards`, matching `match`) that are neither leased nor debounced at `now`.
+    """
+    return {'$and': [
+        *shard_filter(shards),
+        *([match] if match else []),
+        {'$or': [{'lease_until': None}, {'lease_until': {'$lt': now}}]},
+        {'$or': [{'not_before': None}, {'not_before': {'$lte': now}}]}
+    ]}
+
+async def claim_events(collection, limit: int, shards=None, match=None):
+    """
+    Atomically leases up to `limit` of the oldest unleased events in 'to_do_event_queue'.
+    - Each claim is a find_one_and_update, so concurrent workers never receive the same event.
+    - With `shards`, only events of those shards are claimed; with `match`, only events matching that filter.
+    - Leases expire after lease_seconds, making events from crashed workers visible again.
+    - Oldest means by datetime timestamp, with the ObjectId breaking ties in insertion order.
+    """
+    claimed = []
+    while len(claimed) < limit:
+        now = datetime.now(timezone.utc)
+        with timed(MONGO_SECONDS, operation=f'claim_{collection.name}'):
+            doc = await collection.find_one_and_update(
+                claimable_filter(now, shards, match),
+                {'$set': {'lease_until': now + timedelta(seconds=lease_seconds), 'leased_by': worker_id}},
+                sort=[('timestamp', ASCENDING), ('_id', ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+        if doc is None:
+            break
+        claimed.append(doc)
+    return claimed
+
+async def claim_app_batches(collection, docs: list, shards=None):
+    """
+    Tops up bulk hydration groups: for each app among the claimed `docs` with hydratable events, claims more
+    of that app's hydratable events, up to claim_batch_size per app.
+    - An app is only topped up if it has at least bulk_hydration_min_items hydratable events, claimed plus
+      claimable, so no events are leased just to be released again.
+    Returns the extra events claimed.
+    """
+    oldest = hydration_window_start()
+    claimed = {}
+    for doc in docs:
+        if hydratable(doc, oldest):
+            claimed[doc['app_id']] = claimed.get(doc['app_id'], 0) + 1
+    extra = []
+    for app_id, count in claimed.items():
+        if count >= claim_batch_size:
+            continue
+        match = {'app_id': app_id, 'type': {'$in': item_event_types}, 'first_seen': {'$gte': oldest}}
+        if count < bulk_hydration_min_items:
+            pending = await collection.count_documents(
+                claimable_filter(datetime.now(timezone.utc), shards, match),
+                limit=bulk_hydration_min_items - count
+            )
+            if count + pending < bulk_hydration_min_items:
+                continue
+        extra += await claim_events(collection, claim_batch_size - count, shards, match)
+    return extra
+
+async def claim_tasks(collection, capacity: int, shards):
+    """
+    Claims work for up to `capacity` free worker slots and returns it as a list of (app_id, docs) tasks:
+    one per bulk hydration group (app_id set) and one per single event (app_id None).
+    - One event is claimed per free slot; with bulk_hydration, apps with enough pending events are topped up
+      to a full group by claim_app_batches.
+    - Events that do not fit the free slots (an app group that came up short after a concurrent claim)
+      are released.
+    """
+    if capacity <= 0 or not shards:
+        return []
+    docs = await claim_events(collection, min(capacity, claim_batch_size), shards)
+    if bulk_hydration and docs:
+        docs += await claim_app_batches(collection, docs, shards)
+    groups, singles = group_for_hydration(docs)
+    tasks = [(app_id, app_docs) for app_id, app_docs in groups.items()] + [(None, [doc]) for doc in singles]
+    overflow = [doc for app_id, task_docs in tasks[capacity:] for doc in task_docs]
+    if overflow:
+        await release_events(collection, overflow)
+    return tasks[:capacity]
+
+async def release_events(collection, docs: list):
+    """
+    Gives up this worker's leases on claimed events it will not process now, so they can be claimed again.
+    """
+    await collection.update_many(
+        {'_id': {'$in': [doc['_id'] for doc in docs]}, 'leased_by': worker_id},
+        {'$unset': {'lease_until': '', 'leased_by': ''}}
+    )
+
+async def seconds_until_next_event(collection, shards=None):
+    """
+    Returns how long until the earliest debounced event (of `shards`, if given) becomes claimable (None if there is none).
+    """
+    doc = await collection.find_one(
+        {'$and': [*shard_filter(shards), {'lease_until': None, 'not_before': {'$ne': None}}]},
+        sort=[('not_before', ASCENDING)],
+        projection={'not_before': 1}
+    )
+    if doc is None:
+        return None
+    not_before = doc['not_before'].replace(tzinfo=timezone.utc)
+    return max((not_before - datetime.now(timezone.utc)).total_seconds(), 0)
+
+async def watch_queue_inserts():
+    """
+    Tails 'to_do_event_queue' inserts with a change stream and wakes the worker for each one.
+    - Change streams need a replica set, so standalone servers fall back to polling.
+    """
+    try:
+        async with await mongo_db.to_do_event_queue.watch([{'$match': {'operationType': 'insert'}}]) as stream:
+            async for change in stream:
+                queue_notifier.set()
+    except OperationFailure as e:
+        print(f'Change stream unavailable, falling back to polling every {idle_poll_seconds}s.\n{e}')
+
+async def complete_to_do_event_queue_docs(credential_pool):
+    """
+    Processes events from 'to_do_event_queue' in MongoDB with a pool of concurrent tasks.
+    - Claims events for free slots with claim_tasks and keeps up to worker_concurrency tasks in flight.
+    - Sleeps only while the queue is empty, waking on queue_notifier (in-process inserts or the
+      change stream) or after idle_poll_seconds at the latest.
+    - Podio requests are spread over credential_pool, waiting asynchronously when all credentials are exhausted.
+    - Only events of the shards this worker leases from shard_coordinator are claimed.
+    """
+    podio = await create_podio_client()
+
+    db = mongo_db
+    collection = db.to_do_event_queue
+    in_flight = set()
+    while True:
+        queue_notifier.clear()
+        shards = sorted(shard_coordinator.owned)
+        tasks = await claim_tasks(collection, worker_concurrency - len(in_flight), shards)
+        for app_id, task_docs in tasks:
+            if app_id is not None:
+                print(f'{len(task_docs)} items of app {app_id} claimed from to_do_queue')
+                in_flight.add(asyncio.create_task(process_event_batch(podio, db, app_id, task_docs)))
+            else:
+                print(f'Item {task_docs[0].get('item_id')} claimed from to_do_queue')
+                in_flight.add(asyncio.create_task(process_event(podio, db, task_docs[0])))
+        if tasks and len(in_flight) < worker_concurrency:
+            continue
+
+        # Pool is full or queue is empty: wait for a free slot or a new event.
+        waiters = set(in_flight)
+        notified = None
+        timeout = idle_poll_seconds
+        if not tasks:
+            notified = asyncio.create_task(queue_notifier.wait())
+            waiters.add(notified)
+            next_event = await seconds_until_next_event(collection, shards) if shards else None
+            if next_event is not None:
+                timeout = min(timeout, next_event)
+        done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if notified is not None and notified in pending:
+            notified.cancel()
+        in_flight -= done
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Exposes PodioMetrics in the Prometheus text format, measuring queue depth and oldest event age on each scrape.
+    """
+    for queue in ('to_do_event_queue', 'schema_refresh_queue', 'dead_letter_queue'):
+        QUEUE_DEPTH.set(await mongo_db[queue].estimated_document_count(), queue=queue)
+    oldest = await mongo_db.to_do_event_queue.find_one({}, sort=[('timestamp', ASCENDING), ('_id', ASCENDING)], projection={'timestamp': 1})
+    age = (datetime.now(timezone.utc) - oldest['timestamp'].replace(tzinfo=timezone.utc)).total_seconds() if oldest else 0
+    QUEUE_OLDEST_AGE.set(age, queue='to_do_event_queue')
+    return PodioMetrics.render()
+
+@app.get("/queue/stats")
+async def queue_stats_report():
+    """
+    Reports queue depth and how many Podio fetches event coalescing has saved.
+    """
+    pending = await mongo_db.to_do_event_queue.count_documents({})
+    return {
+        **queue_stats,
+        'pending_events': pending,
+        'dead_letter_events': await mongo_db.dead_letter_queue.estimated_document_count(),
+        'ingest': {**ingest_buffer.stats, 'buffered_now': len(ingest_buffer)},
+        'credentials': credential_pool.status()
+    }
+
 @app.post("/item/update")
 @app.get("/item/update")
 async def item_update(request: Request):
     """
     Handles Podio item update events.
-    - Adds 'item.update' events to the queue.
+    - Buffers item events for the queue (ingest_event) and returns without waiting on MongoDB.
+    - Records the app_id from the hook URL query string ('/item/update?app_id=<id>') for bulk hydration.
+    - Rejects (400) item events with a non-numeric item_id or a type other than item_event_types, which the
+      queue worker could only dead-letter.
     - Verifies webhooks if required.
     """
 
     form_data = await request.form()
     data = {key: value for key, value in form_data.items()}
+    if 'item_id' in data.keys():
+        if not (data['item_id'].isascii() and data['item_id'].isdigit()) or data.get('type') not in item_event_types:
+            print(f'Rejected item event {data.get('type')!r} for item_id {data['item_id']!r} on {request.url.path}.')
+            return PlainTextResponse('Expected a numeric item_id and an item event type.', status_code=400)
+        data['item_id'] = str(int(data['item_id']))
+    if 'app_id' in request.query_params and 'item_id' in data.keys():
+        app_id = request.query_params['app_id']
+        if app_id.isascii() and app_id.isdigit():
+            data['app_id'] = str(int(app_id))
+        else:
+            print(f'Ignoring non-numeric app_id {app_id!r} on {request.url.path}.')
 
     if 'item_id' in data.keys():
-        await to_do_event_queue_add(data, failed_attempts=0)
+        await ingest_event(data)
 
     elif 'hook_id' in data.keys():
         status_code = await verify_hook(data)
@@ -233,41 +929,148 @@ async def item_update(request: Request):
     
 #     return {'status': 'item.delete processed'}
 
-# /app/create route
-
+# /app/create and /app/update routes
 @app.post("/app/create")
 @app.get("/app/create")
-async def item_delete(request: Request):
-    data = await request.form()
-    data_dict = {str(key): value for key, value in data.items()}
-    
-    if 'app_id' in data_dict.keys():
-        await to_do_event_queue_add(data, failed_attempts=0)
-
-    elif 'hook_id' in data_dict.keys():
-        status_code = await verify_hook(data_dict['hook_id'])
-        return {'status': 'Webhook verified for item.delete', 'code': status_code}
-    
-    return {'status': 'app.create processed'}
-
-# /app/update route
 @app.post("/app/update")
 @app.get("/app/update")
-async def item_delete(request: Request):
-    data = await request.form()
-    data_dict = {str(key): value for key, value in data.items()}
-    
-    if 'app_id' in data_dict.keys():
-        await to_do_event_queue_add(data, failed_attempts=0)
+async def app_event(request: Request):
+    """
+    Handles Podio app.create and app.update events.
+    - Queues a debounced schema refresh for the app (schema_refresh_add).
+    - Verifies webhooks if required.
+    """
+    form_data = await request.form()
+    data = {str(key): value for key, value in form_data.items()}
+
+    if 'app_id' in data.keys():
+        await schema_refresh_add(data)
+
+    elif 'hook_id' in data.keys():
+        status_code = await verify_hook(data)
+        return {'status': f'Webhook verified for {request.url.path}', 'code': status_code}
+
+    return {'status': f'{data.get('type', request.url.path)} processed'}
+
+async def run_incremental_sync():
+    """
+    Runs PodioSyncEngine over sync_app_ids every sync_interval_seconds.
+    """
+    podio = await create_podio_client()
+    engine = PodioSyncEngine(podio, mongo_db, overlap_seconds=sync_overlap_seconds, history=item_history)
+    while True:
+        await engine.run(sync_app_ids)
+        await asyncio.sleep(sync_interval_seconds)
+
+async def refresh_schema_snapshots():
+    """
+    Records app schema changes every schema_refresh_interval_seconds and prints each app's diff.
+    """
+    podio = await create_podio_client()
+    snapshots = SchemaSnapshots(mongo_db)
+    while True:
+        try:
+            changes = await snapshots.refresh(podio)
+            for change in changes:
+                print(f'Schema v{change['version']} of {change['space_name']}/{change['app_name']}: {change['diff']}')
+            print(f'Schema refresh done, {len(changes)} apps changed.')
+        except (httpx.HTTPError, OperationFailure) as e:
+            print(f'Schema refresh failed.\n{e}')
+        await asyncio.sleep(schema_refresh_interval_seconds)
 
-    elif 'hook_id' in data_dict.keys():
-        status_code = await verify_hook(data_dict['hook_id'])
-        return {'status': 'Webhook verified for app.delete', 'code': status_code}
-    return {'status': 'app.delete processed'}
+async def backfill_event_shards():
+    """
+    Gives queue events written before sharding (or by an older worker) their shard.
+    """
+    collection = mongo_db.to_do_event_queue
+    while True:
+        try:
+            if await assign_missing_shards(collection, queue_shards):
+                queue_notifier.set()
+        except Exception as e:
+            print(f'Shard backfill failed, resuming in {idle_poll_seconds}s.\n{e}')
+        await asyncio.sleep(idle_poll_seconds)
+
+async def run_sql_export():
+    """
+    Streams podio_items changes into the AdHoc server tables, restarting the exporter after failures.
+    """
+    while True:
+        exporter = SqlExporter(mongo_db, sql_export_connect, sql_export_dialect, typed=typed_item_values, history=item_history)
+        try:
+            await exporter.run()
+        except Exception as e:
+            print(f'SQL export failed, resuming in {idle_poll_seconds}s.\n{e}')
+        finally:
+            await exporter.close()
+        await asyncio.sleep(idle_poll_seconds)
+
+async def run_parquet_export():
+    """
+    Appends a Parquet partition per app every parquet_export_interval_seconds.
+    """
+    exporter = ParquetExporter(mongo_db, parquet_export_path, typed=typed_item_values, history=item_history,
+                               overlap_seconds=sync_overlap_seconds)
+    snapshots = SchemaSnapshots(mongo_db)
+    try:
+        while True:
+            try:
+                app_ids = sync_app_ids or list(await snapshots.latest_all())
+                report = await exporter.export_apps(app_ids)
+                print(f'Parquet export done: {sum(count or 0 for count in report.values())} items from {len(report)} apps.')
+            except Exception as e:
+                print(f'Parquet export failed, resuming in {idle_poll_seconds}s.\n{e}')
+                await asyncio.sleep(idle_poll_seconds)
+                continue
+            await asyncio.sleep(parquet_export_interval_seconds)
+    finally:
+        exporter.close()
 
 @app.on_event('startup')
 async def start_sync():
-    asyncio.create_task(complete_to_do_event_queue_docs(count=0, secret_no=1, podio_creds=podio_creds))
+    global http_client, mongo_client, mongo_db, mongo_transactions, ingest_buffer, shard_coordinator
+    http_client = fs.create_async_client(podio_max_connections, podio_max_keepalive_connections)
+    mongo_client = AsyncMongoClient(
+        mongo_connection_string,
+        maxPoolSize=mongo_max_pool_size,
+        minPoolSize=mongo_min_pool_size,
+        maxIdleTimeMS=mongo_max_idle_time_ms
+    )
+    mongo_db = mongo_client[mongo_database]
+    hello = await mongo_client.admin.command('hello')
+    if mongo_transactions and 'setName' not in hello:
+        print('MongoDB is not a replica set; per-event writes will run without a transaction.')
+        mongo_transactions = False
+    await MongoMigrations.run_migrations(mongo_db)
+    root, extension = os.path.splitext(ingest_spill_path)
+    ingest_buffer = IngestBuffer(to_do_event_queue_add_many, ingest_buffer_size, ingest_batch_size,
+                                 ingest_flush_interval_seconds, worker_path(ingest_spill_path),
+                                 adopt_spills=f'{glob.escape(root)}*{extension}')
+    ingest_buffer.start()
+    shard_coordinator = ShardCoordinator(mongo_db, worker_id, queue_shards, credential_pool,
+                                         shard_lease_seconds, shard_heartbeat_seconds)
+    shard_coordinator.leader_job(refresh_app_schemas)
+    shard_coordinator.leader_job(backfill_event_shards)
+    if sync_app_ids:
+        shard_coordinator.leader_job(run_incremental_sync)
+    if schema_refresh_interval_seconds:
+        shard_coordinator.leader_job(refresh_schema_snapshots)
+    if sql_export_connect:
+        shard_coordinator.leader_job(run_sql_export)
+    if parquet_export_path:
+        shard_coordinator.leader_job(run_parquet_export)
+    await shard_coordinator.start()
+    asyncio.create_task(shard_coordinator.run())
+    asyncio.create_task(complete_to_do_event_queue_docs(credential_pool))
+    if use_change_stream:
+        asyncio.create_task(watch_queue_inserts())
+
+@app.on_event('shutdown')
+async def stop_sync():
+    await ingest_buffer.close()
+    await shard_coordinator.stop()
+    await http_client.aclose()
+    await mongo_client.close()
 
 
 if __name__ == "__main__":
@@ -1,19 +1,35 @@
-import logging, requests
-import pandas as pd
-import sys, time, json, re
-from dateutil.parser import parse
+import logging, requests, httpx
+import sys, time, json, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from PodioTokenCache import TokenCache
+from PodioItemCleaner import ItemCleaner
+import PodioMetrics
 
 logging.basicConfig(level=logging.ERROR)
 
+class PodioAPIError(Exception):
+    '''
+    Raised when Podio answers a request with an error that waiting or re-authenticating cannot fix.
+    '''
+    def __init__(self, status_code, response):
+        self.status_code = status_code
+        self.response = response
+        super().__init__(f'Podio API error {status_code}: {response}')
+
 class PodioAPI:
     '''
     A wrapper for the Podio API, allowing interaction with Podio to retrieve and process data.
 
     1. Fetches Podio data structure information (recommended twice daily) to update MongoDB if fields are added, deleted, or renamed.
     2. Retrieves actual data from Podio, processes it, and extracts field labels and values before inserting them into MongoDB.
+
+    Pass a CredentialPool to spread rate-limited calls over several client_ids; the given credentials are then
+    only used until the pool picks one. Pass a shared TokenCache to reuse (and persist) tokens across instances.
+    With typed_values=True items are cleaned to native values keyed by field_id (see ItemCleaner).
     '''
-    def __init__(self, base_url, org_id, username, password, client_id, client_secret):
+    def __init__(self, base_url, org_id, username, password, client_id, client_secret, credential_pool=None, token_cache=None,
+                 typed_values=False):
         self.api_count = 0
         self.data_size = 0
         self.base_url = base_url
@@ -23,82 +39,83 @@ class PodioAPI:
         self.password = password
         self.client_id = client_id
         self.client_secret = client_secret
+        self.credential_pool = credential_pool
+        self.credential = None
+        self.token_cache = token_cache or TokenCache(base_url)
+        self.item_cleaner = ItemCleaner(typed_values)
+        self.access_token = self.get_access_token()
+
+    def use_credential(self, credential):
+        '''
+        Switches to a credential from the pool, reusing its cached access token.
+        '''
+        self.credential = credential
+        self.username = credential.username
+        self.password = credential.password
+        self.client_id = credential.client_id
+        self.client_secret = credential.client_secret
         self.access_token = self.get_access_token()
-        
+
+    def acquire(self, kind):
+        '''
+        Blocks until the credential pool has budget for one `kind` request and switches to that credential.
+        Without a pool, makes sure the current access token has not expired.
+        '''
+        if self.credential_pool:
+            self.use_credential(self.credential_pool.acquire_sync(kind))
+        else:
+            self.access_token = self.get_access_token()
+
+    def observe(self, kind, response):
+        '''
+        Reports a response's rate limit headers/status back to the credential pool.
+        '''
+        if self.credential_pool and self.credential:
+            self.credential_pool.observe(self.credential, kind, response.status_code, response.headers)
+
     def get_access_token(self):
         '''
         Retrieves an authentication token from Podio to allow API interactions.
+        Served from the token cache until it is about to expire, then refreshed.
         '''
-        auth_url = self.base_url + 'oauth/token'
-        response = requests.post(auth_url, data={
-            'grant_type': 'password',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'username': self.username,
-            'password': self.password
-        })
-        self.api_count += 1
-        if response.status_code == 200:
+        return self.token_cache.get_token_sync(self)
+
+    def request(self, method, url, kind='standard', **kwargs):
+        '''
+        Sends an authenticated request after acquire(kind), reporting the response back with observe(kind).
+        A 401 invalidates the cached token and the request is retried once with a fresh one.
+        Extra `headers` are sent alongside the Authorization header. Latency and status are recorded in PodioMetrics.
+        '''
+        self.acquire(kind)
+        extra_headers = kwargs.pop('headers', {})
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {self.access_token}',
+                'Content-Type': 'application/json',
+                **extra_headers
+            }
+            with PodioMetrics.timed(PodioMetrics.PODIO_REQUEST_SECONDS, method=method, endpoint=PodioMetrics.endpoint_name(url)):
+                response = requests.request(method, url, headers=headers, **kwargs)
+            PodioMetrics.PODIO_REQUESTS.inc(client_id=self.client_id, status=response.status_code)
+            self.api_count += 1
             self.data_size += len(response.content)
-            return response.json().get('access_token')
+            if response.status_code != 401:
+                break
+            self.token_cache.invalidate(self.client_id)
+            self.access_token = self.get_access_token()
+        self.observe(kind, response)
+        return response
 
     def clean_item(self, item):
         '''
         Cleans and processes actual data retrieved from Podio. This differs from cleaning data structure metadata. Converts various field types to readable formats.
+        Uses one precompiled converter per field (see PodioItemCleaner), built from the app schema once get_app_fields_data has run.
+        With typed_values=True returns the compact { field_id: native_value } layout instead.
         '''
-        if not item:
-            return None
-        item_dict = {}
-        for field in item['fields']:
-            field_dict = {}
-            field_id = field['field_id']
-            field_label = field['label']
-            values = field['values']
-            field_type = field['type']
-            field_external_id = field['external_id']
-            match field_type:
-                case 'date':
-                    value = ','.join([value['start'] for value in values])
-                case 'contact':
-                    value = ','.join([value['value']['name'] for value in values])
-                case 'text':
-                    value = ','.join([re.sub(r'<.*?>','',(value['value'])) for value in values])
-                case 'category':
-                    value = ','.join([value['value']['text'] for value in values])
-                case 'app':
-                    value = ','.join([str(value['value']['item_id']) for value in values])
-                case 'phone' | 'email' | 'number' | 'location':
-                    value = ','.join([value['value'] for value in values])
-                case 'calculation':
-                    if 'start' in values[0].keys():
-                        value = ','.join([value['start'] for value in values])
-                    else:
-                        try:
-                            value = [parse(value['value']).strftime('%Y-%m-%d') for value in values]
-                            value = ','.join(value)
-                        except:
-                            value = [value['value'] for value in values]
-                            float_values = []
-                            for v in value:
-                                try:
-                                    float_values.append(float(v))
-                                except ValueError:
-                                    float_values.append(v)
-
-                            value = float_values[0]
-                case 'money':
-                    value = float(values[0]['value'])
-                case _:
-                    skip = 1
-                    print('skipped')
-                    pass # Error logic to send email to CRM Admin for fix
-            field_dict = {
-                'field_id': field_id,
-                'field_label': field_label,
-                'field_type': field_type,
-                'field_value': value
-            }
-            item_dict[str(field_id)] = field_dict
+        start = time.perf_counter()
+        item_dict = self.item_cleaner.clean_item(item)
+        PodioMetrics.ITEM_CLEAN_SECONDS.inc(time.perf_counter() - start)
+        PodioMetrics.ITEMS_CLEANED.inc()
         return item_dict
 
     def get_filtered_items(self, app_id, filters):
@@ -107,64 +124,90 @@ class PodioAPI:
 
         Rate limits: Podio allows only ~15 consecutive API calls per minute (250 per hour).
         Implements offset-based pagination to retrieve all matching items (up to 500 per call).
-        Can switch API tokens to bypass rate limits or introduce delays.
-        Returns a dictionary formatted as { item_id: { field_label: field_value } }.
+        With a credential pool each page is sent with the credential that has the most budget left; without one,
+        a rate limit response sleeps for 5 minutes.
+        Returns a dictionary formatted as { item_id: { field_label: field_value } }, or None on failure.
+        Use iter_filtered_items to stream large apps instead of holding every item in memory.
+        '''
+        try:
+            return dict(self.iter_filtered_items(app_id, filters))
+        except PodioAPIError:
+            return None
+
+    def iter_filtered_items(self, app_id, filters, pages=False, max_pages=None, prefetch=True):
+        '''
+        Streams filtered items as (item_id, cleaned_item) pairs, or one { item_id: cleaned_item } dict per page with pages=True.
+
+        The next page is fetched on a background thread while the caller cleans/stores the current one, so peak
+        memory stays around two pages regardless of app size. Raises PodioAPIError if a page cannot be fetched.
+        Stops after `max_pages` pages (default: all). With prefetch=False each page is only requested once the
+        caller asks for it, for callers that may stop early and should not spend a request on an unread page.
         '''
         self.formatted_app_id = str(app_id)
-        # if not self.access_token:
-        #     logging.error("Getting new access token")
-        #     self.access_token = self.get_access_token()
+        filters = dict(filters)
+        limited = 'limit' in filters.keys()
+        limit = filters.pop('limit', 500)  # Default limit to 500 if not included in filter
+        offset = 0
+        fetched = 0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = None
+            while True:
+                items = next_page.result() if next_page else self.fetch_filtered_page(app_id, filters, limit, offset)
+                fetched += 1
+                offset += len(items)
+                # Stop if the number of items is less than the limit (all items gathered), if response is limited
+                # or once max_pages pages were read
+                more = len(items) == limit and not limited and (max_pages is None or fetched < max_pages)
+                next_page = executor.submit(self.fetch_filtered_page, app_id, filters, limit, offset) if more and prefetch else None
+                page = {item['item_id']: self.clean_item(item) for item in items}
+                del items
+                if pages:
+                    yield page
+                else:
+                    yield from page.items()
+                if not more:
+                    return
 
+    def fetch_filtered_page(self, app_id, filters, limit, offset):
+        '''
+        Fetches one raw page of filtered items, waiting out rate limits and re-authenticating once on a 401.
+        '''
         headers = {
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/json'
         }
         url = f'{self.base_url}item/app/{app_id}/filter/'
-        limited = 'limit' in filters.keys()
-        limit = filters.pop('limit', 500)  # Default limit to 500 if not included in filter
-        offset = 0
-
-        all_items = {}
-        count = 1
+        retried_auth = False
         while True:
+            self.acquire('rate_limited')
+            headers['Authorization'] = f'Bearer {self.access_token}'
             response = requests.post(url, headers=headers, json={'filters': filters, 'limit': limit, 'offset': offset})
             self.data_size += len(response.content)
+            self.observe('rate_limited', response)
+
+            if response.status_code == 401 and not retried_auth:  # Token revoked or expired early: re-authenticate once.
+                self.token_cache.invalidate(self.client_id)
+                retried_auth = True
+                continue
 
             if response.status_code == 200:
                 self.api_count += 1
-                items = response.json()['items']
-                if len(items) > 0 :
-                    for item in items:
-                        item_dict = self.clean_item(item)
-                        all_items[item['item_id']] = item_dict
-                    offset += len(items)
-                else:
-                    items = []
-
-                # Break if the number of items is less than the limit (all items gathered) or if response is limited
-                if len(items) < limit or limited:
-                    return all_items
-
-            elif response.json()['error'] == 'rate_limit':  # Rate limit exceeded.  Can be passed by waiting 5 min.
-                if count <= 4:
-                    self.secret_level = (self.secret_level + 1) % 4
-                    self.client_id = self.secrets[self.secret_level]['client_id']
-                    self.client_secret = self.secrets[self.secret_level]['client_secret']
-                    self.access_token = self.get_access_token()
-                    count += 1
-                else:
-                    print('Rate limit exceeded.  Sleeping for 300 seconds.')
-                    number = 0
-                    while number <= 300:
-                        sys.stdout.write(f'\r{number}/300')
-                        time.sleep(1)
-                        sys.stdout.flush()
-                        number += 1
-                    count = 1
+                return response.json()['items']
+
+            elif response.json().get('error') == 'rate_limit':  # Rate limit exceeded.  Can be passed by waiting 5 min.
+                if self.credential_pool:
+                    continue  # observe() drained this credential; acquire() moves to the next one or waits.
+                print('Rate limit exceeded.  Sleeping for 300 seconds.')
+                number = 0
+                while number <= 300:
+                    sys.stdout.write(f'\r{number}/300')
+                    time.sleep(1)
+                    sys.stdout.flush()
+                    number += 1
             else:
                 logging.error(f"Failed to retrieve items: {response.json()}\n"
                             f"PARAMETERS\nFILTERS: {filters}\nLIMIT: {limit}\nOFFSET: {offset}\nRESPONSE: {response.json()}") # For troubleshooting.  Will want email notification on failure as well as logs.
-                return None
+                raise PodioAPIError(response.status_code, response.json())
 
     def get_org(self):
         '''
@@ -172,14 +215,7 @@ class PodioAPI:
 
         Low resource usage: Up to 1000 API calls per hour with no per-minute rate limits.
         '''
-        url = f'{self.base_url}org/{self.org_id}/all_spaces'
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        response = requests.get(url, headers=headers)
-        self.data_size += len(response.content)
-        self.api_count += 1
+        response = self.request('GET', f'{self.base_url}org/{self.org_id}/all_spaces')
         return response.json()
 
     def get_apps_in_space(self, space_id):
@@ -187,17 +223,17 @@ class PodioAPI:
         Low resource usage: Up to 1000 API calls per hour.
         Returns a list of tuples (space_app_id, app_name).
         '''
-        url = self.base_url + f'app/space/{space_id}/'
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        space_response = requests.get(url, headers=headers)
-        self.api_count += 1
-        apps = space_response.json()
+        space_response = self.request('GET', self.base_url + f'app/space/{space_id}/')
+        return self.parse_apps_in_space(space_response.status_code, space_response.json())
+
+    @staticmethod
+    def parse_apps_in_space(status_code, apps):
+        '''
+        Converts an app/space response into a list of tuples (space_app_id, app_name).
+        '''
         data = []
         for app in apps:
-            if space_response.status_code == 200:
+            if status_code == 200:
                 space_app_id = str(app['space_id']) + '.' + str(app['app_id'])
                 app_name = app['config']['name']
                 tuple = (space_app_id, app_name)
@@ -211,16 +247,18 @@ class PodioAPI:
         Low resource usage: Up to 1000 API calls per hour.
         Returns a dictionary { field_id: { field_label, field_type, return_type, hidden } }.
         '''
-        url = self.base_url + f'app/{app_id}'
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        response = requests.get(url, headers=headers)
-        self.data_size += len(response.content)
-        self.api_count += 1
-        if 'fields' in response.json().keys():
-            fields = response.json()['fields']
+        response = self.request('GET', self.base_url + f'app/{app_id}')
+        fields_info = self.parse_app_fields(response.json())
+        self.item_cleaner.load_schema(fields_info)
+        return fields_info
+
+    @staticmethod
+    def parse_app_fields(app):
+        '''
+        Converts an app response into { field_id: { field_label, field_type, return_type, hidden } }.
+        '''
+        if 'fields' in app.keys():
+            fields = app['fields']
             fields_info = {}
             for field in fields:
                 field_hidden = field['config']['hidden']
@@ -275,17 +313,7 @@ class PodioAPI:
         Implements token rotation and optional delays to bypass limits.
         Returns { field_label: field_value } after processing.
         '''
-        if not self.access_token:
-            self.access_token = self.get_access_token()
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        url = f'{self.base_url}item/{item_id}/value'
-        
-        response = requests.get(url, headers=headers)
+        response = self.request('GET', f'{self.base_url}item/{item_id}/value', kind='rate_limited')
         item = {'fields': response.json()}
         if response.status_code == 200:
             return {'item_id': item_id, 'data': self.clean_item(item)}
@@ -300,17 +328,315 @@ class PodioAPI:
         Requires url, ref_type, ref_id, and event_type.
         Returns the webhook creation response.
         '''
-        # self.access_token = self.get_app_access_token()
         data = {
             'ref_type': ref_type,
             'ref_id': ref_id,
             'type': event_type,
             'url': url
         }
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
+        response = self.request('POST', f'{self.base_url}hook/{ref_type}/{ref_id}/', json=data)
+        return response.json()
+
+
+def create_async_client(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0, http2=True, timeout=30.0):
+    '''
+    Builds a pooled httpx.AsyncClient suitable for sharing between AsyncPodioAPI instances.
+
+    Keep-alive connections are reused across calls so repeated requests skip the TCP/TLS handshake.
+    HTTP/2 requires the `h2` package (`pip install httpx[http2]`).
+    '''
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry
+    )
+    return httpx.AsyncClient(limits=limits, http2=http2, timeout=timeout)
+
+
+class AsyncPodioAPI(PodioAPI):
+    '''
+    Asynchronous version of PodioAPI for use inside the FastAPI event loop.
+
+    All requests go through one pooled httpx.AsyncClient (pass `client` to share a pool between instances)
+    and at most `max_concurrency` requests are in flight per instance. The access token is fetched lazily
+    on the first call instead of in __init__. Every PodioAPI method is available as a coroutine.
+    With a CredentialPool every request waits (without blocking the loop) for the credential with the most budget.
+    '''
+    def __init__(self, base_url, org_id, username, password, client_id, client_secret, client=None,
+                 max_concurrency=10, max_connections=20, max_keepalive_connections=10, http2=True, credential_pool=None,
+                 token_cache=None, typed_values=False):
+        self.api_count = 0
+        self.data_size = 0
+        self.base_url = base_url
+        self.org_id = org_id
+        self.secret_level = 1
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.access_token = None
+        self.credential_pool = credential_pool
+        self.token_cache = token_cache or TokenCache(base_url)
+        self.item_cleaner = ItemCleaner(typed_values)
+        self.app_etags = {}
+        self.owns_client = client is None
+        self.client = client or create_async_client(max_connections, max_keepalive_connections, http2=http2)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    def from_pool(cls, base_url, org_id, credential_pool, **kwargs):
+        '''
+        Builds a client that schedules every request through `credential_pool`.
+        '''
+        credential = credential_pool.credentials[0]
+        return cls(base_url, org_id, credential.username, credential.password, credential.client_id,
+                   credential.client_secret, credential_pool=credential_pool, **kwargs)
+
+    async def aclose(self):
+        '''
+        Closes the underlying HTTP client if this instance created it.
+        '''
+        if self.owns_client:
+            await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def get_access_token(self, credential=None):
+        '''
+        Retrieves an authentication token from Podio to allow API interactions.
+        Uses this instance's credentials unless a pool credential is given; served from the token cache
+        until it is about to expire.
+        '''
+        async with self.semaphore:
+            return await self.token_cache.get_token(self.client, credential or self)
+
+    async def request(self, method, url, kind='standard', **kwargs):
+        '''
+        Sends an authenticated request through the shared client, respecting the concurrency limit.
+        `kind` selects the rate limit class charged in the credential pool ('rate_limited' or 'standard').
+        A 401 invalidates the cached token and the request is retried once with a fresh one.
+        Extra `headers` are sent alongside the Authorization header. Latency and status are recorded in PodioMetrics.
+        '''
+        credential = await self.credential_pool.acquire(kind) if self.credential_pool else self
+        extra_headers = kwargs.pop('headers', {})
+        for attempt in range(2):
+            access_token = await self.get_access_token(credential)
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json',
+                **extra_headers
+            }
+            async with self.semaphore:
+                with PodioMetrics.timed(PodioMetrics.PODIO_REQUEST_SECONDS, method=method, endpoint=PodioMetrics.endpoint_name(url)):
+                    response = await self.client.request(method, url, headers=headers, **kwargs)
+            PodioMetrics.PODIO_REQUESTS.inc(client_id=credential.client_id, status=response.status_code)
+            self.api_count += 1
+            self.data_size += len(response.content)
+            if response.status_code != 401:
+                break
+            self.token_cache.invalidate(credential.client_id)
+        if self.credential_pool:
+            self.credential_pool.observe(credential, kind, response.status_code, response.headers)
+        return response
+
+    async def get_filtered_items(self, app_id, filters):
+        '''
+        Fetches filtered items from Podio based on given filter parameters.
+
+        Same pagination and return format as PodioAPI.get_filtered_items. When rate limited the
+        credential pool moves to another credential; without a pool the coroutine waits 300 seconds
+        with asyncio.sleep so other tasks keep running.
+        '''
+        try:
+            return {item_id: item_dict async for item_id, item_dict in self.iter_filtered_items(app_id, filters)}
+        except PodioAPIError:
+            return None
+
+    async def iter_filtered_items(self, app_id, filters, pages=False, max_pages=None, prefetch=True):
+        '''
+        Async generator version of PodioAPI.iter_filtered_items.
+
+        The next page request runs as a task while the caller awaits its own work (e.g. Mongo writes) on the
+        current page, so at most two pages are held in memory. Raises PodioAPIError if a page cannot be fetched.
+        Stops after `max_pages` pages (default: all); prefetch=False requests each page only when it is read.
+        '''
+        self.formatted_app_id = str(app_id)
+        filters = dict(filters)
+        limited = 'limit' in filters.keys()
+        limit = filters.pop('limit', 500)  # Default limit to 500 if not included in filter
+        offset = 0
+        fetched = 0
+        next_page = None
+        try:
+            while True:
+                items = await (next_page or self.fetch_filtered_page(app_id, filters, limit, offset))
+                fetched += 1
+                offset += len(items)
+                # Stop if the number of items is less than the limit (all items gathered), if response is limited
+                # or once max_pages pages were read
+                more = len(items) == limit and not limited and (max_pages is None or fetched < max_pages)
+                next_page = asyncio.create_task(self.fetch_filtered_page(app_id, filters, limit, offset)) if more and prefetch else None
+                page = {item['item_id']: self.clean_item(item) for item in items}
+                del items
+                if pages:
+                    yield page
+                else:
+                    for item_id, item_dict in page.items():
+                        yield item_id, item_dict
+                if not more:
+                    return
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    async def fetch_filtered_page(self, app_id, filters, limit, offset):
+        '''
+        Fetches one raw page of filtered items, waiting out rate limits without blocking the event loop.
+        '''
+        url = f'{self.base_url}item/app/{app_id}/filter/'
+        while True:
+            response = await self.request('POST', url, kind='rate_limited', json={'filters': filters, 'limit': limit, 'offset': offset})
+
+            if response.status_code == 200:
+                return response.json()['items']
+
+            elif response.json().get('error') == 'rate_limit':  # Rate limit exceeded.  Can be passed by waiting 5 min.
+                if not self.credential_pool:
+                    print('Rate limit exceeded.  Sleeping for 300 seconds.')
+                    await asyncio.sleep(300)
+            else:
+                logging.error(f"Failed to retrieve items: {response.json()}\n"
+                            f"PARAMETERS\nFILTERS: {filters}\nLIMIT: {limit}\nOFFSET: {offset}")
+                raise PodioAPIError(response.status_code, response.json())
+
+    async def get_org(self):
+        '''
+        Fetches the organizational structure from Podio, including spaces.
+        '''
+        response = await self.request('GET', f'{self.base_url}org/{self.org_id}/all_spaces')
+        return response.json()
+
+    async def get_apps_in_space(self, space_id):
+        '''
+        Returns a list of tuples (space_app_id, app_name).
+        '''
+        response = await self.request('GET', self.base_url + f'app/space/{space_id}/')
+        return self.parse_apps_in_space(response.status_code, response.json())
+
+    async def get_app_fields_data(self, app_id, etag=None):
+        '''
+        Retrieves metadata about fields in a specific Podio app.
+
+        Returns a dictionary { field_id: { field_label, field_type, return_type, hidden } }.
+        The response ETag is kept in self.app_etags[str(app_id)]; passing it back as `etag` makes the request
+        conditional (If-None-Match) and None is returned when the app has not changed.
+        Raises PodioAPIError if the app cannot be read, so a failed request is never mistaken for an empty app.
+        '''
+        headers = {'If-None-Match': etag} if etag else {}
+        response = await self.request('GET', self.base_url + f'app/{app_id}', headers=headers)
+        if response.status_code == 304:
+            self.app_etags[str(app_id)] = etag
+            return None
+        if response.status_code != 200:
+            raise PodioAPIError(response.status_code, response.json())
+        if response.headers.get('ETag'):
+            self.app_etags[str(app_id)] = response.headers['ETag']
+        fields_info = self.parse_app_fields(response.json())
+        self.item_cleaner.load_schema(fields_info)
+        return fields_info
+
+    async def get_podio_system_setup(self, etags=None):
+        '''
+        Retrieves the complete data structure of all apps within a Podio organization.
+
+        Spaces are listed concurrently, then every app's fields are fetched concurrently (bounded by
+        max_concurrency and the credential pool). `etags` ({ app_id: etag } from a previous walk) makes each
+        app request conditional; apps Podio reports as unchanged, or that could not be read, come back with 'fields': None.
+        Returns a nested dictionary { space_name: { app_name: { space_app_id, app_id, fields, etag } } }.
+        '''
+        etags = etags or {}
+        print('Getting spaces in organization')
+        org_response = await self.get_org()
+        spaces = [space for space in org_response if 'name' in space.keys() and space['name'] != 'Fluent Solar']
+        print(f'Getting apps in {len(spaces)} spaces')
+        space_apps = await asyncio.gather(*[self.get_apps_in_space(space['space_id']) for space in spaces])
+        apps = [
+            (space['name'], space_app_id, app_name)
+            for space, app_response in zip(spaces, space_apps)
+            for space_app_id, app_name in app_response
+        ]
+        print(f'Getting fields in {len(apps)} apps')
+        app_ids = [space_app_id.split('.')[1] for _, space_app_id, _ in apps]
+        fields = await asyncio.gather(*[self.get_app_fields_data(app_id, etags.get(app_id)) for app_id in app_ids],
+                                      return_exceptions=True)
+        org_info = {}
+        for (space_name, space_app_id, app_name), app_id, fields_info in zip(apps, app_ids, fields):
+            if isinstance(fields_info, PodioAPIError):
+                print(f'Could not get fields of app {space_name}/{app_name}.\n{fields_info}')
+                fields_info = None
+            elif isinstance(fields_info, BaseException):
+                raise fields_info
+            org_info.setdefault(space_name, {})[app_name] = {
+                'space_app_id': space_app_id,
+                'app_id': app_id,
+                'fields': fields_info,
+                'etag': self.app_etags.get(app_id)
+            }
+        return org_info
+
+    async def get_podio_item_values(self, item_id):
+        '''
+        Retrieves and processes data for a single Podio item.
+
+        Returns { 'item_id': item_id, 'data': cleaned_fields }.
+        Raises PodioAPIError on failure so callers can tell rate limits, deleted items and server errors apart.
+        '''
+        response = await self.request('GET', f'{self.base_url}item/{item_id}/value', kind='rate_limited')
+        if response.status_code == 200:
+            return {'item_id': item_id, 'data': self.clean_item({'fields': response.json()})}
+        print(f"Failed to get item {item_id}. Response: {response.json()}")
+        raise PodioAPIError(response.status_code, response.json())
+
+    async def get_items_by_ids(self, app_id, item_ids, edited_since, max_pages=1):
+        '''
+        Hydrates many items of one app with a single filtered request instead of one /item/{id}/value call each.
+
+        Filters the app on last_edit_on >= edited_since (UTC) and keeps only the requested item_ids.
+        Reads at most `max_pages` pages of 500, one request at a time, and stops once every id is found: during a
+        mass edit the window holds far more items than were asked for, and those left out are cheaper to fetch
+        one by one. No page beyond those is requested, so no rate limit budget is spent on unread pages.
+        Items missing from the result are left out so the caller can fall back to get_podio_item_values.
+        Returns ({ str(item_id): { 'item_id': item_id, 'data': cleaned_fields } }, pages_fetched);
+        raises PodioAPIError if the request fails.
+        '''
+        wanted = {str(item_id): item_id for item_id in item_ids}
+        filters = {'last_edit_on': {'from': edited_since.strftime('%Y-%m-%d %H:%M:%S')}}
+        hydrated = {}
+        pages = 0
+        async for page in self.iter_filtered_items(app_id, filters, pages=True, max_pages=max_pages, prefetch=False):
+            pages += 1
+            for item_id, item_dict in page.items():
+                if str(item_id) in wanted:
+                    hydrated[str(item_id)] = {'item_id': wanted[str(item_id)], 'data': item_dict}
+            if len(hydrated) == len(wanted):
+                break
+        return hydrated, pages
+
+    async def create_hook(self, url, ref_type, ref_id, event_type):
+        '''
+        Creates a webhook in Podio to trigger events.
+
+        Returns the webhook creation response.
+        '''
+        data = {
+            'ref_type': ref_type,
+            'ref_id': ref_id,
+            'type': event_type,
+            'url': url
         }
-        url = f'{self.base_url}hook/{ref_type}/{ref_id}/'
-        response = requests.post(url, headers=headers, json=data)
+        response = await self.request('POST', f'{self.base_url}hook/{ref_type}/{ref_id}/', json=data)
         return response.json()
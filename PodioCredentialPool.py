@@ -0,0 +1,159 @@
+import asyncio, time
+
+"""
+Podio rate limits per client_id, as (requests, period_seconds) windows.
+- 'rate_limited': item reads/filters (~15 per minute, 250 per hour).
+- 'standard': org, space, app and hook calls (1000 per hour).
+"""
+PODIO_RATE_LIMITS = {
+    'rate_limited': [(15, 60), (250, 3600)],
+    'standard': [(1000, 3600)]
+}
+
+class TokenBucket:
+    '''
+    Token bucket holding up to `capacity` tokens, refilled continuously over `period` seconds.
+    '''
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    def remaining(self):
+        self.refill()
+        return self.tokens
+
+    def wait_time(self, tokens=1):
+        '''
+        Seconds until `tokens` tokens are available (0 if they are available now).
+        '''
+        self.refill()
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) * self.period / self.capacity
+
+    def take(self, tokens=1):
+        self.tokens -= tokens
+
+    def cap(self, remaining):
+        '''
+        Lowers the bucket to the budget Podio reports, so other processes' usage is accounted for.
+        '''
+        self.refill()
+        self.tokens = min(self.tokens, float(remaining))
+
+
+class Credential:
+    '''
+    One set of Podio API credentials with a token bucket per rate limit window.
+    '''
+    def __init__(self, key, creds, limits=PODIO_RATE_LIMITS):
+        self.key = key
+        self.username = creds['user']
+        self.password = creds['password']
+        self.client_id = creds['client_id']
+        self.client_secret = creds['client_secret']
+        self.buckets = {kind: [TokenBucket(capacity, period) for capacity, period in windows] for kind, windows in limits.items()}
+        self.api_count = 0
+
+    def remaining(self, kind):
+        return min(bucket.remaining() for bucket in self.buckets[kind])
+
+    def wait_time(self, kind):
+        return max(bucket.wait_time() for bucket in self.buckets[kind])
+
+    def take(self, kind):
+        for bucket in self.buckets[kind]:
+            bucket.take()
+        self.api_count += 1
+
+
+class CredentialPool:
+    '''
+    Schedules Podio requests across several credentials so throughput scales with the number of client_ids.
+
+    Every request takes one token from the chosen credential's buckets. `acquire` picks the credential
+    that can send soonest (most remaining budget on ties) and waits with asyncio.sleep when all are
+    exhausted; `acquire_sync` does the same for the blocking PodioAPI. `observe` feeds the
+    X-Rate-Limit-Remaining header and rate_limit errors back into the buckets.
+    `use_only` restricts scheduling to a slice of the credentials (e.g. one worker shard's share).
+    '''
+    def __init__(self, podio_creds, limits=PODIO_RATE_LIMITS):
+        self.limits = limits
+        self.credentials = [Credential(key, creds, limits) for key, creds in podio_creds.items()]
+        self.active = self.credentials
+
+    def __len__(self):
+        return len(self.active)
+
+    def use_only(self, keys):
+        '''
+        Schedules requests only on the credentials whose key is in `keys` (all credentials if empty).
+        Buckets are kept, so budget spent before the change still counts.
+        '''
+        keys = set(keys)
+        self.active = [credential for credential in self.credentials if credential.key in keys] or self.credentials
+
+    def best(self, kind='rate_limited'):
+        return min(self.active, key=lambda credential: (credential.wait_time(kind), -credential.remaining(kind)))
+
+    def next_wait(self, kind='rate_limited'):
+        '''
+        Returns (credential, seconds_to_wait); takes a token when no wait is needed.
+        '''
+        credential = self.best(kind)
+        wait = credential.wait_time(kind)
+        if wait == 0:
+            credential.take(kind)
+        return credential, wait
+
+    async def acquire(self, kind='rate_limited'):
+        '''
+        Waits asynchronously until some credential has budget for one `kind` request and returns it.
+        '''
+        while True:
+            credential, wait = self.next_wait(kind)
+            if wait == 0:
+                return credential
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, kind='rate_limited'):
+        '''
+        Blocking version of acquire for the synchronous PodioAPI.
+        '''
+        while True:
+            credential, wait = self.next_wait(kind)
+            if wait == 0:
+                return credential
+            print(f'All Podio credentials rate limited.  Sleeping for {wait:.0f} seconds.')
+            time.sleep(wait)
+
+    def observe(self, credential, kind, status_code, headers):
+        '''
+        Updates a credential's budget from a Podio response.
+        - X-Rate-Limit-Remaining caps the longest window's bucket.
+        - A rate_limit error (HTTP 420/429) empties every bucket for that kind.
+        '''
+        buckets = credential.buckets[kind]
+        if status_code in (420, 429):
+            for bucket in buckets:
+                bucket.cap(0)
+            return
+        remaining = headers.get('X-Rate-Limit-Remaining')
+        if remaining is not None and remaining.isdigit():
+            max(buckets, key=lambda bucket: bucket.period).cap(int(remaining))
+
+    def status(self):
+        '''
+        Returns { client_id: { kind: remaining_tokens } } for the active credentials.
+        '''
+        return {
+            credential.client_id: {kind: round(credential.remaining(kind), 2) for kind in self.limits}
+            for credential in self.active
+        }
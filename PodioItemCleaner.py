@@ -0,0 +1,238 @@
+import re
+from datetime import datetime
+from dateutil.parser import parse
+
+HTML_TAG = re.compile(r'<.*?>')
+
+'''
+Registry of value converters by Podio field type.
+
+Each entry is a factory taking the field's return_type (from get_app_fields_data) and returning a function
+that turns the field's raw `values` list into the stored value. Factories run once per field, so per-item
+work is a single dict lookup plus the converter call instead of a `match` and regex compile per field.
+'''
+FIELD_CLEANERS = {}
+
+'''
+Converters for typed storage: native values instead of joined strings.
+Multi-valued types (contact, category, app, phone, email, location) always become lists, numbers and money
+become floats and dates become datetimes, so stored documents can be indexed and range-queried.
+'''
+TYPED_FIELD_CLEANERS = {}
+
+def field_cleaner(*field_types, registry=FIELD_CLEANERS):
+    def register(factory):
+        for field_type in field_types:
+            registry[field_type] = factory
+        return factory
+    return register
+
+def parse_date(value):
+    '''
+    Parses a Podio date string to 'YYYY-MM-DD', trying the fast ISO parser before dateutil.
+    Returns None if the value is not a date.
+    '''
+    try:
+        return datetime.fromisoformat(value).strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    try:
+        return parse(value).strftime('%Y-%m-%d')
+    except (ValueError, OverflowError):
+        return None
+
+def parse_datetime(value):
+    '''
+    Parses a Podio date string to a datetime, trying the fast ISO parser before dateutil.
+    Returns None if the value is not a date.
+    '''
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return parse(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+@field_cleaner('date')
+def date_cleaner(return_type):
+    return lambda values: ','.join([value['start'] for value in values])
+
+@field_cleaner('contact')
+def contact_cleaner(return_type):
+    return lambda values: ','.join([value['value']['name'] for value in values])
+
+@field_cleaner('text')
+def text_cleaner(return_type):
+    strip_tags = HTML_TAG.sub
+    return lambda values: ','.join([strip_tags('', value['value']) for value in values])
+
+@field_cleaner('category')
+def category_cleaner(return_type):
+    return lambda values: ','.join([value['value']['text'] for value in values])
+
+@field_cleaner('app')
+def app_cleaner(return_type):
+    return lambda values: ','.join([str(value['value']['item_id']) for value in values])
+
+@field_cleaner('phone', 'email', 'number', 'location')
+def plain_cleaner(return_type):
+    return lambda values: ','.join([value['value'] for value in values])
+
+@field_cleaner('money')
+def money_cleaner(return_type):
+    return lambda values: float(values[0]['value']) if values else None
+
+@field_cleaner('calculation')
+def calculation_cleaner(return_type):
+    '''
+    Calculations are converted according to their return_type when the app schema is known.
+    Without a schema, ISO dates become 'YYYY-MM-DD' and anything else the first value as a float when possible.
+    '''
+    def starts_or(convert):
+        def clean(values):
+            if not values:
+                return None
+            if 'start' in values[0]:
+                return ','.join([value['start'] for value in values])
+            return convert(values)
+        return clean
+
+    if return_type == 'date':
+        return starts_or(lambda values: ','.join([parse_date(value['value']) or value['value'] for value in values]))
+    if return_type == 'number':
+        return starts_or(lambda values: to_float(values[0]['value']))
+    if return_type == 'text':
+        return starts_or(lambda values: values[0]['value'])
+
+    def unknown(values):
+        try:
+            return ','.join([datetime.fromisoformat(value['value']).strftime('%Y-%m-%d') for value in values])
+        except (TypeError, ValueError):
+            return to_float(values[0]['value'])
+    return starts_or(unknown)
+
+@field_cleaner('date', registry=TYPED_FIELD_CLEANERS)
+def typed_date_cleaner(return_type):
+    return lambda values: parse_datetime(values[0]['start']) if values else None
+
+@field_cleaner('contact', registry=TYPED_FIELD_CLEANERS)
+def typed_contact_cleaner(return_type):
+    return lambda values: [value['value']['name'] for value in values]
+
+@field_cleaner('text', registry=TYPED_FIELD_CLEANERS)
+def typed_text_cleaner(return_type):
+    strip_tags = HTML_TAG.sub
+    return lambda values: ','.join([strip_tags('', value['value']) for value in values]) if values else None
+
+@field_cleaner('category', registry=TYPED_FIELD_CLEANERS)
+def typed_category_cleaner(return_type):
+    return lambda values: [value['value']['text'] for value in values]
+
+@field_cleaner('app', registry=TYPED_FIELD_CLEANERS)
+def typed_app_cleaner(return_type):
+    return lambda values: [value['value']['item_id'] for value in values]
+
+@field_cleaner('phone', 'email', 'location', registry=TYPED_FIELD_CLEANERS)
+def typed_list_cleaner(return_type):
+    return lambda values: [value['value'] for value in values]
+
+@field_cleaner('number', 'money', registry=TYPED_FIELD_CLEANERS)
+def typed_number_cleaner(return_type):
+    return lambda values: to_float(values[0]['value']) if values else None
+
+@field_cleaner('calculation', registry=TYPED_FIELD_CLEANERS)
+def typed_calculation_cleaner(return_type):
+    '''
+    Date calculations become datetimes and number calculations floats; without a schema the value is parsed
+    as an ISO date, then as a float, and otherwise kept as text.
+    '''
+    def clean(values):
+        if not values:
+            return None
+        value = values[0]
+        if 'start' in value:
+            return parse_datetime(value['start'])
+        if return_type == 'date':
+            return parse_datetime(value['value'])
+        if return_type == 'number':
+            return to_float(value['value'])
+        if return_type == 'text':
+            return value['value']
+        try:
+            return datetime.fromisoformat(value['value'])
+        except (TypeError, ValueError):
+            return to_float(value['value'])
+    return clean
+
+def compile_field_cleaner(field_type, return_type=None, typed=False):
+    '''
+    Returns the converter for one field, or None for field types without a cleaner.
+    '''
+    factory = (TYPED_FIELD_CLEANERS if typed else FIELD_CLEANERS).get(field_type)
+    return factory(return_type) if factory else None
+
+
+class ItemCleaner:
+    '''
+    Cleans Podio items with one precompiled converter per field_id.
+
+    Converters are built from the app schema when `load_schema` is given the output of get_app_fields_data,
+    and otherwise compiled on first sight of a field from the type in the item itself. A converter is rebuilt
+    if a field's type changes. Output matches PodioAPI.clean_item: { field_id: { field_id, field_label, field_type, field_value } }.
+
+    With typed=True values come from TYPED_FIELD_CLEANERS and the output is the compact { field_id: value };
+    labels and types are left to the app schema (get_app_fields_data / the app_schemas snapshots).
+    '''
+    def __init__(self, typed=False):
+        self.typed = typed
+        self.converters = {}
+        self.skipped = set()
+
+    def load_schema(self, fields_info):
+        '''
+        Precompiles converters from a get_app_fields_data result { field_id: { type, return_type, ... } }.
+        '''
+        for field_id, info in fields_info.items():
+            field_type = info['type']
+            self.converters[int(field_id)] = (field_type, compile_field_cleaner(field_type, info.get('return_type'), self.typed))
+
+    def converter(self, field_id, field_type):
+        cached = self.converters.get(field_id)
+        if cached is None or cached[0] != field_type:
+            cached = (field_type, compile_field_cleaner(field_type, typed=self.typed))
+            self.converters[field_id] = cached
+        return cached[1]
+
+    def clean_item(self, item):
+        if not item:
+            return None
+        item_dict = {}
+        for field in item['fields']:
+            field_id = field['field_id']
+            field_type = field['type']
+            convert = self.converter(field_id, field_type)
+            if convert is None:
+                value = None
+                if field_id not in self.skipped:
+                    self.skipped.add(field_id)
+                    print(f'skipped field {field_id} of unsupported type {field_type}')  # Error logic to send email to CRM Admin for fix
+            else:
+                value = convert(field['values'])
+            if self.typed:
+                item_dict[str(field_id)] = value
+                continue
+            item_dict[str(field_id)] = {
+                'field_id': field_id,
+                'field_label': field['label'],
+                'field_type': field_type,
+                'field_value': value
+            }
+        return item_dict
@@ -0,0 +1,249 @@
+import hashlib, json
+from pymongo import InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from PodioMetrics import timed, MONGO_SECONDS
+
+"""
+Write path for the 'podio_items' collection, shared by the webhook queue worker and the sync engine.
+- item_id is stored as a string (webhooks deliver it as form data), so both writers address the same documents.
+- history='copies': every changed item becomes a new full version with current: 1; older versions are set to current: 0.
+  Items whose data hash matches the current version are not written, so re-syncing unchanged items adds nothing.
+- history='delta': one current document per item plus field-level change records in 'podio_item_changes'
+  ({ item_id, version, timestamp, set: { field_id: value }, unset: [field_id] }). Items whose data hash
+  matches the current document are not written at all.
+- item_at reconstructs an item as it was at any point in time in either mode.
+"""
+
+def data_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def item_document(item_vals: dict, timestamp, app_id=None):
+    """
+    Builds the podio_items document for one get_podio_item_values/get_items_by_ids result.
+    """
+    doc = {str(key): val for key, val in item_vals.items()}
+    doc['item_id'] = str(doc['item_id'])
+    if app_id is not None:
+        doc['app_id'] = str(app_id)
+    doc['timestamp'] = timestamp
+    doc['current'] = 1
+    return doc
+
+def item_write_ops(item_vals: dict, timestamp, app_id=None, current=None):
+    """
+    Returns the bulk_write operations that make `item_vals` the current version of its item (history='copies'),
+    or None if `current` (the item's current document, if known) already holds the same data.
+    """
+    doc = item_document(item_vals, timestamp, app_id)
+    doc['hash'] = data_hash(doc.get('data') or {})
+    if current is not None and current.get('hash', data_hash(current.get('data') or {})) == doc['hash']:
+        return None
+    return [
+        UpdateMany({'item_id': doc['item_id'], 'current': 1}, {'$set': {'current': 0}}),
+        InsertOne(doc)
+    ]
+
+def delta_write_ops(item_vals: dict, timestamp, app_id, current):
+    """
+    Returns (podio_items operations, change record) for history='delta', or None if the data is unchanged.
+    - `current` is the item's current document (None for a new item).
+    - Only changed fields are $set/$unset; the update is guarded by the current version so a concurrent
+      writer's update is not overwritten.
+    - A full copy written before delta mode (no version) is kept as current: 0 for item_at, and the new
+      current document starts at version 1 with a full change record.
+    """
+    doc = item_document(item_vals, timestamp, app_id)
+    data = doc.get('data') or {}
+    doc['hash'] = data_hash(data)
+    if current is None or current.get('version') is None:
+        doc['version'] = 1
+        change = {'item_id': doc['item_id'], 'version': 1, 'timestamp': timestamp, 'set': data, 'unset': []}
+        if current is None:
+            return [UpdateOne({'item_id': doc['item_id'], 'current': 1}, {'$setOnInsert': doc}, upsert=True)], change
+        return item_write_ops(item_vals, timestamp, app_id)[:1] + [InsertOne(doc)], change
+    if current.get('hash') == doc['hash']:
+        return None
+    old_data = current.get('data') or {}
+    changed = {field_id: value for field_id, value in data.items() if field_id not in old_data or old_data[field_id] != value}
+    removed = [field_id for field_id in old_data if field_id not in data]
+    version = current['version'] + 1
+    update = {'$set': {
+        **{f'data.{field_id}': value for field_id, value in changed.items()},
+        'hash': doc['hash'],
+        'timestamp': timestamp,
+        'version': version
+    }}
+    if app_id is not None:
+        update['$set']['app_id'] = doc['app_id']
+    if removed:
+        update['$unset'] = {f'data.{field_id}': '' for field_id in removed}
+    operation = UpdateOne({'_id': current['_id'], 'version': current['version']}, update)
+    return [operation], {'item_id': doc['item_id'], 'version': version, 'timestamp': timestamp, 'set': changed, 'unset': removed}
+
+async def store_items(db, items: list, session=None, history='copies'):
+    """
+    Writes a batch of items with one bulk_write per collection.
+    - items is a list of (item_vals, timestamp, app_id) tuples; app_id may be None.
+    Returns the number of items written (items whose data is unchanged are skipped).
+    """
+    if history == 'delta':
+        return await store_item_deltas(db, items, session)
+    return await store_item_copies(db, items, session)
+
+class ItemWriteConflict(Exception):
+    """
+    Raised when concurrent writers kept replacing an item's current version during store_items.
+    """
+
+def fold_items(items: list):
+    """
+    Keeps only the last result for each item_id in a batch, in first-seen order.
+    """
+    latest = {}
+    for item_vals, timestamp, app_id in items:
+        latest[str(item_vals['item_id'])] = (item_vals, timestamp, app_id)
+    return list(latest.values())
+
+def lost_items(expected: dict, current: dict):
+    """
+    Returns the item_ids whose current document is not the version this writer expected to write.
+    - expected is { item_id: (version, hash) }; current is { item_id: current document }.
+    """
+    return [
+        item_id for item_id, (version, digest) in expected.items()
+        if item_id not in current or (current[item_id].get('version'), current[item_id].get('hash')) != (version, digest)
+    ]
+
+async def read_current_items(db, item_ids: list, session=None):
+    """
+    Returns { item_id: current document } for the given item_ids with one query.
+    """
+    with timed(MONGO_SECONDS, operation='read_current_items'):
+        return {
+            doc['item_id']: doc
+            async for doc in db.podio_items.find({'item_id': {'$in': item_ids}, 'current': 1}, session=session)
+        }
+
+async def retry_lost_writes(write, db, items: list, session=None, attempts=3):
+    """
+    Runs `write` (write_item_copies or write_item_deltas) over the folded batch until no item lost to a
+    concurrent writer, at most `attempts` times; after that ItemWriteConflict is raised so the caller retries
+    the event instead of dropping the data. Returns the number of items written.
+    """
+    pending = fold_items(items)
+    written = 0
+    for attempt in range(attempts):
+        count, pending = await write(db, pending, session)
+        written += count
+        if not pending:
+            return written
+    raise ItemWriteConflict(f'Items {[str(item_vals['item_id']) for item_vals, _, _ in pending]} changed concurrently {attempts} times.')
+
+async def store_item_copies(db, items: list, session=None, attempts=3):
+    """
+    history='copies' write: reads the current documents for the batch in one query and inserts a new version
+    only for items whose data changed. Several results for one item are folded into the last one, and an
+    insert that lost to a concurrent writer (unique item_id_current_only) is retried from a fresh read.
+    """
+    return await retry_lost_writes(write_item_copies, db, items, session, attempts)
+
+async def write_item_copies(db, items: list, session=None):
+    """
+    One store_item_copies round. Returns (items written, items to retry).
+    """
+    current = await read_current_items(db, [str(item_vals['item_id']) for item_vals, _, _ in items], session)
+    operations = []
+    expected = {}
+    for item_vals, timestamp, app_id in items:
+        item_id = str(item_vals['item_id'])
+        item_operations = item_write_ops(item_vals, timestamp, app_id, current.get(item_id))
+        if item_operations is None:
+            continue
+        operations.extend(item_operations)
+        expected[item_id] = (None, item_operations[1]._doc['hash'])
+    if not operations:
+        return 0, []
+    try:
+        with timed(MONGO_SECONDS, operation='store_items'):
+            await db.podio_items.bulk_write(operations, ordered=True, session=session)
+    except BulkWriteError as e:
+        # Another writer inserted a current version first; the rest of the ordered batch did not run.
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        lost = lost_items(expected, await read_current_items(db, list(expected), session))
+        return len(expected) - len(lost), [item for item in items if str(item[0]['item_id']) in lost]
+    return len(expected), []
+
+async def store_item_deltas(db, items: list, session=None, attempts=3):
+    """
+    history='delta' write: reads the current documents for the batch in one query, then writes changed
+    fields to podio_items and change records to podio_item_changes.
+    - Several results for one item in the batch are folded into the last one (fold_items).
+    - A write that lost to a concurrent writer (its version-guarded update matched nothing, or another
+      writer inserted the item first, found by the upsert or by the unique item_id_current_only index)
+      is recomputed from a fresh read and retried, up to `attempts` times;
+      after that ItemWriteConflict is raised so the caller retries the event instead of dropping the data.
+    """
+    return await retry_lost_writes(write_item_deltas, db, items, session, attempts)
+
+async def write_item_deltas(db, items: list, session=None):
+    """
+    One store_item_deltas round. Returns (items written, items to retry).
+    """
+    current = await read_current_items(db, [str(item_vals['item_id']) for item_vals, _, _ in items], session)
+    operations = []
+    changes = []
+    expected = {}
+    for item_vals, timestamp, app_id in items:
+        item_id = str(item_vals['item_id'])
+        delta = delta_write_ops(item_vals, timestamp, app_id, current.get(item_id))
+        if delta is None:
+            continue
+        item_operations, change = delta
+        operations.extend(item_operations)
+        changes.append(change)
+        expected[item_id] = (change['version'], data_hash(item_vals.get('data') or {}))
+    if not changes:
+        return 0, []
+    try:
+        with timed(MONGO_SECONDS, operation='store_item_deltas'):
+            result = await db.podio_items.bulk_write(operations, ordered=True, session=session)
+        converted = any(isinstance(operation, UpdateMany) for operation in operations)  # Its count covers every old copy.
+        verify = converted or result.modified_count + result.upserted_count + result.inserted_count < len(operations)
+    except BulkWriteError as e:
+        # Another writer inserted a current document first (unique item_id_current_only); the rest of the
+        # ordered batch did not run. Both count as lost writes below.
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        verify = True
+    lost = []
+    if verify:
+        # Some guarded update matched nothing or an upsert found the item already inserted; see which.
+        lost = lost_items(expected, await read_current_items(db, list(expected), session))
+        changes = [change for change in changes if change['item_id'] not in lost]
+    if changes:
+        try:
+            await db.podio_item_changes.insert_many(changes, ordered=False, session=session)
+        except BulkWriteError as e:
+            # A concurrent writer already recorded the same (item_id, version); its record stands.
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+    retry = [item for item in items if str(item[0]['item_id']) in lost]
+    return len(changes), retry
+
+async def item_at(db, item_id, when):
+    """
+    Returns the item's data as it was at `when` (a datetime), or None if it did not exist yet.
+    Replays change records up to `when`; items stored with history='copies' use the latest full version instead.
+    """
+    item_id = str(item_id)
+    data = None
+    async for change in db.podio_item_changes.find({'item_id': item_id, 'timestamp': {'$lte': when}}, sort=[('version', 1)]):
+        data = dict(data or {})
+        data.update(change['set'])
+        for field_id in change['unset']:
+            data.pop(field_id, None)
+    if data is not None:
+        return data
+    doc = await db.podio_items.find_one({'item_id': item_id, 'timestamp': {'$lte': when}}, sort=[('timestamp', -1)])
+    return doc.get('data') if doc else None
@@ -0,0 +1,150 @@
+import json, re, time
+from contextlib import contextmanager
+
+"""
+In-process metrics in the Prometheus text exposition format, served by the gateway's /metrics route.
+- Counter, Gauge and Histogram keep one value per label set; `function` metrics are read when rendered
+  (e.g. counters the gateway already keeps in queue_stats, or the credential pool's remaining budget).
+- timed() is a span: it observes the elapsed seconds into a histogram and, with TRACE_SPANS, prints the span
+  as one JSON line for log-based tracing.
+- Every metric created here is registered in REGISTRY; render() formats them all.
+"""
+TRACE_SPANS = False
+REGISTRY = []
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+def format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        '''
+        `function`, if given, returns the current value (or { label_tuple: value } with labelnames) at render time.
+        '''
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}
+        REGISTRY.append(self)
+
+    def samples(self):
+        if self.function is None:
+            values = self.values
+        else:
+            values = self.function()
+            if not self.labelnames:
+                values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield f'{self.name}{format_labels(self.labelnames, tuple(str(part) for part in key))} {format_value(value)}'
+
+    def render(self):
+        return '\n'.join([f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}', *self.samples()])
+
+    def value(self, **labels):
+        return self.values.get(label_key(self.labelnames, labels), 0)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = label_key(self.labelnames, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[label_key(self.labelnames, labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = label_key(self.labelnames, labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state['counts'][i] += 1
+                break
+        state['sum'] += value
+        state['count'] += 1
+
+    def samples(self):
+        for key, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, [('le', format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {state['sum']}'
+            yield f'{self.name}_count{labels} {state['count']}'
+
+    def value(self, **labels):
+        state = self.values.get(label_key(self.labelnames, labels))
+        return state['count'] if state else 0
+
+
+@contextmanager
+def timed(histogram, **labels):
+    '''
+    Times the enclosed block into `histogram` (works around awaits too).
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **labels)
+        if TRACE_SPANS:
+            print(json.dumps({'span': histogram.name, **labels, 'seconds': round(elapsed, 6)}))
+
+_id_segment = re.compile(r'/\d+(?=/|$)')
+
+def endpoint_name(url):
+    '''
+    Collapses a Podio API URL to a low-cardinality endpoint label, e.g. 'GET item/:id/value'.
+    '''
+    path = str(url).split('://', 1)[-1].split('?', 1)[0]
+    path = path.split('/', 1)[1] if '/' in path else ''
+    return _id_segment.sub('/:id', '/' + path).strip('/')
+
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+"""
+Metrics shared by the wrapper, the item store and the gateway.
+"""
+PODIO_REQUEST_SECONDS = Histogram('podio_request_seconds', 'Podio API request latency by endpoint.', ['method', 'endpoint'])
+PODIO_REQUESTS = Counter('podio_requests_total', 'Podio API requests by credential and response status.', ['client_id', 'status'])
+ITEMS_CLEANED = Counter('podio_items_cleaned_total', 'Items converted by clean_item.')
+ITEM_CLEAN_SECONDS = Counter('podio_item_clean_seconds_total', 'Time spent in clean_item; items_cleaned / clean_seconds is the throughput.')
+MONGO_SECONDS = Histogram('mongo_operation_seconds', 'MongoDB operation latency by operation.', ['operation'])
+SPAN_SECONDS = Histogram('pipeline_span_seconds', 'Latency of pipeline stages.', ['span'])
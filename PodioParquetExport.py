@@ -0,0 +1,261 @@
+import asyncio, json, os, shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PodioItemCleaner import parse_datetime, to_float
+from PodioSchemaSnapshots import SchemaSnapshots
+from PodioMetrics import timed, SPAN_SECONDS
+
+"""
+Columnar snapshots of current items for analytics, as Parquet files partitioned by app and export watermark:
+
+    <root>/app_id=<app_id>/watermark=<YYYYmmddTHHMMSS>/part-0.parquet
+
+- The first export of an app is a full snapshot; later exports append a partition holding only items
+  stored since the previous watermark (minus overlap_seconds), judged by store time: the ObjectId of the
+  item version for history='copies', of its change records in 'podio_item_changes' for history='delta'.
+  ObjectIds have one-second resolution, so items stored in the watermark's second are exported again.
+  The newest row per item_id across partitions is the current item, e.g. pyarrow.dataset.dataset(root, partitioning='hive').
+- An app's items are those with its app_id, plus items stored without an app_id that have one of its fields.
+- Columns are item_id, timestamp and field_<field_id> (app_id and watermark come from the path), typed from the app schema (get_app_fields_data /
+  app_schemas snapshots); labels and Podio types are stored in the file metadata under 'podio_fields'.
+- Rows are written chunk_size at a time, so memory stays bounded regardless of app size. A partition is
+  written under <root>/_staging (ignored by dataset readers) and renamed into place once complete, and the watermark in
+  'export_state' only moves after that, so an interrupted export is simply repeated. Arrow conversion and file
+  operations run on one dedicated thread so they never block the event loop.
+"""
+
+def arrow_type(info, typed):
+    '''
+    Arrow type of one field's values. The labeled layout keeps comma-joined text, so only money is numeric there.
+    '''
+    field_type = info.get('type')
+    if field_type == 'calculation':
+        field_type = info.get('return_type')
+    if field_type == 'money' or (typed and field_type == 'number'):
+        return pa.float64()
+    if not typed:
+        return pa.string()
+    if field_type == 'date':
+        return pa.timestamp('us')
+    if field_type == 'app':
+        return pa.list_(pa.int64())
+    if field_type in ('category', 'contact', 'phone', 'email', 'location'):
+        return pa.list_(pa.string())
+    return pa.string()
+
+def arrow_value(value, arrow_type):
+    '''
+    Coerces a stored value to `arrow_type`; values that no longer fit (e.g. after a field type change) become null.
+    '''
+    if value is None:
+        return None
+    if pa.types.is_floating(arrow_type):
+        value = to_float(value)
+        return value if isinstance(value, float) else None
+    if pa.types.is_timestamp(arrow_type):
+        return value if isinstance(value, datetime) else parse_datetime(str(value))
+    if pa.types.is_list(arrow_type):
+        values = value if isinstance(value, list) else [value]
+        if pa.types.is_integer(arrow_type.value_type):
+            return [int(part) for part in values if str(part).isdigit()]
+        return [str(part) for part in values]
+    return value if isinstance(value, str) else str(value)
+
+def item_schema(fields_info, typed):
+    '''
+    Returns (arrow schema, field ids in column order) for an app's fields_info { field_id: { type, return_type, field_label } }.
+    '''
+    field_ids = sorted(fields_info, key=int)
+    columns = [
+        pa.field('item_id', pa.string()),
+        pa.field('timestamp', pa.timestamp('us'))
+    ]
+    columns += [pa.field(f'field_{field_id}', arrow_type(fields_info[field_id], typed)) for field_id in field_ids]
+    labels = {
+        str(field_id): {key: fields_info[field_id].get(key) for key in ('field_label', 'type', 'return_type')}
+        for field_id in field_ids
+    }
+    return pa.schema(columns, metadata={'podio_fields': json.dumps(labels)}), [str(field_id) for field_id in field_ids]
+
+
+class ParquetExporter:
+    '''
+    Writes current items of an app to Parquet under `root`, from MongoDB (current: 1 documents) or, with a
+    `podio` client, straight from get_filtered_items pages.
+
+    `typed` must match how the items were cleaned (typed_item_values), `history` the item_history mode.
+    Watermarks live in the 'export_state' documents 'parquet:<app_id>'.
+    '''
+    def __init__(self, db, root, typed=False, history='copies', podio=None, chunk_size=10000, overlap_seconds=300):
+        self.db = db
+        self.root = root
+        self.typed = typed
+        self.history = history
+        self.podio = podio
+        self.chunk_size = chunk_size
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.snapshots = SchemaSnapshots(db)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def io(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def watermark(self, app_id):
+        doc = await self.db.export_state.find_one({'_id': f'parquet:{app_id}'})
+        return doc['watermark'] if doc else None
+
+    async def fields_info(self, app_id):
+        if self.podio:
+            fields_info = await self.podio.get_app_fields_data(app_id)
+            if fields_info:
+                return {str(field_id): info for field_id, info in fields_info.items()}
+        snapshot = await self.snapshots.latest(app_id)
+        return snapshot['fields'] if snapshot else {}
+
+    @staticmethod
+    def app_query(app_id, field_ids):
+        '''
+        Current items of the app: by app_id, or for items stored without one (e.g. by the sync engine) by the app's fields.
+        '''
+        clauses = [{'app_id': app_id}]
+        if field_ids:
+            clauses.append({'app_id': None, '$or': [{f'data.{field_id}': {'$exists': True}} for field_id in field_ids]})
+        return {'current': 1, '$or': clauses}
+
+    async def current_items(self, query):
+        async for doc in self.db.podio_items.find(query, projection={'item_id': 1, 'data': 1, 'timestamp': 1}, batch_size=self.chunk_size):
+            yield doc['item_id'], doc.get('data') or {}, doc.get('timestamp')
+
+    async def items_since(self, app_id, since, field_ids=()):
+        '''
+        Yields (item_id, data, timestamp) for items of `app_id` stored since `since` (all items when None).
+        `field_ids` are the app's fields, used to find items stored without an app_id.
+        '''
+        if self.podio:
+            filters = {}
+            if since is not None:
+                filters['last_edit_on'] = {'from': since.strftime('%Y-%m-%d %H:%M:%S')}
+            async for page in self.podio.iter_filtered_items(app_id, filters, pages=True):
+                timestamp = datetime.now(timezone.utc)
+                for item_id, data in page.items():
+                    yield str(item_id), data, timestamp
+            return
+        query = self.app_query(str(app_id), field_ids)
+        if since is None:
+            async for row in self.current_items(query):
+                yield row
+            return
+        since_id = ObjectId.from_datetime(since)
+        if self.history != 'delta':  # Every stored version is a new document, so its _id is the store time.
+            async for row in self.current_items({**query, '_id': {'$gte': since_id}}):
+                yield row
+            return
+        # Delta mode updates the current document in place; its change records carry the store time.
+        seen = set()
+        item_ids = []
+        changes = self.db.podio_item_changes.find({'_id': {'$gte': since_id}}, projection={'item_id': 1}, sort=[('_id', 1)], batch_size=self.chunk_size)
+        async for change in changes:
+            if change['item_id'] in seen:
+                continue
+            seen.add(change['item_id'])
+            item_ids.append(change['item_id'])
+            if len(item_ids) >= self.chunk_size:
+                async for row in self.current_items({**query, 'item_id': {'$in': item_ids}}):
+                    yield row
+                item_ids = []
+        if item_ids:
+            async for row in self.current_items({**query, 'item_id': {'$in': item_ids}}):
+                yield row
+
+    def record_batch(self, rows, schema, field_ids):
+        columns = [
+            [item_id for item_id, _, _ in rows],
+            [timestamp.replace(tzinfo=None) if timestamp else None for _, _, timestamp in rows]
+        ]
+        for position, field_id in enumerate(field_ids):
+            column_type = schema.field(position + 2).type
+            values = []
+            for _, data, _ in rows:
+                value = data.get(field_id)
+                if not self.typed and isinstance(value, dict):
+                    value = value.get('field_value')
+                values.append(arrow_value(value, column_type))
+            columns.append(values)
+        return pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+    def open_partition(self, staging, partition, schema):
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        os.makedirs(os.path.dirname(partition), exist_ok=True)
+        return pq.ParquetWriter(os.path.join(staging, 'part-0.parquet'), schema)
+
+    def write_rows(self, writer, rows, schema, field_ids):
+        writer.write_batch(self.record_batch(rows, schema, field_ids))
+
+    def close_partition(self, writer, staging, partition, keep):
+        '''
+        Closes the staged file and moves it into place, or discards it when `keep` is False.
+        '''
+        writer.close()
+        if keep:
+            os.replace(staging, partition)
+        else:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    async def export_app(self, app_id, full=False):
+        '''
+        Writes one partition for `app_id`: every current item on the first export (or with full=True), otherwise
+        items changed since the last watermark. Returns the number of rows written.
+        '''
+        app_id = str(app_id)
+        run_started = datetime.now(timezone.utc)
+        watermark = None if full else await self.watermark(app_id)
+        since = watermark.replace(tzinfo=timezone.utc) - self.overlap if watermark else None
+        schema, field_ids = item_schema(await self.fields_info(app_id), self.typed)
+        stamp = run_started.strftime('%Y%m%dT%H%M%S')
+        partition = os.path.join(self.root, f'app_id={app_id}', f'watermark={stamp}')
+        staging = os.path.join(self.root, '_staging', f'{app_id}-{stamp}')
+        writer = await self.io(self.open_partition, staging, partition, schema)
+        count = 0
+        rows = []
+        try:
+            with timed(SPAN_SECONDS, span='parquet_export_app'):
+                async for row in self.items_since(app_id, since, field_ids):
+                    rows.append(row)
+                    if len(rows) >= self.chunk_size:
+                        await self.io(self.write_rows, writer, rows, schema, field_ids)
+                        count += len(rows)
+                        rows = []
+                if rows:
+                    await self.io(self.write_rows, writer, rows, schema, field_ids)
+                    count += len(rows)
+        except BaseException:
+            await self.io(self.close_partition, writer, staging, partition, False)
+            raise
+        await self.io(self.close_partition, writer, staging, partition, count > 0)
+        await self.db.export_state.update_one(
+            {'_id': f'parquet:{app_id}'},
+            {'$set': {'watermark': run_started, 'exported_at': datetime.now(timezone.utc), 'last_count': count}},
+            upsert=True
+        )
+        print(f'Exported {count} items of app {app_id} to Parquet ({"incremental" if since else "full"}).')
+        return count
+
+    async def export_apps(self, app_ids):
+        '''
+        Exports each app in turn (one at a time keeps memory to one chunk). Returns { app_id: rows }, None for failures.
+        '''
+        report = {}
+        for app_id in app_ids:
+            try:
+                report[str(app_id)] = await self.export_app(app_id)
+            except Exception as e:
+                print(f'Parquet export of app {app_id} failed, watermark kept.\n{e}')
+                report[str(app_id)] = None
+        return report
@@ -0,0 +1,132 @@
+import hashlib, json
+from datetime import datetime, timezone
+
+'''
+Versioned snapshots of Podio app schemas in the 'app_schemas' collection.
+
+Each document is one version of one app: { app_id, version, app_name, space_name, space_app_id, hash, etag,
+fields, diff, taken_at }, with fields keyed by str(field_id). A new version is written only when the schema
+hash changes; `diff` records what changed against the previous version so metadata updates (label and
+datatype changes downstream) can be applied per field instead of re-pulling the whole org.
+'''
+
+def stored_fields(fields_info):
+    '''
+    Converts a get_app_fields_data result to the stored form, keyed by str(field_id).
+    '''
+    return {str(field_id): info for field_id, info in fields_info.items()}
+
+def schema_hash(fields):
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+def diff_fields(old, new):
+    '''
+    Compares two stored field maps and returns only the non-empty parts of
+    { added: { field_id: label }, removed: { field_id: label },
+      renamed: { field_id: [old_label, new_label] }, type_changed: { field_id: [old_type, new_type] } }.
+    Types are compared as 'type' or 'type/return_type' when the two differ (e.g. 'calculation/number').
+    '''
+    def type_of(info):
+        return info['type'] if info.get('return_type') in (None, info['type']) else f'{info['type']}/{info['return_type']}'
+
+    diff = {
+        'added': {field_id: new[field_id]['field_label'] for field_id in new.keys() - old.keys()},
+        'removed': {field_id: old[field_id]['field_label'] for field_id in old.keys() - new.keys()},
+        'renamed': {},
+        'type_changed': {}
+    }
+    for field_id in old.keys() & new.keys():
+        if old[field_id]['field_label'] != new[field_id]['field_label']:
+            diff['renamed'][field_id] = [old[field_id]['field_label'], new[field_id]['field_label']]
+        if type_of(old[field_id]) != type_of(new[field_id]):
+            diff['type_changed'][field_id] = [type_of(old[field_id]), type_of(new[field_id])]
+    return {key: value for key, value in diff.items() if value}
+
+
+class SchemaSnapshots:
+    '''
+    Reads and writes app schema versions for one database.
+    '''
+    def __init__(self, db):
+        self.collection = db.app_schemas
+
+    async def latest(self, app_id):
+        return await self.collection.find_one({'app_id': str(app_id)}, sort=[('version', -1)])
+
+    async def latest_all(self):
+        '''
+        Returns { app_id: latest snapshot } for every known app.
+        '''
+        pipeline = [
+            {'$sort': {'app_id': 1, 'version': -1}},
+            {'$group': {'_id': '$app_id', 'doc': {'$first': '$$ROOT'}}}
+        ]
+        return {group['_id']: group['doc'] async for group in await self.collection.aggregate(pipeline)}
+
+    async def load_into(self, cleaner):
+        '''
+        Precompiles `cleaner` (an ItemCleaner) from the latest snapshot of every app.
+        Field ids are unique across the org, so one cleaner can serve all apps. Returns the number of apps loaded.
+        '''
+        known = await self.latest_all()
+        for doc in known.values():
+            cleaner.load_schema(doc['fields'])
+        return len(known)
+
+    async def record(self, app_id, fields_info, etag=None, previous=None, **app_info):
+        '''
+        Stores a new version if the schema differs from the latest one.
+        Returns the diff against the previous version (every field 'added' for a first snapshot), or None if unchanged.
+        '''
+        if previous is None:
+            previous = await self.latest(app_id)
+        if previous:  # Single-app refreshes do not know the names; keep the last walk's.
+            app_info = {key: previous[key] for key in ('app_name', 'space_name', 'space_app_id') if key in previous} | app_info
+        fields = stored_fields(fields_info)
+        digest = schema_hash(fields)
+        now = datetime.now(timezone.utc)
+        if previous and previous['hash'] == digest:
+            await self.collection.update_one({'_id': previous['_id']}, {'$set': {'etag': etag, 'checked_at': now}})
+            return None
+        diff = diff_fields(previous['fields'] if previous else {}, fields)
+        await self.collection.insert_one({
+            'app_id': str(app_id),
+            'version': previous['version'] + 1 if previous else 1,
+            'hash': digest,
+            'etag': etag,
+            'fields': fields,
+            'diff': diff,
+            'taken_at': now,
+            'checked_at': now,
+            **app_info
+        })
+        return diff
+
+    async def refresh(self, podio):
+        '''
+        Walks the org with podio.get_podio_system_setup (conditional on the stored ETags) and records changed apps.
+        Unchanged apps are loaded into podio's item cleaner from their stored snapshot.
+        Returns [{ app_id, app_name, space_name, version, diff }] for apps with a new version.
+        '''
+        known = await self.latest_all()
+        etags = {app_id: doc['etag'] for app_id, doc in known.items() if doc.get('etag')}
+        org_info = await podio.get_podio_system_setup(etags)
+        changes = []
+        for space_name, apps in org_info.items():
+            for app_name, app in apps.items():
+                previous = known.get(app['app_id'])
+                if app['fields'] is None:
+                    if previous:
+                        podio.item_cleaner.load_schema(previous['fields'])
+                    continue
+                diff = await self.record(app['app_id'], app['fields'], app['etag'], previous,
+                                         app_name=app_name, space_name=space_name, space_app_id=app['space_app_id'])
+                if diff is not None:
+                    changes.append({
+                        'app_id': app['app_id'],
+                        'app_name': app_name,
+                        'space_name': space_name,
+                        'version': previous['version'] + 1 if previous else 1,
+                        'diff': diff
+                    })
+        return changes
@@ -0,0 +1,399 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from PodioSchemaSnapshots import SchemaSnapshots
+from PodioMetrics import timed, SPAN_SECONDS, Counter
+
+"""
+Change-data export of current items from 'podio_items' to the SQL AdHoc server (MySQL 8.0, or SQLite locally).
+- One table per app, podio_app_<app_id>, keyed by item_id with one column per field (field_<field_id>);
+  columns are added as fields appear in the app_schemas snapshots. 'podio_fields' maps every column back to
+  its app, label and type, so label and datatype changes reach the AdHoc server as metadata updates.
+- Items are exported as whole rows with batched upserts, so replaying a batch is harmless.
+- On a replica set the exporter tails podio_items with a change stream and persists its resume token in
+  'export_state' after every committed batch. On a standalone server it polls by ObjectId instead: new
+  versions in podio_items for history='copies', change records in podio_item_changes for history='delta'.
+- The first run (or one whose resume token is no longer in the oplog) copies every current item once.
+- If writing an app's rows fails, the rows are parked in 'sql_export_parked' and the export moves on; parked
+  items are re-exported from their current documents every parked_retry_seconds.
+"""
+SQL_EXPORT_ROWS = Counter('sql_export_rows_total', 'Item rows upserted into the SQL export tables.')
+
+DIALECTS = {
+    'sqlite': {
+        'param': '?',
+        'quote': '"',
+        'key_type': 'TEXT',
+        'types': {'text': 'TEXT', 'number': 'REAL', 'date': 'TEXT'},
+        'native_dates': False,
+        'upsert': 'INSERT INTO {table} ({columns}) VALUES ({params}) ON CONFLICT({key}) DO UPDATE SET {updates}',
+        'update': '{column} = excluded.{column}',
+        'modify': None  # SQLite columns take any type.
+    },
+    'mysql': {
+        'param': '%s',
+        'quote': '`',
+        'key_type': 'VARCHAR(32)',
+        'types': {'text': 'TEXT', 'number': 'DOUBLE', 'date': 'DATETIME'},
+        'native_dates': True,
+        'upsert': 'INSERT INTO {table} ({columns}) VALUES ({params}) AS new ON DUPLICATE KEY UPDATE {updates}',
+        'update': '{column} = new.{column}',
+        'modify': 'ALTER TABLE {table} MODIFY COLUMN {column} {type}'
+    }
+}
+
+def value_kind(info, typed):
+    '''
+    'number', 'date' or 'text' for a field's stored values. The labeled layout keeps most values as
+    comma-joined text; only money (and, typed, numbers and dates) have a native column type.
+    '''
+    field_type = info.get('type')
+    if field_type == 'calculation':
+        field_type = info.get('return_type')
+    if field_type == 'money' or (typed and field_type == 'number'):
+        return 'number'
+    if typed and field_type == 'date':
+        return 'date'
+    return 'text'
+
+def app_key(app_id):
+    '''
+    The app_id as a table-name-safe string of digits, or None if it is not an integer id.
+    '''
+    if isinstance(app_id, int) and not isinstance(app_id, bool):
+        return str(app_id) if app_id >= 0 else None
+    if isinstance(app_id, str) and app_id.isascii() and app_id.isdigit():
+        return str(int(app_id))
+    return None
+
+def field_value(value, typed):
+    '''
+    Flattens one stored field value into a SQL parameter.
+    '''
+    if not typed:
+        value = value.get('field_value') if isinstance(value, dict) else value
+    if isinstance(value, list):
+        return ','.join(str(part) for part in value)
+    return value
+
+
+class SqlExporter:
+    '''
+    Streams current podio_items documents into per-app SQL tables.
+
+    `connect` returns a DB-API connection (e.g. `lambda: sqlite3.connect('adhoc.db')`, or a pymysql/mysql-connector
+    connection for `dialect='mysql'`); it is opened and used on one dedicated thread so SQL writes never block
+    the event loop. `typed` must match how items were stored (typed_item_values), `history` the item_history mode.
+    State is kept in the 'export_state' document `name`, so several exporters can run against different targets.
+    '''
+    def __init__(self, db, connect, dialect='sqlite', typed=False, history='copies', name='sql', batch_size=500,
+                 flush_interval=1.0, poll_seconds=10, settle_seconds=5, parked_retry_seconds=300):
+        self.db = db
+        self.connect = connect
+        self.dialect = DIALECTS[dialect]
+        self.typed = typed
+        self.history = history
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.parked_retry_seconds = parked_retry_seconds
+        self.parked_retried = None
+        self.snapshots = SchemaSnapshots(db)
+        self.schemas = {}
+        self.field_apps = {}
+        self.fields = {}
+        self.connection = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def quote(self, name):
+        quote = self.dialect['quote']
+        return f'{quote}{str(name).replace(quote, quote * 2)}{quote}'
+
+    async def sql(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def execute(self, statement, params=()):
+        cursor = self.connection.cursor()
+        cursor.execute(statement.replace('?', self.dialect['param']), params)
+        return cursor
+
+    def open(self):
+        '''
+        Connects and creates the metadata table; runs on the SQL thread.
+        '''
+        self.connection = self.connect()
+        key = self.dialect['key_type']
+        self.execute(
+            f'CREATE TABLE IF NOT EXISTS podio_fields (app_id {key} NOT NULL, field_id {key} NOT NULL, '
+            f'column_name {key}, column_type {key}, field_label TEXT, field_type {key}, return_type {key}, '
+            f'app_name TEXT, space_name TEXT, schema_version INTEGER, PRIMARY KEY (app_id, field_id))'
+        )
+        for app_id, field_id, *exported in self.execute(
+                'SELECT app_id, field_id, column_type, field_label, field_type, return_type, schema_version FROM podio_fields').fetchall():
+            self.fields.setdefault(app_id, {})[field_id] = tuple(exported)
+        self.connection.commit()
+
+    async def load_schemas(self):
+        self.schemas = await self.snapshots.latest_all()
+        self.field_apps = {field_id: app_id for app_id, doc in self.schemas.items() for field_id in doc['fields']}
+
+    def app_of(self, doc):
+        '''
+        The item's app: stored app_id, or else the app whose schema has the item's fields (field ids are org-unique).
+        Returns None for an app_id that is not an integer.
+        '''
+        if doc.get('app_id'):
+            return app_key(doc['app_id'])
+        return next((self.field_apps[field_id] for field_id in doc.get('data') or {} if field_id in self.field_apps), None)
+
+    def field_infos(self, app_id, docs):
+        '''
+        { field_id: field info } from the app schema, plus fields seen in `docs` that the snapshot does not know yet.
+        '''
+        schema = self.schemas.get(app_id)
+        infos = dict(schema['fields']) if schema else {}
+        for doc in docs:
+            for field_id, value in (doc.get('data') or {}).items():
+                if field_id not in infos:
+                    infos[field_id] = {'type': value.get('field_type'), 'field_label': value.get('field_label')} if isinstance(value, dict) else {}
+        return infos
+
+    def sync_table(self, app_id, infos):
+        '''
+        Creates the app's table and adds or retypes columns for its fields; runs on the SQL thread.
+        '''
+        table = self.quote(f'podio_app_{app_id}')
+        types = self.dialect['types']
+        self.execute(f'CREATE TABLE IF NOT EXISTS {table} (item_id {self.dialect['key_type']} PRIMARY KEY, '
+                     f'podio_timestamp {types['date']}, exported_at {types['date']})')
+        existing = {description[0] for description in self.execute(f'SELECT * FROM {table} LIMIT 0').description}
+        schema = self.schemas.get(app_id) or {}
+        exported = self.fields.setdefault(app_id, {})
+        for field_id, info in infos.items():
+            column = f'field_{field_id}'
+            column_type = types[value_kind(info, self.typed)]
+            if column not in existing:
+                self.execute(f'ALTER TABLE {table} ADD COLUMN {self.quote(column)} {column_type}')
+            elif field_id in exported and exported[field_id][0] != column_type and self.dialect['modify']:
+                self.execute(self.dialect['modify'].format(table=table, column=self.quote(column), type=column_type))
+            current = (column_type, info.get('field_label'), info.get('type'), info.get('return_type'), schema.get('version'))
+            if exported.get(field_id) != current:
+                columns = ['app_id', 'field_id', 'column_name', 'column_type', 'field_label', 'field_type', 'return_type',
+                           'schema_version', 'app_name', 'space_name']
+                self.execute(self.upsert_statement('podio_fields', columns, key=['app_id', 'field_id']),
+                             (app_id, field_id, column, *current, schema.get('app_name'), schema.get('space_name')))
+                exported[field_id] = current
+        return table
+
+    def upsert_statement(self, table, columns, key=('item_id',)):
+        return self.dialect['upsert'].format(
+            table=table,
+            columns=', '.join(columns),
+            params=', '.join('?' * len(columns)),
+            key=', '.join(key),
+            updates=', '.join(self.dialect['update'].format(column=column) for column in columns if column not in key)
+        )
+
+    def write_app(self, app_id, infos, docs):
+        '''
+        Upserts the rows of one app in a single executemany and commits; runs on the SQL thread.
+        '''
+        table = self.sync_table(app_id, infos)
+        field_ids = list(infos)
+        columns = ['item_id', 'podio_timestamp', 'exported_at'] + [self.quote(f'field_{field_id}') for field_id in field_ids]
+        def date(value):
+            return value.isoformat(' ') if isinstance(value, datetime) and not self.dialect['native_dates'] else value
+        exported_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = []
+        for doc in docs:
+            data = doc.get('data') or {}
+            rows.append([doc['item_id'], date(doc.get('timestamp')), date(exported_at)] +
+                        [date(field_value(data.get(field_id), self.typed)) for field_id in field_ids])
+        self.connection.cursor().executemany(
+            self.upsert_statement(table, columns).replace('?', self.dialect['param']), rows
+        )
+        self.connection.commit()
+
+    async def export_docs(self, docs):
+        '''
+        Writes current item documents to their app tables. Returns the number of rows upserted.
+        '''
+        latest = {}
+        for doc in docs:  # Later documents in a batch are newer.
+            latest[doc['item_id']] = doc
+        if any(self.app_of(doc) not in self.schemas for doc in latest.values()):
+            await self.load_schemas()
+        by_app = {}
+        for doc in latest.values():
+            app_id = self.app_of(doc)
+            if app_id is None:
+                print(f'Item {doc['item_id']} has no valid app_id ({doc.get('app_id')!r}) and no known field; not exported.')
+                continue
+            by_app.setdefault(app_id, []).append(doc)
+        count = 0
+        with timed(SPAN_SECONDS, span='sql_export_batch'):
+            for app_id, app_docs in by_app.items():
+                try:
+                    await self.sql(self.write_app, app_id, self.field_infos(app_id, app_docs), app_docs)
+                except Exception as e:
+                    await self.sql(self.rollback)
+                    await self.park(app_id, app_docs, e)
+                    continue
+                count += len(app_docs)
+        SQL_EXPORT_ROWS.inc(count)
+        return count
+
+    def rollback(self):
+        try:
+            self.connection.rollback()
+        except Exception as e:
+            print(f'SQL export rollback failed.\n{e}')
+
+    async def park(self, app_id, docs, error):
+        '''
+        Records items whose rows could not be written in 'sql_export_parked', one document per exporter and item.
+        '''
+        failed_at = datetime.now(timezone.utc)
+        await self.db.sql_export_parked.bulk_write([
+            UpdateOne(
+                {'exporter': self.name, 'item_id': doc['item_id']},
+                {'$set': {'app_id': app_id, 'error': str(error), 'failed_at': failed_at}, '$inc': {'failures': 1}},
+                upsert=True
+            )
+            for doc in docs
+        ], ordered=False)
+        # send email to crm admin
+        print(f'ALERT: SQL export of {len(docs)} items of app {app_id} failed, parked in sql_export_parked.\n{error}')
+
+    async def retry_parked(self):
+        '''
+        Re-exports parked items from their current documents; items that fail again stay parked. Returns the number exported.
+        '''
+        started = datetime.now(timezone.utc)
+        self.parked_retried = started
+        parked = await self.db.sql_export_parked.find({'exporter': self.name}, projection={'item_id': 1}).to_list()
+        count = 0
+        item_ids = [doc['item_id'] for doc in parked]
+        for start in range(0, len(item_ids), self.batch_size):
+            docs = await self.db.podio_items.find({'item_id': {'$in': item_ids[start:start + self.batch_size]}, 'current': 1}).to_list()
+            count += await self.export_docs(docs)
+        if parked:
+            await self.db.sql_export_parked.delete_many({'exporter': self.name, 'failed_at': {'$lt': started}})
+            print(f'Re-exported {count} of {len(parked)} parked items.')
+        return count
+
+    async def retry_parked_due(self):
+        if self.parked_retried is None or datetime.now(timezone.utc) - self.parked_retried >= timedelta(seconds=self.parked_retry_seconds):
+            await self.retry_parked()
+
+    async def state(self):
+        return await self.db.export_state.find_one({'_id': self.name}) or {}
+
+    async def save_state(self, **fields):
+        await self.db.export_state.update_one(
+            {'_id': self.name}, {'$set': {**fields, 'exported_at': datetime.now(timezone.utc)}}, upsert=True
+        )
+
+    async def full_export(self):
+        '''
+        Copies every current item, in _id order and batch_size documents at a time. Returns the number exported.
+        '''
+        count = 0
+        last_id = ObjectId('0' * 24)
+        while True:
+            docs = await self.db.podio_items.find(
+                {'_id': {'$gt': last_id}, 'current': 1}, sort=[('_id', 1)], limit=self.batch_size
+            ).to_list()
+            if not docs:
+                break
+            count += await self.export_docs(docs)
+            last_id = docs[-1]['_id']
+        print(f'Full SQL export copied {count} items.')
+        return count
+
+    async def tail_change_stream(self, resume_token):
+        '''
+        Exports podio_items changes from `resume_token` (or now) on, saving the token after each batch.
+        '''
+        pipeline = [{'$match': {
+            'operationType': {'$in': ['insert', 'update', 'replace']},
+            'fullDocument.current': 1
+        }}]
+        async with await self.db.podio_items.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+            if resume_token is None:  # Stream is open, so nothing written during the copy is missed.
+                await self.full_export()
+                await self.save_state(mode='change_stream', resume_token=stream.resume_token)
+            while True:
+                docs = []
+                deadline = asyncio.get_running_loop().time() + self.flush_interval
+                while len(docs) < self.batch_size and asyncio.get_running_loop().time() < deadline:
+                    change = await stream.try_next()
+                    if change is None:
+                        await asyncio.sleep(min(0.1, self.flush_interval))
+                        continue
+                    if change.get('fullDocument'):
+                        docs.append(change['fullDocument'])
+                if docs:
+                    await self.export_docs(docs)
+                await self.retry_parked_due()
+                if docs or stream.resume_token != resume_token:
+                    resume_token = stream.resume_token
+                    await self.save_state(mode='change_stream', resume_token=resume_token)
+
+    async def poll(self, last_id):
+        '''
+        Exports by ObjectId from `last_id` on, for servers without change streams. ObjectIds younger than
+        settle_seconds are left for the next round, so inserts from other workers with slightly older ids are not skipped.
+        '''
+        if last_id is None:
+            last_id = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.settle_seconds))
+            await self.full_export()
+            await self.save_state(mode='poll', last_id=last_id)
+        source = self.db.podio_item_changes if self.history == 'delta' else self.db.podio_items
+        while True:
+            settled = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.settle_seconds))
+            query = {'_id': {'$gt': last_id, '$lt': settled}}
+            if self.history != 'delta':
+                query['current'] = 1
+            found = await source.find(query, sort=[('_id', 1)], limit=self.batch_size).to_list()
+            if found:
+                docs = found
+                if self.history == 'delta':
+                    item_ids = list({change['item_id'] for change in found})
+                    docs = await self.db.podio_items.find({'item_id': {'$in': item_ids}, 'current': 1}).to_list()
+                await self.export_docs(docs)
+                last_id = found[-1]['_id']
+                await self.save_state(mode='poll', last_id=last_id)
+            await self.retry_parked_due()
+            if len(found) < self.batch_size:
+                await asyncio.sleep(self.poll_seconds)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.sql(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=False)
+
+    async def run(self):
+        '''
+        Exports continuously: change stream when the server supports it, ObjectId polling otherwise.
+        '''
+        await self.sql(self.open)
+        await self.load_schemas()
+        state = await self.state()
+        while state.get('mode') != 'poll':
+            try:
+                await self.tail_change_stream(state.get('resume_token'))
+            except OperationFailure as e:
+                if state.get('resume_token') is not None and e.code == 286:  # ChangeStreamHistoryLost
+                    print(f'SQL export resume token is no longer in the oplog; re-exporting all items.\n{e}')
+                    state = {}
+                    continue
+                print(f'Change stream unavailable, exporting by polling every {self.poll_seconds}s.\n{e}')
+                state = {'mode': 'poll'}
+        await self.poll(state.get('last_id'))
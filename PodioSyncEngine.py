@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import PodioItemStore
+from PodioMetrics import timed, SPAN_SECONDS
+
+class PodioSyncEngine:
+    '''
+    Incremental reconciliation of Podio apps into 'podio_items', to catch changes whose webhooks never arrived.
+
+    Each app keeps a last_edit_on watermark in the 'sync_watermarks' collection ({ _id: app_id, last_edit_on, ... }).
+    A run fetches only items edited since the watermark (minus `overlap_seconds`, to absorb clock skew and items
+    edited while the previous run was paging) and stores every page as it arrives. The watermark only moves
+    forward, to the time the run started, once the whole app has been stored; a failed app is retried from its
+    old watermark next run. Apps without a watermark are pulled in full.
+
+    Apps sync in parallel, at most `max_parallel_apps` at a time (default: one per credential in the podio
+    client's CredentialPool), with all requests sharing the pool's rate limit budget.
+    `history` is passed to PodioItemStore.store_items ('copies' or 'delta').
+    '''
+    def __init__(self, podio, db, max_parallel_apps=None, overlap_seconds=300, history='copies'):
+        self.podio = podio
+        self.db = db
+        self.history = history
+        if max_parallel_apps is None:
+            max_parallel_apps = len(podio.credential_pool) if podio.credential_pool else 1
+        self.semaphore = asyncio.Semaphore(max_parallel_apps)
+        self.overlap = timedelta(seconds=overlap_seconds)
+
+    async def watermark(self, app_id):
+        doc = await self.db.sync_watermarks.find_one({'_id': str(app_id)})
+        return doc['last_edit_on'] if doc else None
+
+    def filters_since(self, watermark):
+        '''
+        Returns the get_filtered_items filters for items edited since `watermark` (all items when None).
+        '''
+        if watermark is None:
+            return {}
+        edited_since = watermark.replace(tzinfo=timezone.utc) - self.overlap
+        return {'last_edit_on': {'from': edited_since.strftime('%Y-%m-%d %H:%M:%S')}}
+
+    async def sync_app(self, app_id):
+        '''
+        Stores every item of `app_id` edited since its watermark, then advances the watermark.
+        Returns the number of items stored.
+        '''
+        async with self.semaphore:
+            run_started = datetime.now(timezone.utc)
+            watermark = await self.watermark(app_id)
+            filters = self.filters_since(watermark)
+            count = 0
+            with timed(SPAN_SECONDS, span='sync_app'):
+                async for page in self.podio.iter_filtered_items(app_id, filters, pages=True):
+                    timestamp = datetime.now(timezone.utc)
+                    items = [({'item_id': item_id, 'data': item_dict}, timestamp, app_id) for item_id, item_dict in page.items()]
+                    count += await PodioItemStore.store_items(self.db, items, history=self.history)
+            await self.db.sync_watermarks.update_one(
+                {'_id': str(app_id)},
+                {'$set': {'last_edit_on': run_started, 'synced_at': datetime.now(timezone.utc), 'last_count': count}},
+                upsert=True
+            )
+            print(f'Synced {count} items from app {app_id} ({"full" if watermark is None else "incremental"}).')
+            return count
+
+    async def run(self, app_ids):
+        '''
+        Syncs `app_ids` in parallel. Returns { app_id: items_stored }, with None for apps that failed.
+        '''
+        app_ids = [str(app_id) for app_id in app_ids]
+        results = await asyncio.gather(*[self.sync_app(app_id) for app_id in app_ids], return_exceptions=True)
+        report = {}
+        for app_id, result in zip(app_ids, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                print(f'Sync of app {app_id} failed, watermark kept.\n{result}')
+                result = None
+            report[app_id] = result
+        return report
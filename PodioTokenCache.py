@@ -0,0 +1,119 @@
+import asyncio, json, os, socket, time, requests
+
+class TokenCache:
+    '''
+    Caches Podio OAuth tokens per client_id so clients and restarts reuse them instead of re-authenticating.
+
+    Tokens are refreshed with the refresh_token grant once they are within `refresh_margin` seconds of
+    `expires_in`, falling back to the password grant when the refresh fails. With a `path` the cache is
+    persisted as JSON (mode 600) after every change and loaded again on startup; several processes may share
+    one path, each writing through its own temporary file.
+    '''
+    def __init__(self, base_url, path=None, refresh_margin=300):
+        self.auth_url = base_url + 'oauth/token'
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.tokens = self.load()
+        self.locks = {}
+        self.auth_count = 0
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Could not read token cache {self.path}, starting empty.\n{e}')
+            return {}
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.{socket.gethostname()}-{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.tokens, f)
+        os.replace(tmp_path, self.path)
+
+    def cached(self, client_id):
+        '''
+        Returns the cached access token for client_id if it is not close to expiring.
+        '''
+        entry = self.tokens.get(client_id)
+        if entry and entry['expires_at'] - self.refresh_margin > time.time():
+            return entry['access_token']
+        return None
+
+    def invalidate(self, client_id):
+        '''
+        Marks a token as expired (e.g. after a 401) while keeping its refresh_token.
+        '''
+        if client_id in self.tokens:
+            self.tokens[client_id]['expires_at'] = 0
+            self.save()
+
+    def store(self, client_id, payload):
+        self.tokens[client_id] = {
+            'access_token': payload['access_token'],
+            'refresh_token': payload.get('refresh_token'),
+            'expires_at': time.time() + payload.get('expires_in', 0)
+        }
+        self.save()
+        return payload['access_token']
+
+    def grants(self, credential):
+        '''
+        Yields the token request bodies to try in order: refresh_token grant (if known), then password grant.
+        '''
+        entry = self.tokens.get(credential.client_id)
+        if entry and entry.get('refresh_token'):
+            yield {
+                'grant_type': 'refresh_token',
+                'client_id': credential.client_id,
+                'client_secret': credential.client_secret,
+                'refresh_token': entry['refresh_token']
+            }
+        yield {
+            'grant_type': 'password',
+            'client_id': credential.client_id,
+            'client_secret': credential.client_secret,
+            'username': credential.username,
+            'password': credential.password
+        }
+
+    async def get_token(self, client, credential):
+        '''
+        Returns a valid access token for `credential`, authenticating through the httpx `client` only when needed.
+        Concurrent callers for the same client_id share one refresh.
+        '''
+        token = self.cached(credential.client_id)
+        if token:
+            return token
+        lock = self.locks.setdefault(credential.client_id, asyncio.Lock())
+        async with lock:
+            token = self.cached(credential.client_id)
+            if token:
+                return token
+            for data in self.grants(credential):
+                response = await client.post(self.auth_url, data=data)
+                self.auth_count += 1
+                if response.status_code == 200:
+                    return self.store(credential.client_id, response.json())
+            print(f'Failed to authenticate {credential.client_id}. Response: {response.text}')
+            return None
+
+    def get_token_sync(self, credential):
+        '''
+        Blocking version of get_token for the synchronous PodioAPI.
+        '''
+        token = self.cached(credential.client_id)
+        if token:
+            return token
+        for data in self.grants(credential):
+            response = requests.post(self.auth_url, data=data)
+            self.auth_count += 1
+            if response.status_code == 200:
+                return self.store(credential.client_id, response.json())
+        print(f'Failed to authenticate {credential.client_id}. Response: {response.text}')
+        return None
@@ -0,0 +1,202 @@
+import asyncio, math, zlib
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import BulkWriteError
+
+"""
+Sharded queue consumers for running the gateway in several processes or hosts.
+- Every queue event carries shard = crc32(item_id) % shards (shard_for), so all events of one item land in
+  the same shard and are processed by whichever worker currently leases that shard, in queue order.
+- Workers heartbeat into 'worker_heartbeats' and lease shards in 'shard_leases'; each live worker takes
+  ceil(shards / live workers) and gives up the rest, so shards rebalance when workers join or leave.
+  A crashed worker's leases expire after lease_seconds.
+- Each worker schedules Podio requests on its own slice of the credential pool (CredentialPool.use_only).
+- One worker at a time holds the 'leader' lease and runs the singleton jobs (schema walks, syncs).
+- A worker that cannot renew its leases stops claiming and stops its leader jobs before the leases expire,
+  so no shard or job ever runs on two workers at once.
+"""
+LEADER_ID = 'leader'
+
+def shard_for(key, shards):
+    '''
+    Stable shard number for an item_id (or app_id) that every process computes the same way.
+    '''
+    return zlib.crc32(str(key).encode()) % shards
+
+def credential_slice(keys, index, workers):
+    '''
+    Returns the credential keys for the worker at `index` of `workers`: every workers-th key, or a single
+    shared key when there are more workers than credentials.
+    '''
+    if workers <= len(keys):
+        return keys[index::workers]
+    return [keys[index % len(keys)]]
+
+
+class ShardCoordinator:
+    '''
+    Keeps this worker's shard leases, credential slice and leadership up to date.
+
+    Call `start` once (first round, so `owned` is known before the queue worker claims anything), then run
+    `run` as a task. Jobs registered with `leader_job` run only while this worker is the leader, are restarted
+    if they stop, and are cancelled if leadership is lost or can no longer be renewed.
+    '''
+    def __init__(self, db, worker_id, shards, credential_pool=None, lease_seconds=30, heartbeat_seconds=10):
+        self.db = db
+        self.worker_id = worker_id
+        self.shards = shards
+        self.credential_pool = credential_pool
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.owned = set()
+        self.is_leader = False
+        self.live_workers = [worker_id]
+        self.leader_jobs = []
+        self.leader_tasks = []
+        self.renewed_at = None
+
+    def leader_job(self, factory):
+        '''
+        Registers a coroutine function to run while this worker is the leader.
+        '''
+        self.leader_jobs.append(factory)
+
+    async def start(self):
+        documents = [{'_id': shard, 'owner': None, 'lease_until': None} for shard in range(self.shards)]
+        documents.append({'_id': LEADER_ID, 'owner': None, 'lease_until': None})
+        try:
+            await self.db.shard_leases.insert_many(documents, ordered=False)
+        except BulkWriteError:  # Already created by another worker.
+            pass
+        await self.round()
+
+    async def heartbeat(self, now):
+        await self.db.worker_heartbeats.update_one({'_id': self.worker_id}, {'$set': {'seen': now}}, upsert=True)
+        cutoff = now - timedelta(seconds=self.heartbeat_seconds * 3)
+        self.live_workers = sorted([doc['_id'] async for doc in self.db.worker_heartbeats.find({'seen': {'$gte': cutoff}})])
+        if self.worker_id not in self.live_workers:
+            self.live_workers = sorted(self.live_workers + [self.worker_id])
+
+    async def lease(self, lease_id, now):
+        '''
+        Takes or renews one lease; returns True if this worker holds it afterwards.
+        '''
+        doc = await self.db.shard_leases.find_one_and_update(
+            {'_id': lease_id, '$or': [{'owner': self.worker_id}, {'owner': None}, {'lease_until': {'$lt': now}}]},
+            {'$set': {'owner': self.worker_id, 'lease_until': now + timedelta(seconds=self.lease_seconds)}}
+        )
+        return doc is not None
+
+    async def release(self, lease_ids):
+        await self.db.shard_leases.update_many(
+            {'_id': {'$in': list(lease_ids)}, 'owner': self.worker_id},
+            {'$set': {'owner': None, 'lease_until': None}}
+        )
+
+    async def rebalance(self, now):
+        target = math.ceil(self.shards / len(self.live_workers))
+        owned = set()
+        for shard in sorted(self.owned):  # Renew what we hold first.
+            if await self.lease(shard, now):
+                owned.add(shard)
+        extra = sorted(owned)[target:]
+        if extra:
+            await self.release(extra)
+            owned -= set(extra)
+        start = self.live_workers.index(self.worker_id) * target  # Start at our share so workers don't collide.
+        for offset in range(self.shards):
+            if len(owned) >= target:
+                break
+            shard = (start + offset) % self.shards
+            if shard not in owned and await self.lease(shard, now):
+                owned.add(shard)
+        if owned != self.owned:
+            print(f'Worker {self.worker_id} owns shards {sorted(owned)} of {self.shards} ({len(self.live_workers)} workers).')
+            self.owned = owned
+
+    def assign_credentials(self):
+        if not self.credential_pool:
+            return
+        keys = [credential.key for credential in self.credential_pool.credentials]
+        index = self.live_workers.index(self.worker_id)
+        self.credential_pool.use_only(credential_slice(keys, index, len(self.live_workers)))
+
+    def stop_leader_jobs(self):
+        for task in self.leader_tasks:
+            task.cancel()
+        self.leader_tasks = []
+
+    def restart_stopped_leader_jobs(self):
+        '''
+        Restarts leader jobs whose task ended (crashed or returned), logging why.
+        '''
+        for index, task in enumerate(self.leader_tasks):
+            if task.done():
+                error = None if task.cancelled() else task.exception()
+                print(f'Leader job {self.leader_jobs[index].__name__} stopped, restarting.' + (f'\n{error}' if error else ''))
+                self.leader_tasks[index] = asyncio.create_task(self.leader_jobs[index]())
+
+    async def elect(self, now):
+        leader = await self.lease(LEADER_ID, now)
+        if leader and not self.is_leader:
+            print(f'Worker {self.worker_id} is now the leader.')
+            self.leader_tasks = [asyncio.create_task(factory()) for factory in self.leader_jobs]
+        elif leader:
+            self.restart_stopped_leader_jobs()
+        elif self.is_leader:
+            print(f'Worker {self.worker_id} lost leadership.')
+            self.stop_leader_jobs()
+        self.is_leader = leader
+
+    def drop_expiring_leases(self, now):
+        '''
+        After failed rounds, gives up shards and leader jobs locally once the leases would expire before the
+        next round could renew them, since another worker may then take them over.
+        '''
+        if self.renewed_at is None or now + timedelta(seconds=self.heartbeat_seconds) < self.renewed_at + timedelta(seconds=self.lease_seconds):
+            return
+        if self.is_leader:
+            print(f'Worker {self.worker_id} could not renew leadership, stopping leader jobs.')
+            self.stop_leader_jobs()
+            self.is_leader = False
+        if self.owned:
+            print(f'Worker {self.worker_id} could not renew its shard leases, releasing shards {sorted(self.owned)}.')
+            self.owned = set()
+
+    async def round(self):
+        now = datetime.now(timezone.utc)
+        await self.heartbeat(now)
+        await self.rebalance(now)
+        self.assign_credentials()
+        await self.elect(now)
+        self.renewed_at = now
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.round()
+            except Exception as e:
+                print(f'Shard coordination round failed; leases expire in {self.lease_seconds}s if this persists.\n{e}')
+                self.drop_expiring_leases(datetime.now(timezone.utc))
+
+    async def stop(self):
+        '''
+        Gives up leases and leadership so other workers take over without waiting for expiry.
+        '''
+        self.stop_leader_jobs()
+        await self.release(list(self.owned) + ([LEADER_ID] if self.is_leader else []))
+        await self.db.worker_heartbeats.delete_one({'_id': self.worker_id})
+        self.owned = set()
+        self.is_leader = False
+
+
+async def assign_missing_shards(collection, shards, batch_size=1000):
+    '''
+    Sets 'shard' on queue documents written before sharding (by item_id, else app_id). Returns the number updated.
+    '''
+    updated = 0
+    async for doc in collection.find({'shard': {'$exists': False}}, projection={'item_id': 1, 'app_id': 1}, limit=batch_size):
+        key = doc.get('item_id', doc.get('app_id', doc['_id']))
+        result = await collection.update_one({'_id': doc['_id'], 'shard': {'$exists': False}}, {'$set': {'shard': shard_for(key, shards)}})
+        updated += result.modified_count
+    return updated
@@ -0,0 +1,104 @@
+"""
+Benchmark for item cleaning throughput on a recorded page of Podio filter results.
+
+Compares the original per-field `match` implementation with PodioItemCleaner, both with converters compiled
+lazily from the items and precompiled from the app schema, and the typed (native value) layout including its
+stored BSON size. Run from the repository root:
+
+    python benchmarks/bench_clean_item.py [--items 500] [--rounds 20]
+"""
+import argparse, copy, json, os, re, sys, time
+import bson
+from dateutil.parser import parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PodioApiWrapper import PodioAPI
+from PodioItemCleaner import ItemCleaner
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def legacy_clean_item(item):
+    """
+    The clean_item implementation before the cleaner registry, kept as the baseline.
+    """
+    item_dict = {}
+    for field in item['fields']:
+        values = field['values']
+        match field['type']:
+            case 'date':
+                value = ','.join([value['start'] for value in values])
+            case 'contact':
+                value = ','.join([value['value']['name'] for value in values])
+            case 'text':
+                value = ','.join([re.sub(r'<.*?>', '', (value['value'])) for value in values])
+            case 'category':
+                value = ','.join([value['value']['text'] for value in values])
+            case 'app':
+                value = ','.join([str(value['value']['item_id']) for value in values])
+            case 'phone' | 'email' | 'number' | 'location':
+                value = ','.join([value['value'] for value in values])
+            case 'calculation':
+                if 'start' in values[0].keys():
+                    value = ','.join([value['start'] for value in values])
+                else:
+                    try:
+                        value = ','.join([parse(value['value']).strftime('%Y-%m-%d') for value in values])
+                    except Exception:
+                        value = float(values[0]['value'])
+            case 'money':
+                value = float(values[0]['value'])
+        item_dict[str(field['field_id'])] = {
+            'field_id': field['field_id'],
+            'field_label': field['label'],
+            'field_type': field['type'],
+            'field_value': value
+        }
+    return item_dict
+
+def load_page(n_items):
+    with open(os.path.join(DATA_DIR, 'filtered_items_page.json')) as f:
+        recorded = json.load(f)['items']
+    items = []
+    for i in range(n_items):
+        item = copy.deepcopy(recorded[i % len(recorded)])
+        item['item_id'] += i
+        items.append(item)
+    return items
+
+def measure(name, clean, items, rounds):
+    clean(items[0])  # warm up converters
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for item in items:
+            clean(item)
+    elapsed = time.perf_counter() - start
+    rate = len(items) * rounds / elapsed
+    print(f'{name:<32}{rate:>12,.0f} items/sec')
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=500, help='items per page (Podio maximum is 500)')
+    parser.add_argument('--rounds', type=int, default=20, help='pages cleaned per measurement')
+    args = parser.parse_args()
+
+    items = load_page(args.items)
+    with open(os.path.join(DATA_DIR, 'app.json')) as f:
+        schema = PodioAPI.parse_app_fields(json.load(f))
+
+    print(f'Cleaning {args.rounds} pages of {args.items} items ({len(items[0]["fields"])} fields each)')
+    baseline = measure('legacy match/re.sub/dateutil', legacy_clean_item, items, args.rounds)
+    lazy = measure('ItemCleaner (no schema)', ItemCleaner().clean_item, items, args.rounds)
+    cleaner = ItemCleaner()
+    cleaner.load_schema(schema)
+    compiled = measure('ItemCleaner (app schema)', cleaner.clean_item, items, args.rounds)
+    print(f'speedup: {lazy / baseline:.1f}x without schema, {compiled / baseline:.1f}x with schema')
+    typed_cleaner = ItemCleaner(typed=True)
+    typed_cleaner.load_schema(schema)
+    measure('ItemCleaner typed (app schema)', typed_cleaner.clean_item, items, args.rounds)
+    labeled_size = sum(len(bson.encode({'data': cleaner.clean_item(item)})) for item in items) / len(items)
+    typed_size = sum(len(bson.encode({'data': typed_cleaner.clean_item(item)})) for item in items) / len(items)
+    print(f'stored data per item: {labeled_size:,.0f} bytes labeled, {typed_size:,.0f} bytes typed')
+
+if __name__ == '__main__':
+    main()
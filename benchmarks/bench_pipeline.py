@@ -0,0 +1,214 @@
+"""
+Offline throughput benchmark for the webhook pipeline and the bulk Podio methods.
+
+Runs against benchmarks/fake_podio.py on a local port instead of Podio, so no rate limit budget is used.
+- bulk: PodioAPI.get_filtered_items and AsyncPodioAPI.get_filtered_items over every fake app (items/sec).
+- gateway: posts item.update hooks to PodioApiGateway's /item/update route and runs its ingest buffer and
+  queue worker until the queue drains; reports hooks/sec, end-to-end events/sec, p50/p99 lag from hook to
+  stored item, and Podio API calls per stored item. Needs a MongoDB server (--mongo-uri); the gateway uses
+  pymongo's AsyncMongoClient, which mongomock cannot stand in for. Uses and then drops --mongo-database.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py [--events 2000] [--items 500] [--latency 0.02] [--json results.json]
+    python benchmarks/bench_pipeline.py --compare results.json   # exit 1 on a regression beyond --tolerance
+"""
+import argparse, asyncio, json, os, random, statistics, sys, time
+import httpx
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PodioApiGateway as gateway
+import PodioApiWrapper as fs
+import EventRetry, PodioMetrics
+from PodioCredentialPool import CredentialPool
+from PodioTokenCache import TokenCache
+from fake_podio import FakePodio, serve
+
+"""
+Direction of each reported metric, for --compare.
+"""
+HIGHER_IS_BETTER = ['bulk_sync_items_per_sec', 'bulk_async_items_per_sec', 'hooks_per_sec', 'events_per_sec']
+LOWER_IS_BETTER = ['lag_p50_seconds', 'lag_p99_seconds', 'api_calls_per_item', 'bulk_api_calls_per_item']
+
+def percentile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+def relaxed_pool(rate_limit):
+    return CredentialPool(gateway.podio_creds, limits={
+        'rate_limited': [(rate_limit, 60)],
+        'standard': [(rate_limit * 60, 3600)]
+    })
+
+async def bench_bulk(fake, base_url, args):
+    results = {}
+    pool = relaxed_pool(args.rate_limit)
+    credential = pool.credentials[0]
+    podio = fs.PodioAPI(base_url, gateway.org_id, credential.username, credential.password, credential.client_id,
+                        credential.client_secret, credential_pool=pool, token_cache=TokenCache(base_url))
+    fake.requests.clear()
+    start = time.perf_counter()
+    count = sum(len(podio.get_filtered_items(app_id, {}) or {}) for app_id in fake.app_ids)
+    results['bulk_sync_items_per_sec'] = count / (time.perf_counter() - start)
+
+    async with fs.AsyncPodioAPI.from_pool(base_url, gateway.org_id, pool, token_cache=TokenCache(base_url)) as podio:
+        start = time.perf_counter()
+        pages = await asyncio.gather(*[podio.get_filtered_items(app_id, {}) for app_id in fake.app_ids])
+        count = sum(len(page or {}) for page in pages)
+        results['bulk_async_items_per_sec'] = count / (time.perf_counter() - start)
+    results['bulk_api_calls_per_item'] = fake.api_calls() / (2 * count) if count else None
+    return results
+
+async def wait_until_drained(db, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if not len(gateway.ingest_buffer) and not await db.to_do_event_queue.count_documents({}):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+async def bench_gateway(fake, base_url, args):
+    probe = AsyncMongoClient(args.mongo_uri, serverSelectionTimeoutMS=2000)
+    try:
+        await probe.admin.command('ping')
+        await probe.drop_database(args.mongo_database)
+    except PyMongoError as e:
+        print(f'Skipping gateway benchmark, no MongoDB at {args.mongo_uri}.\n{e}')
+        return {}
+    finally:
+        await probe.close()
+
+    gateway.mongo_connection_string = args.mongo_uri
+    gateway.mongo_database = args.mongo_database
+    gateway.base_url = base_url
+    gateway.credential_pool = relaxed_pool(args.rate_limit)
+    gateway.token_cache = TokenCache(base_url)
+    gateway.coalesce_debounce_seconds = args.debounce
+    gateway.coalesce_max_delay_seconds = max(args.debounce * 10, 1)
+    gateway.idle_poll_seconds = 0.5
+    gateway.schema_refresh_interval_seconds = None
+    gateway.sync_app_ids = []
+    gateway.ingest_spill_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_ingest_spill.jsonl')
+    for error_class, (max_attempts, base, cap) in EventRetry.RETRY_POLICIES.items():
+        EventRetry.RETRY_POLICIES[error_class] = (max_attempts, base * args.retry_scale, cap * args.retry_scale)
+    await gateway.start_sync()
+    db = gateway.mongo_db
+
+    item_ids = [item_id for app_id in fake.app_ids for item_id in fake.item_ids(app_id)[:args.items]]
+    hooks = [random.choice(item_ids) for _ in range(args.events)]
+    fake.requests.clear()
+    transport = httpx.ASGITransport(app=gateway.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://gateway') as client:
+        queue = asyncio.Queue()
+        for item_id in hooks:
+            queue.put_nowait(item_id)
+
+        async def sender():
+            while not queue.empty():
+                item_id = queue.get_nowait()
+                fake.edit(item_id)
+                await client.post(f'/item/update?app_id={fake.app_of(item_id)}',
+                                  data={'item_id': str(item_id), 'item_revision_id': '1', 'type': 'item.update', 'hook_id': '1'})
+
+        start = time.perf_counter()
+        await asyncio.gather(*[sender() for _ in range(args.senders)])
+        sent = time.perf_counter() - start
+        drained = await wait_until_drained(db, args.timeout)
+        elapsed = time.perf_counter() - start
+
+    lags = []
+    async for doc in db.completed_event_queue.find({}, projection={'timestamp': 1, 'completed_timestamp': 1}):
+        lags.append((doc['completed_timestamp'] - doc['timestamp']).total_seconds())
+    stored = await db.podio_items.count_documents({'current': 1})
+    mongo_ms = {
+        key[0]: round(state['sum'] / state['count'] * 1000, 2)
+        for key, state in PodioMetrics.MONGO_SECONDS.values.items() if state['count']
+    }
+
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+    await gateway.stop_sync()
+    cleanup = AsyncMongoClient(args.mongo_uri)
+    await cleanup.drop_database(args.mongo_database)
+    await cleanup.close()
+
+    if not drained:
+        print(f'Queue did not drain within {args.timeout}s; results cover the completed part only.')
+    return {
+        'hooks_per_sec': args.events / sent,
+        'events_per_sec': args.events / elapsed,
+        'items_stored': stored,
+        'events_coalesced': gateway.queue_stats['events_coalesced'],
+        'lag_p50_seconds': percentile(sorted(lags), 50),
+        'lag_p99_seconds': percentile(sorted(lags), 99),
+        'api_calls_per_item': fake.api_calls() / stored if stored else None,
+        'rate_limited_responses': fake.rate_limited_requests // args.rate_limit_every if args.rate_limit_every else 0,
+        'mongo_mean_ms': mongo_ms
+    }
+
+def compare(results, baseline, tolerance):
+    '''
+    Returns the metrics that regressed by more than `tolerance` (a fraction) against `baseline`.
+    '''
+    regressions = []
+    for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        new, old = results.get(key), baseline.get(key)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if (key in HIGHER_IS_BETTER and change < -tolerance) or (key in LOWER_IS_BETTER and change > tolerance):
+            regressions.append(f'{key}: {old:.4g} -> {new:.4g} ({change:+.0%})')
+    return regressions
+
+async def run(args):
+    fake = FakePodio(apps=args.apps, items_per_app=args.items, latency=args.latency, rate_limit_every=args.rate_limit_every)
+    base_url, server = serve(fake)
+    try:
+        results = await bench_bulk(fake, base_url, args)
+        if not args.skip_gateway:
+            results.update(await bench_gateway(fake, base_url, args))
+    finally:
+        server.should_exit = True
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--apps', type=int, default=2, help='fake apps')
+    parser.add_argument('--items', type=int, default=500, help='items per app')
+    parser.add_argument('--events', type=int, default=2000, help='item.update hooks to send')
+    parser.add_argument('--senders', type=int, default=50, help='concurrent hook senders')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake Podio latency per request (seconds)')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth item request with HTTP 420')
+    parser.add_argument('--rate-limit', type=int, default=6000, help='rate_limited requests per credential per minute')
+    parser.add_argument('--debounce', type=float, default=0.2, help='coalesce_debounce_seconds for the run')
+    parser.add_argument('--retry-scale', type=float, default=0.001, help='factor applied to retry backoff delays')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for the queue to drain')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--mongo-database', default='podio_benchmark')
+    parser.add_argument('--skip-gateway', action='store_true', help='only run the bulk method benchmark')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression as a fraction')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for key, value in results.items():
+        print(f'{key:<28}{value:>14,.3f}' if isinstance(value, float) else f'{key:<28}{value!s:>14}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Local stand-in for the Podio API used by the offline benchmarks.
+
+Serves the recorded item and app JSON in benchmarks/data for any number of apps and items, with a configurable
+per-request latency and a rate_limit (HTTP 420) response every `rate_limit_every` item requests. It keeps a
+last_edit_on time per item (see FakePodio.edit) so last_edit_on filters return only edited items, and counts
+requests per endpoint so benchmarks can report API calls per item.
+"""
+import asyncio, copy, json, os, socket, threading, time
+from collections import Counter
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+NEVER_EDITED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+class FakePodio:
+    def __init__(self, apps=1, items_per_app=1000, latency=0.0, rate_limit_every=0, space_id=1):
+        with open(os.path.join(DATA_DIR, 'filtered_items_page.json')) as f:
+            self.recorded_items = json.load(f)['items']
+        with open(os.path.join(DATA_DIR, 'app.json')) as f:
+            self.recorded_app = json.load(f)
+        self.app_ids = [1000 + i for i in range(apps)]
+        self.items_per_app = items_per_app
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.space_id = space_id
+        self.edited = {}
+        self.requests = Counter()
+        self.rate_limited_requests = 0
+
+    def item_ids(self, app_id):
+        return [app_id * 1_000_000 + i for i in range(self.items_per_app)]
+
+    def app_of(self, item_id):
+        return item_id // 1_000_000
+
+    def edit(self, item_id):
+        '''
+        Marks an item as edited now, as Podio does before sending its item.update hook.
+        '''
+        self.edited[int(item_id)] = datetime.now(timezone.utc)
+
+    def item(self, item_id):
+        item = copy.deepcopy(self.recorded_items[item_id % len(self.recorded_items)])
+        item['item_id'] = item_id
+        return item
+
+    def api_calls(self):
+        return sum(count for endpoint, count in self.requests.items() if endpoint != 'oauth/token')
+
+    async def respond(self, endpoint, rate_limited=False):
+        self.requests[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if rate_limited and self.rate_limit_every:
+            self.rate_limited_requests += 1
+            if self.rate_limited_requests % self.rate_limit_every == 0:
+                return JSONResponse({'error': 'rate_limit', 'error_description': 'Fake rate limit'}, status_code=420)
+        return None
+
+    def create_app(self):
+        app = FastAPI()
+
+        @app.post('/oauth/token')
+        async def token():
+            await self.respond('oauth/token')
+            return {'access_token': 'fake', 'refresh_token': 'fake-refresh', 'expires_in': 28800}
+
+        @app.get('/item/{item_id}/value')
+        async def item_values(item_id: int):
+            limited = await self.respond('item/:id/value', rate_limited=True)
+            if limited:
+                return limited
+            if self.app_of(item_id) not in self.app_ids:
+                return JSONResponse({'error': 'not_found'}, status_code=404)
+            return self.item(item_id)['fields']
+
+        @app.post('/item/app/{app_id}/filter/')
+        async def filter_items(app_id: int, request: Request):
+            limited = await self.respond('item/app/:id/filter', rate_limited=True)
+            if limited:
+                return limited
+            body = await request.json()
+            item_ids = self.item_ids(app_id) if app_id in self.app_ids else []
+            since = body.get('filters', {}).get('last_edit_on', {}).get('from')
+            if since:
+                since = datetime.fromisoformat(since).replace(tzinfo=timezone.utc)
+                item_ids = [item_id for item_id in item_ids if self.edited.get(item_id, NEVER_EDITED) >= since]
+            page = item_ids[body.get('offset', 0):body.get('offset', 0) + body.get('limit', 500)]
+            return {'filtered': len(item_ids), 'total': len(item_ids), 'items': [self.item(item_id) for item_id in page]}
+
+        @app.get('/app/{app_id}')
+        async def get_app(app_id: int):
+            await self.respond('app/:id')
+            return {**self.recorded_app, 'app_id': app_id}
+
+        @app.get('/org/{org_id}/all_spaces')
+        async def all_spaces(org_id: int):
+            await self.respond('org/:id/all_spaces')
+            return [{'space_id': self.space_id, 'name': 'Benchmark'}]
+
+        @app.get('/app/space/{space_id}/')
+        async def apps_in_space(space_id: int):
+            await self.respond('app/space/:id')
+            return [{'space_id': space_id, 'app_id': app_id, 'config': {'name': f'App {app_id}'}} for app_id in self.app_ids]
+
+        return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def serve(fake: FakePodio):
+    '''
+    Runs the fake on a local port in a background thread. Returns (base_url, server); set server.should_exit to stop.
+    '''
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(fake.create_app(), host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f'http://127.0.0.1:{port}/', server
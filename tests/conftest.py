@@ -0,0 +1,369 @@
+import copy, os, sys
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+"""
+In-memory stand-in for the async MongoDB collections used by the store, the exporters and the gateway queues,
+covering only the operators they issue: $and/$or/$in/$lt/$lte/$gte/$gt/$ne/$exists filters; $set, $unset, $inc and
+$setOnInsert updates; $set pipeline updates with $literal/$ifNull/$add/$min/$max expressions; and $match/$sort/$group
+aggregations with $push/$sum/$min/$max accumulators.
+"""
+
+def get_path(doc, path):
+    for part in path.split('.'):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        if key == '$and':
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        value, found = get_path(doc, key)
+        if isinstance(condition, dict) and any(operator.startswith('$') for operator in condition):
+            for operator, operand in condition.items():
+                if operator == '$exists' and found != operand:
+                    return False
+                if operator == '$in' and value not in operand:
+                    return False
+                if operator == '$ne' and value == operand:
+                    return False
+                if operator == '$lt' and not (value is not None and value < operand):
+                    return False
+                if operator == '$lte' and not (value is not None and value <= operand):
+                    return False
+                if operator == '$gte' and not (value is not None and value >= operand):
+                    return False
+                if operator == '$gt' and not (value is not None and value > operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+def set_path(doc, path, value):
+    *parents, last = path.split('.')
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+def unset_path(doc, path):
+    *parents, last = path.split('.')
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+def evaluate(expression, doc):
+    '''
+    Evaluates an aggregation expression of a pipeline update against `doc`.
+    '''
+    if isinstance(expression, str) and expression.startswith('$'):
+        return get_path(doc, expression[1:])[0]
+    if not isinstance(expression, dict) or len(expression) != 1 or not next(iter(expression)).startswith('$'):
+        return expression
+    operator, operands = next(iter(expression.items()))
+    if operator == '$literal':
+        return operands
+    values = [evaluate(operand, doc) for operand in operands]
+    if operator == '$ifNull':
+        return next((value for value in values if value is not None), None)
+    if operator == '$add':
+        dates = [value for value in values if isinstance(value, datetime)]
+        total = sum(value for value in values if not isinstance(value, datetime))
+        return dates[0] + timedelta(milliseconds=total) if dates else total
+    if operator == '$min':
+        return min(values)
+    if operator == '$max':
+        return max(values)
+    raise NotImplementedError(operator)
+
+def accumulate(operator, values):
+    '''
+    Applies a $group accumulator to the values of one group.
+    '''
+    if operator == '$push':
+        return values
+    if operator == '$sum':
+        return sum(value for value in values if value is not None)
+    present = [value for value in values if value is not None]
+    if operator == '$min':
+        return min(present) if present else None
+    if operator == '$max':
+        return max(present) if present else None
+    raise NotImplementedError(operator)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+
+class FakeCollection:
+    '''
+    `unique` names the fields of a unique index, limited to documents matching `unique_filter` (a partial index).
+    `before_bulk_write` (a coroutine function) is awaited ahead of each bulk_write and `before_upsert` ahead of
+    each upsert insert, so tests can slip in a concurrent writer between a read and the write that depends on it.
+    `calls` counts the write commands issued, by method.
+    '''
+    def __init__(self, name='collection', unique=None, unique_filter=None):
+        self.name = name
+        self.docs = []
+        self.unique = unique
+        self.unique_filter = unique_filter or {}
+        self.before_bulk_write = None
+        self.before_upsert = None
+        self.calls = {}
+
+    def count_call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def select(self, query, sort=None):
+        docs = [doc for doc in self.docs if matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return docs
+
+    def find(self, query=None, sort=None, session=None, limit=0, **kwargs):
+        docs = self.select(query or {}, sort)
+        return Cursor([copy.deepcopy(doc) for doc in (docs[:limit] if limit else docs)])
+
+    async def find_one(self, query=None, sort=None, session=None, **kwargs):
+        docs = self.select(query or {}, sort)
+        return copy.deepcopy(docs[0]) if docs else None
+
+    async def aggregate(self, pipeline, session=None, **kwargs):
+        docs = [copy.deepcopy(doc) for doc in self.docs]
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == '$match':
+                docs = [doc for doc in docs if matches(doc, spec)]
+            elif name == '$sort':
+                for key, direction in reversed(list(spec.items())):
+                    docs.sort(key=lambda doc: get_path(doc, key)[0], reverse=direction < 0)
+            elif name == '$group':
+                groups = {}
+                for doc in docs:
+                    groups.setdefault(evaluate(spec['_id'], doc), []).append(doc)
+                docs = [
+                    {'_id': key, **{
+                        field: accumulate(operator, [evaluate(expression, doc) for doc in group])
+                        for field, accumulator in spec.items() if field != '_id'
+                        for operator, expression in accumulator.items()
+                    }}
+                    for key, group in groups.items()
+                ]
+            else:
+                raise NotImplementedError(name)
+        return Cursor(docs)
+
+    async def count_documents(self, query, session=None, limit=0):
+        count = len(self.select(query))
+        return min(count, limit) if limit else count
+
+    def violates_unique(self, doc, ignore=None):
+        if not self.unique or not matches(doc, self.unique_filter):
+            return False
+        return any(
+            other is not ignore and matches(other, self.unique_filter) and all(other.get(key) == doc.get(key) for key in self.unique)
+            for other in self.docs
+        )
+
+    def insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault('_id', ObjectId())
+        if self.violates_unique(doc) or any(other['_id'] == doc['_id'] for other in self.docs):
+            return None
+        self.docs.append(doc)
+        return doc
+
+    def update(self, doc, update, inserted=False):
+        '''
+        Applies an update document or pipeline to `doc` in place; returns False (leaving `doc` as it was) if
+        the result would break the unique index.
+        '''
+        before = copy.deepcopy(doc)
+        if isinstance(update, list):
+            for stage in update:
+                values = {path: evaluate(expression, doc) for path, expression in stage['$set'].items()}
+                for path, value in values.items():
+                    set_path(doc, path, copy.deepcopy(value))
+        else:
+            for path, value in update.get('$set', {}).items():
+                set_path(doc, path, copy.deepcopy(value))
+            for path in update.get('$unset', {}):
+                unset_path(doc, path)
+            for path, amount in update.get('$inc', {}).items():
+                set_path(doc, path, (get_path(doc, path)[0] or 0) + amount)
+            if inserted:
+                for path, value in update.get('$setOnInsert', {}).items():
+                    set_path(doc, path, copy.deepcopy(value))
+        if not inserted and self.violates_unique(doc, ignore=doc):
+            doc.clear()
+            doc.update(before)
+            return False
+        return True
+
+    async def upsert(self, query, update):
+        doc = {key: value for key, value in query.items() if not key.startswith('$') and not isinstance(value, dict)}
+        self.update(doc, update, inserted=True)
+        if self.before_upsert:
+            await self.before_upsert()
+        return self.insert(doc)
+
+    async def update_one(self, query, update, upsert=False, session=None):
+        self.count_call('update_one')
+        return await self.update_docs(self.select(query)[:1], query, update, upsert)
+
+    async def update_many(self, query, update, upsert=False, session=None):
+        self.count_call('update_many')
+        return await self.update_docs(self.select(query), query, update, upsert)
+
+    async def update_docs(self, targets, query, update, upsert):
+        if not targets and upsert:
+            doc = await self.upsert(query, update)
+            if doc is None:
+                raise DuplicateKeyError('E11000 duplicate key error', 11000)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc['_id'])
+        modified = 0
+        for doc in targets:
+            before = copy.deepcopy(doc)
+            if not self.update(doc, update):
+                raise DuplicateKeyError('E11000 duplicate key error', 11000)
+            modified += doc != before
+        return SimpleNamespace(matched_count=len(targets), modified_count=modified, upserted_id=None)
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=False, session=None, **kwargs):
+        self.count_call('find_one_and_update')
+        targets = self.select(query, sort)[:1]
+        if not targets:
+            return None
+        before = copy.deepcopy(targets[0])
+        self.update(targets[0], update)
+        return copy.deepcopy(targets[0] if return_document else before)
+
+    async def insert_one(self, doc, session=None):
+        self.count_call('insert_one')
+        inserted = self.insert(doc)
+        if inserted is None:
+            raise DuplicateKeyError('E11000 duplicate key error', 11000)
+        return SimpleNamespace(inserted_id=inserted['_id'])
+
+    async def delete_one(self, query, session=None):
+        self.count_call('delete_one')
+        targets = self.select(query)[:1]
+        for doc in targets:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=len(targets))
+
+    async def delete_many(self, query, session=None):
+        targets = self.select(query)
+        for doc in targets:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=len(targets))
+
+    async def bulk_write(self, operations, ordered=True, session=None):
+        '''
+        Runs InsertOne/UpdateOne/UpdateMany/DeleteOne operations. Unique index violations are reported like
+        MongoDB does, as a BulkWriteError after the failing operation (ordered) or after all of them (unordered).
+        '''
+        self.count_call('bulk_write')
+        if self.before_bulk_write:
+            await self.before_bulk_write()
+        counts = {'inserted_count': 0, 'matched_count': 0, 'modified_count': 0, 'upserted_count': 0, 'deleted_count': 0}
+        errors = []
+        for index, operation in enumerate(operations):
+            if isinstance(operation, InsertOne):
+                failed = self.insert(operation._doc) is None
+                counts['inserted_count'] += not failed
+            elif not hasattr(operation, '_doc'):  # DeleteOne
+                targets = self.select(operation._filter)[:1]
+                for doc in targets:
+                    self.docs.remove(doc)
+                counts['deleted_count'] += len(targets)
+                continue
+            else:
+                targets = self.select(operation._filter)
+                if isinstance(operation, UpdateOne):
+                    targets = targets[:1]
+                failed = False
+                if not targets and operation._upsert:
+                    failed = await self.upsert(operation._filter, operation._doc) is None
+                    counts['upserted_count'] += not failed
+                counts['matched_count'] += len(targets)
+                for doc in targets:
+                    before = copy.deepcopy(doc)
+                    if not self.update(doc, operation._doc):
+                        failed = True
+                        break
+                    counts['modified_count'] += doc != before
+            if failed:
+                errors.append({'index': index, 'code': 11000, 'errmsg': 'E11000 duplicate key error'})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, **counts})
+        return SimpleNamespace(**counts)
+
+    async def insert_many(self, docs, ordered=True, session=None):
+        self.count_call('insert_many')
+        errors = [{'index': index, 'code': 11000} for index, doc in enumerate(docs) if self.insert(doc) is None]
+        if errors:
+            raise BulkWriteError({'writeErrors': errors})
+
+
+class FakeDatabase:
+    '''
+    Collections are created on first access, with the unique indexes of MongoMigrations.INDEXES that tests rely on.
+    '''
+    UNIQUE = {
+        'podio_items': (('item_id',), {'current': 1}),
+        'podio_item_changes': (('item_id', 'version'), None),
+        'to_do_event_queue': (('item_id',), {'item_id': {'$exists': True}})
+    }
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        unique, unique_filter = self.UNIQUE.get(name, (None, None))
+        collection = FakeCollection(name, unique, unique_filter)
+        setattr(self, name, collection)
+        return collection
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    '''
+    PodioApiGateway running on a FakeDatabase without transactions, with fresh queue_stats.
+    '''
+    import PodioApiGateway
+    monkeypatch.setattr(PodioApiGateway, 'mongo_db', FakeDatabase())
+    monkeypatch.setattr(PodioApiGateway, 'mongo_transactions', False)
+    monkeypatch.setattr(PodioApiGateway, 'queue_stats', {'events_coalesced': 0, 'fetches': 0, 'fetches_saved': 0, 'failures': {}, 'dead_lettered': 0})
+    return PodioApiGateway
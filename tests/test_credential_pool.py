@@ -0,0 +1,47 @@
+from PodioCredentialPool import CredentialPool, TokenBucket
+
+LIMITS = {'rate_limited': [(2, 60), (10, 3600)], 'standard': [(100, 3600)]}
+
+def pool(*keys):
+    creds = {key: {'user': key, 'password': 'x', 'client_id': f'client-{key}', 'client_secret': 'x'} for key in keys}
+    return CredentialPool(creds, LIMITS)
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(2, 60)
+    assert bucket.wait_time() == 0
+    bucket.take(2)
+    assert 29 < bucket.wait_time() <= 30
+    bucket.cap(5)
+    assert bucket.remaining() < 1
+
+def test_best_picks_credential_with_most_budget():
+    credentials = pool('a', 'b')
+    credentials.credentials[0].take('rate_limited')
+    assert credentials.best().key == 'b'
+
+def test_next_wait_moves_on_when_a_credential_is_exhausted():
+    credentials = pool('a', 'b')
+    used = [credentials.next_wait()[0].key for _ in range(4)]
+    assert sorted(used) == ['a', 'a', 'b', 'b']
+    credential, wait = credentials.next_wait()
+    assert wait > 0
+    assert credential.api_count == 2
+
+def test_use_only_restricts_and_falls_back_to_all():
+    credentials = pool('a', 'b', 'c')
+    credentials.use_only(['b'])
+    assert len(credentials) == 1 and credentials.best().key == 'b'
+    assert list(credentials.status()) == ['client-b']
+    credentials.use_only(['missing'])
+    assert len(credentials) == 3
+
+def test_observe_rate_limit_and_remaining_header():
+    credentials = pool('a')
+    credential = credentials.credentials[0]
+    credentials.observe(credential, 'rate_limited', 200, {'X-Rate-Limit-Remaining': '1'})
+    assert credential.buckets['rate_limited'][1].remaining() < 2
+    assert credential.buckets['rate_limited'][0].remaining() > 1
+    credentials.observe(credential, 'rate_limited', 420, {})
+    assert credential.wait_time('rate_limited') > 0
+    assert credential.remaining('standard') > 99
@@ -0,0 +1,204 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+import pytest
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from IngestBuffer import IngestBuffer
+
+SHARDS = [0]
+
+def pending(gateway, item_id, app_id=None, type='item.update', age_seconds=10, **fields):
+    now = datetime.now(timezone.utc)
+    doc = {'_id': ObjectId(), 'type': type, 'item_id': str(item_id), 'shard': 0, 'timestamp': now - timedelta(seconds=age_seconds),
+           'first_seen': now - timedelta(seconds=age_seconds), 'version': 1, 'failed_attempts': 0, **fields}
+    if app_id is not None:
+        doc['app_id'] = str(app_id)
+    gateway.mongo_db.to_do_event_queue.docs.append(doc)
+    return doc
+
+def claim(gateway, capacity):
+    return asyncio.run(gateway.claim_tasks(gateway.mongo_db.to_do_event_queue, capacity, SHARDS))
+
+
+def test_claim_events_leases_oldest_unleased_events(gateway):
+    collection = gateway.mongo_db.to_do_event_queue
+    newest = pending(gateway, 1, age_seconds=1)
+    oldest = pending(gateway, 2, age_seconds=30)
+    pending(gateway, 3, lease_until=datetime.now(timezone.utc) + timedelta(minutes=1))
+    pending(gateway, 4, not_before=datetime.now(timezone.utc) + timedelta(minutes=1))
+    pending(gateway, 5, shard=1)
+    docs = asyncio.run(gateway.claim_events(collection, 10, SHARDS))
+    assert [doc['_id'] for doc in docs] == [oldest['_id'], newest['_id']]
+    assert all(doc['leased_by'] == gateway.worker_id for doc in docs)
+
+def test_group_for_hydration(gateway):
+    now = datetime.now(timezone.utc)
+    docs = [
+        *[{'type': 'item.update', 'item_id': str(i), 'app_id': '10', 'first_seen': now} for i in range(3)],
+        *[{'type': 'item.update', 'item_id': str(i), 'app_id': '20', 'first_seen': now} for i in range(3, 5)],
+        {'type': 'item.update', 'item_id': '5', 'app_id': '10', 'first_seen': now - timedelta(hours=1)},
+        {'type': 'item.update', 'item_id': '6'}
+    ]
+    groups, singles = gateway.group_for_hydration(docs)
+    assert {app_id: [doc['item_id'] for doc in app_docs] for app_id, app_docs in groups.items()} == {'10': ['0', '1', '2']}
+    assert sorted(doc['item_id'] for doc in singles) == ['3', '4', '5', '6']
+
+def test_claim_tasks_claims_one_event_per_free_slot(gateway):
+    collection = gateway.mongo_db.to_do_event_queue
+    for item_id in range(20):
+        pending(gateway, item_id)
+    tasks = claim(gateway, 3)
+    assert len(tasks) == 3 and all(app_id is None for app_id, docs in tasks)
+    assert collection.calls == {'find_one_and_update': 3}
+    assert len(collection.select({'leased_by': gateway.worker_id})) == 3
+
+def test_claim_tasks_tops_up_apps_with_enough_pending_events(gateway):
+    collection = gateway.mongo_db.to_do_event_queue
+    for item_id in range(15):
+        pending(gateway, item_id, app_id=10, age_seconds=100 - item_id)
+    for item_id in range(100, 110):
+        pending(gateway, item_id, age_seconds=50)
+    tasks = claim(gateway, 2)
+    assert [(app_id, len(docs)) for app_id, docs in tasks] == [('10', 15)]
+    # 2 free-slot claims, 13 top-up claims and one that found the app drained; nothing released.
+    assert collection.calls == {'find_one_and_update': 16}
+    assert len(collection.select({'leased_by': gateway.worker_id})) == 15
+
+def test_claim_tasks_does_not_top_up_apps_with_too_few_events(gateway):
+    collection = gateway.mongo_db.to_do_event_queue
+    pending(gateway, 1, app_id=10, age_seconds=30)
+    for item_id in range(100, 110):
+        pending(gateway, item_id, age_seconds=20)
+    tasks = claim(gateway, 2)
+    assert sorted(docs[0]['item_id'] for app_id, docs in tasks) == ['1', '100']
+    assert all(app_id is None for app_id, docs in tasks)
+    assert collection.calls == {'find_one_and_update': 2}
+
+def test_claim_tasks_releases_a_group_that_came_up_short(gateway, monkeypatch):
+    collection = gateway.mongo_db.to_do_event_queue
+    pending(gateway, 1, app_id=10, age_seconds=40)
+    pending(gateway, 100, age_seconds=39)
+    pending(gateway, 2, app_id=10, age_seconds=38)
+    stolen = pending(gateway, 3, app_id=10, age_seconds=37)
+    claim_events = gateway.claim_events
+
+    async def concurrent_claim(collection, limit, shards=None, match=None):
+        if match:
+            # Another worker leases one of the app's events between the count and the top-up.
+            stolen.update(lease_until=datetime.now(timezone.utc) + timedelta(minutes=1), leased_by='other')
+        return await claim_events(collection, limit, shards, match)
+
+    monkeypatch.setattr(gateway, 'claim_events', concurrent_claim)
+    tasks = claim(gateway, 2)
+    # Items 1 and 2 of the app are too few for a group; with item 100 that is one single too many.
+    assert sorted(docs[0]['item_id'] for app_id, docs in tasks) == ['1', '100']
+    assert collection.calls == {'find_one_and_update': 4, 'update_many': 1}
+    assert sorted(doc['item_id'] for doc in collection.select({'leased_by': gateway.worker_id})) == ['1', '100']
+
+def hook(item_id, now, **fields):
+    return {'type': 'item.update', 'item_id': str(item_id), 'app_id': '10', 'timestamp': now, **fields}
+
+def test_coalesce_update_merges_hooks_into_one_pending_event(gateway):
+    collection = gateway.mongo_db.to_do_event_queue
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for seconds in (0, 2, 50, 58):
+        now = start + timedelta(seconds=seconds)
+        asyncio.run(gateway.to_do_event_queue_add_many([hook(7, now)]))
+    asyncio.run(gateway.to_do_event_queue_add_many([hook(8, start)]))
+    assert len(collection.docs) == 2
+    doc = collection.select({'item_id': '7'})[0]
+    assert doc['coalesced_events'] == doc['version'] == 4
+    assert doc['timestamp'] == doc['first_seen'] == start
+    # Each hook pushes not_before out by the debounce, capped at coalesce_max_delay_seconds after the first.
+    assert doc['not_before'] == start + timedelta(seconds=gateway.coalesce_max_delay_seconds)
+    assert gateway.queue_stats['events_coalesced'] == 3
+
+def test_coalesce_update_does_not_pull_a_retry_forward(gateway):
+    collection = gateway.mongo_db.to_do_event_queue
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    retry_at = now + timedelta(hours=1)
+    collection.docs.append({'_id': ObjectId(), **hook(7, now), 'first_seen': now, 'version': 1, 'coalesced_events': 1,
+                            'failed_attempts': 2, 'retry_at': retry_at, 'not_before': retry_at})
+    asyncio.run(gateway.to_do_event_queue_add_many([hook(7, now + timedelta(seconds=1))]))
+    doc = collection.docs[0]
+    assert doc['not_before'] == retry_at
+    assert doc['failed_attempts'] == 2 and doc['version'] == 2
+
+def stop_after(calls, count):
+    '''
+    A stand-in for asyncio.sleep that ends the loop under test on its `count`-th call.
+    '''
+    async def sleep(seconds):
+        calls.append(seconds)
+        if len(calls) >= count:
+            raise asyncio.CancelledError
+    return sleep
+
+def test_backfill_event_shards_survives_a_failed_round(gateway, monkeypatch):
+    rounds = []
+
+    async def assign_missing_shards(collection, shards):
+        rounds.append(shards)
+        if len(rounds) == 1:
+            raise OperationFailure('not primary')
+        return 0
+
+    sleeps = []
+    monkeypatch.setattr(gateway, 'assign_missing_shards', assign_missing_shards)
+    monkeypatch.setattr(asyncio, 'sleep', stop_after(sleeps, 2))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(gateway.backfill_event_shards())
+    assert len(rounds) == 2 and sleeps == [gateway.idle_poll_seconds] * 2
+
+def test_refresh_app_schemas_survives_a_failed_claim(gateway, monkeypatch):
+    claims = []
+
+    async def claim_events(collection, limit, shards=None, match=None):
+        claims.append(collection.name)
+        if len(claims) == 1:
+            raise OperationFailure('not primary')
+        if len(claims) == 3:
+            raise asyncio.CancelledError
+        return []
+
+    async def create_podio_client():
+        return None
+
+    sleeps = []
+    monkeypatch.setattr(gateway, 'claim_events', claim_events)
+    monkeypatch.setattr(gateway, 'create_podio_client', create_podio_client)
+    monkeypatch.setattr(gateway, 'idle_poll_seconds', 0)
+    monkeypatch.setattr(asyncio, 'sleep', stop_after(sleeps, 5))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(gateway.refresh_app_schemas())
+    assert claims == ['schema_refresh_queue'] * 3 and sleeps == [0]
+
+def test_worker_path_adds_the_worker_id(gateway, monkeypatch):
+    monkeypatch.setattr(gateway, 'worker_id', 'host-a:1234')
+    assert gateway.worker_path('data/ingest_spill.jsonl') == 'data/ingest_spill.host-a-1234.jsonl'
+
+def post_hook(gateway, data, query=''):
+    async def post():
+        transport = httpx.ASGITransport(app=gateway.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://gateway') as client:
+            return await client.post(f'/item/update{query}', data=data)
+    return asyncio.run(post())
+
+@pytest.mark.parametrize('data', [
+    {'item_id': '12a', 'type': 'item.update'},
+    {'item_id': '-5', 'type': 'item.update'},
+    {'item_id': '12', 'type': 'item.delete'},
+    {'item_id': '12'}
+])
+def test_item_update_rejects_malformed_item_events(gateway, monkeypatch, data):
+    monkeypatch.setattr(gateway, 'ingest_buffer', IngestBuffer(None))
+    assert post_hook(gateway, data).status_code == 400
+    assert len(gateway.ingest_buffer) == 0
+
+def test_item_update_buffers_valid_item_events(gateway, monkeypatch):
+    monkeypatch.setattr(gateway, 'ingest_buffer', IngestBuffer(None))
+    response = post_hook(gateway, {'item_id': '0012', 'type': 'item.create', 'item_revision_id': '3'}, '?app_id=10')
+    assert response.status_code == 200
+    event = gateway.ingest_buffer.events[0]
+    assert (event['item_id'], event['app_id'], event['type']) == ('12', '10', 'item.create')
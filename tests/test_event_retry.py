@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timezone
+import httpx
+import pytest
+from EventRetry import RETRY_POLICIES, backoff_seconds, classify_error, should_dead_letter
+from PodioApiWrapper import PodioAPIError
+
+@pytest.mark.parametrize('error, error_class', [
+    (PodioAPIError(420, {'error': 'rate_limit'}), 'rate_limit'),
+    (PodioAPIError(400, {'error': 'rate_limit'}), 'rate_limit'),
+    (PodioAPIError(404, {'error': 'not_found'}), 'gone'),
+    (PodioAPIError(500, 'Internal error'), 'server'),
+    (PodioAPIError(403, {'error': 'forbidden'}), 'client'),
+    (httpx.ReadTimeout('timed out'), 'server'),
+    (httpx.ConnectError('refused'), 'server'),
+    (KeyError('fields'), 'other')
+])
+def test_classify_error(error, error_class):
+    assert classify_error(error) == error_class
+
+def test_backoff_seconds_doubles_within_cap():
+    for attempts in range(1, 12):
+        _, base, cap = RETRY_POLICIES['server']
+        delay = min(cap, base * 2 ** (attempts - 1))
+        assert delay / 2 <= backoff_seconds('server', attempts) <= delay
+    assert backoff_seconds('gone', 1) == 0
+
+def test_should_dead_letter():
+    assert should_dead_letter('gone', 1)
+    assert not should_dead_letter('client', 2)
+    assert should_dead_letter('client', 3)
+
+def queued(gateway, **fields):
+    doc = {'_id': 'event-1', 'type': 'item.update', 'item_id': '7', 'failed_attempts': 0, 'version': 1,
+           'lease_until': datetime.now(timezone.utc), 'leased_by': gateway.worker_id, **fields}
+    gateway.mongo_db.to_do_event_queue.docs.append(dict(doc))
+    return doc
+
+def test_fail_event_schedules_retry_with_backoff(gateway):
+    data = queued(gateway)
+    asyncio.run(gateway.fail_event(gateway.mongo_db, data, PodioAPIError(500, 'Internal error')))
+    doc = gateway.mongo_db.to_do_event_queue.docs[0]
+    assert doc['failed_attempts'] == 1
+    assert doc['error_class'] == 'server'
+    assert doc['not_before'] == doc['retry_at'] > datetime.now(timezone.utc)
+    assert 'lease_until' not in doc and 'leased_by' not in doc
+    assert gateway.queue_stats['failures'] == {'server': 1}
+
+def test_fail_event_dead_letters_when_out_of_attempts(gateway):
+    data = queued(gateway)
+    asyncio.run(gateway.fail_event(gateway.mongo_db, data, PodioAPIError(404, {'error': 'not_found'})))
+    assert gateway.mongo_db.to_do_event_queue.docs == []
+    dead = gateway.mongo_db.dead_letter_queue.docs[0]
+    assert (dead['event_id'], dead['error_class'], dead['failed_attempts']) == ('event-1', 'gone', 1)
+    assert 'leased_by' not in dead
+    assert gateway.queue_stats['dead_lettered'] == 1
+
+def test_event_updated_by_a_new_hook_is_retried_instead_of_dead_lettered(gateway):
+    data = queued(gateway)
+    gateway.mongo_db.to_do_event_queue.docs[0]['version'] = 2
+    asyncio.run(gateway.fail_event(gateway.mongo_db, data, PodioAPIError(404, {'error': 'not_found'})))
+    assert gateway.mongo_db.dead_letter_queue.docs == []
+    assert gateway.mongo_db.to_do_event_queue.docs[0]['failed_attempts'] == 1
@@ -0,0 +1,76 @@
+import asyncio, os
+from datetime import datetime, timezone
+import pytest
+from IngestBuffer import IngestBuffer
+
+def spill_events(path, count):
+    buffer = IngestBuffer(None, spill_path=path)
+    buffer.spill([{'item_id': str(n), 'timestamp': datetime(2024, 1, 1, tzinfo=timezone.utc)} for n in range(count)])
+
+
+def test_replay_resumes_after_the_last_written_batch(tmp_path):
+    path = str(tmp_path / 'spill.jsonl')
+    spill_events(path, 5)
+    written = []
+    outage = iter([False, True])
+
+    async def flush(batch):
+        if next(outage, False):
+            raise ConnectionError('MongoDB unavailable')
+        written.extend(event['item_id'] for event in batch)
+
+    buffer = IngestBuffer(flush, batch_size=2, spill_path=path)
+    with pytest.raises(ConnectionError):
+        asyncio.run(buffer.replay_spill())
+    assert buffer.has_spill()
+    assert asyncio.run(buffer.replay_spill()) == 3
+    assert written == ['0', '1', '2', '3', '4']
+    assert not buffer.has_spill()
+    assert os.listdir(tmp_path) == []
+
+def test_replay_parses_timestamps_and_ignores_stale_offset(tmp_path):
+    path = str(tmp_path / 'spill.jsonl')
+    with open(path + '.replay.offset', 'w') as f:
+        f.write('4')
+    spill_events(path, 3)
+    written = []
+
+    async def flush(batch):
+        written.extend(batch)
+
+    assert asyncio.run(IngestBuffer(flush, spill_path=path).replay_spill()) == 3
+    assert written[0]['timestamp'] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def test_spill_files_of_stopped_workers_are_adopted(tmp_path):
+    base = str(tmp_path / 'spill')
+    spill_events(base + '.old.jsonl', 2)
+    spill_events(base + '.live.jsonl', 1)
+    with open(base + '.crashed.jsonl.replay', 'w') as f:
+        f.writelines(f'{{"item_id": "r{n}"}}\n' for n in range(3))
+    with open(base + '.crashed.jsonl.replay.offset', 'w') as f:
+        f.write('1')
+    live = IngestBuffer(None, spill_path=base + '.live.jsonl')
+    live.lock_spill()
+    buffer = IngestBuffer(None, spill_path=base + '.new.jsonl', adopt_spills=base + '*.jsonl')
+    buffer.lock_spill()
+    assert buffer.adopt_orphaned_spills() == 4
+    assert [event['item_id'] for event in IngestBuffer.unreplayed(base + '.new.jsonl')] == ['r1', 'r2', '0', '1']
+    assert IngestBuffer.unreplayed(base + '.live.jsonl')[0]['item_id'] == '0'
+    assert sorted(os.listdir(tmp_path)) == ['spill.live.jsonl', 'spill.live.jsonl.lock', 'spill.new.jsonl', 'spill.new.jsonl.lock']
+
+def test_overflow_is_spilled_in_batches_off_the_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / 'spill.jsonl')
+    writes = []
+    buffer = IngestBuffer(None, max_size=2, spill_path=path)
+    spill = buffer.spill
+    monkeypatch.setattr(buffer, 'spill', lambda events: (writes.append(len(events)), spill(events)))
+
+    async def burst():
+        accepted = [buffer.put({'item_id': str(n)}) for n in range(10)]
+        assert not os.path.exists(path)  # Nothing was written on the loop.
+        await buffer.spill_task
+        return accepted
+
+    assert asyncio.run(burst()) == [True, True] + [False] * 8
+    assert writes == [8]
+    assert [event['item_id'] for event in IngestBuffer.unreplayed(path)] == [str(n) for n in range(2, 10)]
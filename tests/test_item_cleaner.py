@@ -0,0 +1,63 @@
+from datetime import datetime
+from PodioItemCleaner import ItemCleaner, compile_field_cleaner, parse_date, to_float
+
+def field(field_id, field_type, values, label='Label'):
+    return {'field_id': field_id, 'type': field_type, 'label': label, 'values': values}
+
+
+def test_parse_date_and_to_float():
+    assert parse_date('2024-03-05 10:00:00') == '2024-03-05'
+    assert parse_date('March 5, 2024') == '2024-03-05'
+    assert parse_date('not a date') is None
+    assert to_float('1.5') == 1.5
+    assert to_float('n/a') == 'n/a'
+
+def test_labeled_cleaners():
+    assert compile_field_cleaner('date')([{'start': '2024-01-01 00:00:00'}, {'start': '2024-01-02 00:00:00'}]) == '2024-01-01 00:00:00,2024-01-02 00:00:00'
+    assert compile_field_cleaner('text')([{'value': '<p>Hello</p>'}, {'value': 'world'}]) == 'Hello,world'
+    assert compile_field_cleaner('category')([{'value': {'text': 'Open'}}, {'value': {'text': 'Won'}}]) == 'Open,Won'
+    assert compile_field_cleaner('app')([{'value': {'item_id': 7}}]) == '7'
+    assert compile_field_cleaner('money')([{'value': '12.50'}]) == 12.5
+    assert compile_field_cleaner('money')([]) is None
+
+def test_labeled_calculation_follows_return_type():
+    assert compile_field_cleaner('calculation', 'date')([{'value': '2024-01-02 08:00:00'}]) == '2024-01-02'
+    assert compile_field_cleaner('calculation', 'number')([{'value': '3'}]) == 3.0
+    assert compile_field_cleaner('calculation', 'text')([{'value': 'abc'}]) == 'abc'
+    assert compile_field_cleaner('calculation')([{'value': '2024-01-02'}]) == '2024-01-02'
+    assert compile_field_cleaner('calculation')([{'value': '4.5'}]) == 4.5
+    assert compile_field_cleaner('calculation')([{'start': '2024-01-02'}]) == '2024-01-02'
+    assert compile_field_cleaner('calculation')([]) is None
+
+def test_unknown_field_type_has_no_cleaner():
+    assert compile_field_cleaner('image') is None
+
+def test_item_cleaner_labeled_layout():
+    item = {'fields': [field(1, 'text', [{'value': 'Acme'}], 'Name'), field(2, 'image', [{'value': 'x'}])]}
+    assert ItemCleaner().clean_item(item) == {
+        '1': {'field_id': 1, 'field_label': 'Name', 'field_type': 'text', 'field_value': 'Acme'},
+        '2': {'field_id': 2, 'field_label': 'Label', 'field_type': 'image', 'field_value': None}
+    }
+    assert ItemCleaner().clean_item(None) is None
+
+def test_item_cleaner_uses_schema_and_recompiles_on_type_change():
+    cleaner = ItemCleaner()
+    cleaner.load_schema({'3': {'type': 'calculation', 'return_type': 'number'}})
+    assert cleaner.clean_item({'fields': [field(3, 'calculation', [{'value': '2024'}])]})['3']['field_value'] == 2024.0
+    assert cleaner.clean_item({'fields': [field(3, 'text', [{'value': '2024'}])]})['3']['field_value'] == '2024'
+
+def test_typed_cleaners():
+    assert compile_field_cleaner('date', typed=True)([{'start': '2024-01-02 08:00:00'}]) == datetime(2024, 1, 2, 8)
+    assert compile_field_cleaner('category', typed=True)([{'value': {'text': 'Open'}}]) == ['Open']
+    assert compile_field_cleaner('app', typed=True)([{'value': {'item_id': 7}}, {'value': {'item_id': 8}}]) == [7, 8]
+    assert compile_field_cleaner('number', typed=True)([{'value': '2'}]) == 2.0
+    assert compile_field_cleaner('calculation', 'date', typed=True)([{'value': '2024-01-02'}]) == datetime(2024, 1, 2)
+    assert compile_field_cleaner('calculation', typed=True)([{'value': 'abc'}]) == 'abc'
+    assert compile_field_cleaner('image', typed=True) is None
+
+def test_item_cleaner_typed_layout():
+    cleaner = ItemCleaner(typed=True)
+    cleaner.load_schema({'3': {'type': 'calculation', 'return_type': 'number'}})
+    item = {'fields': [field(1, 'text', [{'value': 'Acme'}], 'Name'), field(2, 'image', [{'value': 'x'}]),
+                       field(3, 'calculation', [{'value': '2024'}])]}
+    assert cleaner.clean_item(item) == {'1': 'Acme', '2': None, '3': 2024.0}
@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime
+import pytest
+from pymongo import InsertOne, UpdateMany, UpdateOne
+import PodioItemStore
+from conftest import FakeDatabase
+
+def item(item_id, **data):
+    return {'item_id': item_id, 'data': data}
+
+def at(day):
+    return datetime(2024, 1, day)
+
+def store(db, items, **kwargs):
+    return asyncio.run(PodioItemStore.store_items(db, items, history='delta', **kwargs))
+
+def current(db, item_id):
+    return asyncio.run(db.podio_items.find_one({'item_id': str(item_id), 'current': 1}))
+
+
+def test_delta_write_ops_new_item_upserts_full_record():
+    operations, change = PodioItemStore.delta_write_ops(item(1, a=1, b=2), at(1), 10, None)
+    assert len(operations) == 1 and isinstance(operations[0], UpdateOne)
+    assert change == {'item_id': '1', 'version': 1, 'timestamp': at(1), 'set': {'a': 1, 'b': 2}, 'unset': []}
+
+def test_delta_write_ops_records_only_changed_and_removed_fields():
+    current_doc = {'_id': 'x', 'version': 3, 'hash': PodioItemStore.data_hash({'a': 1, 'b': 2}), 'data': {'a': 1, 'b': 2}}
+    operations, change = PodioItemStore.delta_write_ops(item(1, a=5, c=3), at(2), None, current_doc)
+    assert change['version'] == 4
+    assert change['set'] == {'a': 5, 'c': 3}
+    assert change['unset'] == ['b']
+    assert operations[0]._filter == {'_id': 'x', 'version': 3}
+    assert operations[0]._doc['$unset'] == {'data.b': ''}
+
+def test_delta_write_ops_skips_unchanged_data():
+    current_doc = {'_id': 'x', 'version': 1, 'hash': PodioItemStore.data_hash({'a': 1}), 'data': {'a': 1}}
+    assert PodioItemStore.delta_write_ops(item(1, a=1), at(2), None, current_doc) is None
+
+def test_delta_write_ops_keeps_legacy_copy_as_history():
+    legacy = {'_id': 'x', 'item_id': '1', 'current': 1, 'data': {'a': 1}}
+    operations, change = PodioItemStore.delta_write_ops(item(1, a=2), at(2), None, legacy)
+    assert [type(operation) for operation in operations] == [UpdateMany, InsertOne]
+    assert change['version'] == 1 and change['set'] == {'a': 2}
+
+def test_store_item_deltas_and_item_at():
+    db = FakeDatabase()
+    assert store(db, [(item(1, a=1, b=2), at(1), 10)]) == 1
+    assert store(db, [(item(1, a=1, b=2), at(2), 10)]) == 0
+    assert store(db, [(item(1, a=3), at(3), 10)]) == 1
+    assert current(db, 1)['data'] == {'a': 3}
+    assert current(db, 1)['version'] == 2
+    assert asyncio.run(PodioItemStore.item_at(db, 1, datetime(2023, 12, 31))) is None
+    assert asyncio.run(PodioItemStore.item_at(db, 1, at(2))) == {'a': 1, 'b': 2}
+    assert asyncio.run(PodioItemStore.item_at(db, 1, at(3))) == {'a': 3}
+
+def test_item_at_falls_back_to_copies():
+    db = FakeDatabase()
+    asyncio.run(PodioItemStore.store_items(db, [(item(1, a=1), at(1), None)]))
+    asyncio.run(PodioItemStore.store_items(db, [(item(1, a=2), at(3), None)]))
+    assert asyncio.run(PodioItemStore.item_at(db, 1, at(2))) == {'a': 1}
+    assert asyncio.run(PodioItemStore.item_at(db, 1, at(4))) == {'a': 2}
+
+def test_duplicate_items_in_a_batch_keep_the_last_result():
+    db = FakeDatabase()
+    assert store(db, [(item(1, a='X'), at(1), 10), (item(1, a='Y'), at(2), 10)]) == 1
+    assert current(db, 1)['data'] == {'a': 'Y'}
+    store(db, [(item(1, a='Z'), at(3), 10), (item(1, a='W'), at(4), 10)])
+    assert current(db, 1)['data'] == {'a': 'W'}
+    assert len(db.podio_item_changes.docs) == 2
+
+def concurrent_store(db, items):
+    '''
+    A writer that stores `items` between the next store's read and its bulk_write.
+    '''
+    async def write():
+        db.podio_items.before_bulk_write = None
+        await PodioItemStore.store_items(db, items, history='delta')
+    return write
+
+def test_write_that_loses_to_a_concurrent_writer_is_retried():
+    db = FakeDatabase()
+    store(db, [(item(1, a=1), at(1), 10)])
+    db.podio_items.before_bulk_write = concurrent_store(db, [(item(1, a=2), at(2), 10)])
+    assert store(db, [(item(1, a=3), at(3), 10)]) == 1
+    assert current(db, 1)['data'] == {'a': 3}
+    assert current(db, 1)['version'] == 3
+    assert sorted(change['version'] for change in db.podio_item_changes.docs) == [1, 2, 3]
+
+def test_new_item_inserted_concurrently_is_retried_as_update():
+    db = FakeDatabase()
+    db.podio_items.before_bulk_write = concurrent_store(db, [(item(1, a='sync'), at(1), 10)])
+    assert store(db, [(item(1, a='hook'), at(2), 10)]) == 1
+    assert current(db, 1)['data'] == {'a': 'hook'}
+    assert len(db.podio_items.select({'item_id': '1'})) == 1
+
+def test_persistent_conflict_raises_instead_of_dropping_the_write():
+    db = FakeDatabase()
+    store(db, [(item(1, a=0), at(1), 10)])
+    bumps = iter(range(1, 100))
+
+    async def concurrent_writer():
+        db.podio_items.before_bulk_write = None
+        await PodioItemStore.store_items(db, [(item(1, a=f'other{next(bumps)}'), at(2), 10)], history='delta')
+        db.podio_items.before_bulk_write = concurrent_writer
+
+    db.podio_items.before_bulk_write = concurrent_writer
+    with pytest.raises(PodioItemStore.ItemWriteConflict):
+        store(db, [(item(1, a='mine'), at(3), 10)])
+
+def test_lost_items():
+    expected = {'1': (2, 'h1'), '2': (1, 'h2'), '3': (1, 'h3')}
+    current_docs = {'1': {'version': 2, 'hash': 'h1'}, '2': {'version': 2, 'hash': 'other'}}
+    assert PodioItemStore.lost_items(expected, current_docs) == ['2', '3']
+
+def test_concurrent_insert_of_a_new_item_hits_unique_index_and_is_retried():
+    db = FakeDatabase()
+    other = concurrent_store(db, [(item(1, a='sync'), at(1), 10)])
+
+    async def insert_between_match_and_upsert():
+        db.podio_items.before_upsert = None
+        await other()
+
+    db.podio_items.before_upsert = insert_between_match_and_upsert
+    assert store(db, [(item(1, a='hook'), at(2), 10), (item(2, a='next'), at(2), 10)]) == 2
+    assert len(db.podio_items.select({'item_id': '1', 'current': 1})) == 1
+    assert current(db, 1)['data'] == {'a': 'hook'}
+    assert current(db, 1)['version'] == 2
+    assert current(db, 2)['data'] == {'a': 'next'}
+    assert sorted((change['item_id'], change['version']) for change in db.podio_item_changes.docs) == [('1', 1), ('1', 2), ('2', 1)]
+
+def test_copies_skip_unchanged_items():
+    db = FakeDatabase()
+    assert asyncio.run(PodioItemStore.store_items(db, [(item(1, a=1), at(1), 10), (item(2, a=1), at(1), 10)])) == 2
+    assert asyncio.run(PodioItemStore.store_items(db, [(item(1, a=1), at(2), 10), (item(2, a=2), at(2), 10)])) == 1
+    assert len(db.podio_items.select({'item_id': '1'})) == 1
+    assert len(db.podio_items.select({'item_id': '2'})) == 2
+    assert current(db, 2)['data'] == {'a': 2}
+
+def test_copies_skip_legacy_copy_without_hash():
+    db = FakeDatabase()
+    asyncio.run(db.podio_items.insert_one({'item_id': '1', 'current': 1, 'data': {'a': 1}}))
+    assert asyncio.run(PodioItemStore.store_items(db, [(item(1, a=1), at(2), 10)])) == 0
+    assert len(db.podio_items.docs) == 1
+
+def test_copies_insert_that_loses_to_a_concurrent_writer_is_retried():
+    db = FakeDatabase()
+
+    async def concurrent_writer():
+        db.podio_items.before_bulk_write = None
+        await PodioItemStore.store_items(db, [(item(1, a='sync'), at(1), 10)])
+
+    db.podio_items.before_bulk_write = concurrent_writer
+    assert asyncio.run(PodioItemStore.store_items(db, [(item(1, a='hook'), at(2), 10)])) == 1
+    assert len(db.podio_items.select({'item_id': '1', 'current': 1})) == 1
+    assert current(db, 1)['data'] == {'a': 'hook'}
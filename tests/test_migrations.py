@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from pymongo.errors import OperationFailure
+import MongoMigrations
+from conftest import FakeDatabase, FakeCollection
+
+def at(minute):
+    return datetime(2024, 1, 1, 12, minute)
+
+def event(_id, item_id, minute, **fields):
+    return {'_id': _id, 'type': 'item.update', 'item_id': item_id, 'timestamp': at(minute), **fields}
+
+
+def test_collapse_duplicate_item_events_merges_each_item_into_its_oldest_event():
+    db = FakeDatabase()
+    queue = db.to_do_event_queue
+    queue.unique = None  # Duplicates from before the unique index.
+    queue.docs = [
+        event(1, '7', 5, first_seen=at(5), coalesced_events=3, version=3, lease_until=at(10), leased_by='w1'),
+        event(2, '7', 1),
+        event(3, '7', 8, app_id='10', first_seen=at(8), coalesced_events=2, version=2),
+        event(4, '8', 2, version=1),
+        {'_id': 5, 'type': 'app.update', 'app_id': '10', 'timestamp': at(3)},
+        {'_id': 6, 'type': 'app.update', 'app_id': '10', 'timestamp': at(4)}
+    ]
+    assert asyncio.run(MongoMigrations.collapse_duplicate_item_events(db)) == 2
+    assert sorted(doc['_id'] for doc in queue.docs) == [2, 4, 5, 6]
+    merged = queue.select({'item_id': '7'})[0]
+    assert merged['timestamp'] == merged['first_seen'] == at(1)
+    assert merged['coalesced_events'] == 6
+    assert merged['version'] == 4
+    assert merged['app_id'] == '10'
+    assert 'lease_until' not in merged
+    queue.docs.append(event(7, '8', 9))
+    assert asyncio.run(MongoMigrations.collapse_duplicate_item_events(db)) == 0
+
+class FailingIndexes(FakeCollection):
+    async def create_index(self, keys, **options):
+        raise OperationFailure('E11000 duplicate key error', 11000)
+
+    async def index_information(self):
+        return {}
+
+def test_unique_index_that_cannot_be_created_raises():
+    db = FakeDatabase()
+    db.to_do_event_queue = FailingIndexes('to_do_event_queue')
+    with pytest.raises(MongoMigrations.MigrationError):
+        asyncio.run(MongoMigrations.ensure_indexes(db, {'to_do_event_queue': MongoMigrations.INDEXES['to_do_event_queue'][:1]}))
+
+def test_other_index_that_cannot_be_created_is_reported():
+    db = FakeDatabase()
+    db.to_do_event_queue = FailingIndexes('to_do_event_queue')
+    problems = asyncio.run(MongoMigrations.ensure_indexes(db, {'to_do_event_queue': MongoMigrations.INDEXES['to_do_event_queue'][1:2]}))
+    assert problems[0].startswith('to_do_event_queue.timestamp_id: could not create index')
+    assert problems[1:] == ['to_do_event_queue.timestamp_id: missing']
+
+def test_backfill_timestamps_marker_tolerates_workers_starting_together():
+    db = FakeDatabase()
+
+    async def start_two_workers():
+        return await asyncio.gather(MongoMigrations.backfill_timestamps(db), MongoMigrations.backfill_timestamps(db))
+
+    assert asyncio.run(start_two_workers()) == [0, 0]
+    assert [doc['_id'] for doc in db.migrations.docs] == ['backfill_timestamps']
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pyarrow as pa
+from bson import ObjectId
+import PodioItemStore
+from PodioParquetExport import ParquetExporter, arrow_value, item_schema
+from conftest import FakeDatabase
+
+FIELDS = {'1': {'type': 'text', 'field_label': 'Name'}, '2': {'type': 'money', 'field_label': 'Amount'}}
+
+def store(db, item_id, name, app_id, history):
+    item = {'item_id': item_id, 'data': {'1': name}}
+    asyncio.run(PodioItemStore.store_items(db, [(item, datetime(2024, 1, 1), app_id)], history=history))
+
+def age(collection, seconds):
+    '''
+    Moves every document's ObjectId `seconds` into the past, as if it had been stored then.
+    '''
+    for doc in collection.docs:
+        doc['_id'] = ObjectId.from_datetime(doc['_id'].generation_time - timedelta(seconds=seconds))
+
+def exported(db, history, since):
+    exporter = ParquetExporter(db, None, typed=True, history=history, chunk_size=2)
+
+    async def rows():
+        return sorted([(item_id, data['1']) async for item_id, data, _ in exporter.items_since('10', since, list(FIELDS))])
+    try:
+        return asyncio.run(rows())
+    finally:
+        exporter.close()
+
+
+def test_items_since_uses_store_time_and_includes_items_without_app_id():
+    for history in ('copies', 'delta'):
+        db = FakeDatabase()
+        store(db, 1, 'old', '10', history)
+        store(db, 2, 'other app', '11', history)
+        age(db.podio_items, 3600)
+        age(db.podio_item_changes, 3600)
+        store(db, 1, 'retried', '10', history)  # Stored now with its original hook timestamp.
+        store(db, 3, 'no app_id', None, history)
+        since = datetime.now(timezone.utc) - timedelta(minutes=5)
+        assert exported(db, history, since) == [('1', 'retried'), ('3', 'no app_id')]
+        assert exported(db, history, None) == [('1', 'retried'), ('3', 'no app_id')]
+
+def test_item_schema_and_record_batch():
+    schema, field_ids = item_schema(FIELDS, typed=False)
+    assert field_ids == ['1', '2']
+    assert schema.field('field_2').type == pa.float64()
+    exporter = ParquetExporter(FakeDatabase(), None)
+    batch = exporter.record_batch([('7', {'1': {'field_value': 'Acme'}, '2': {'field_value': 'n/a'}}, datetime(2024, 1, 1))], schema, field_ids)
+    assert batch.to_pylist() == [{'item_id': '7', 'timestamp': datetime(2024, 1, 1), 'field_1': 'Acme', 'field_2': None}]
+    exporter.close()
+
+def test_arrow_value_coerces_or_nulls():
+    assert arrow_value('2.5', pa.float64()) == 2.5
+    assert arrow_value('abc', pa.float64()) is None
+    assert arrow_value(['7', 'x'], pa.list_(pa.int64())) == [7]
+    assert arrow_value('2024-01-02', pa.timestamp('us')) == datetime(2024, 1, 2)
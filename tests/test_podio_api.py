@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+import requests
+from PodioApiWrapper import AsyncPodioAPI, PodioAPI
+
+class PagedPodio(AsyncPodioAPI):
+    '''
+    Serves `total` items in pages from fetch_filtered_page and records the offset of each request.
+    '''
+    def __init__(self, total):
+        super().__init__('https://api.podio.com/', 1, 'user', 'password', 'client', 'secret', client=object())
+        self.total = total
+        self.offsets = []
+
+    async def fetch_filtered_page(self, app_id, filters, limit, offset):
+        self.offsets.append(offset)
+        return [{'item_id': item_id} for item_id in range(offset, min(offset + limit, self.total))]
+
+    def clean_item(self, item):
+        return {'id': item['item_id']}
+
+async def read_pages(podio, **kwargs):
+    return [page async for page in podio.iter_filtered_items(10, {}, pages=True, **kwargs)]
+
+
+def test_iter_filtered_items_prefetches_every_page():
+    podio = PagedPodio(1200)
+    assert [len(page) for page in asyncio.run(read_pages(podio))] == [500, 500, 200]
+    assert podio.offsets == [0, 500, 1000]
+
+def test_iter_filtered_items_stops_at_max_pages_without_prefetching_more():
+    podio = PagedPodio(1200)
+    assert [len(page) for page in asyncio.run(read_pages(podio, max_pages=1))] == [500]
+    assert podio.offsets == [0]
+
+def test_get_items_by_ids_requests_only_the_pages_it_reads():
+    podio = PagedPodio(1200)
+    hydrated, pages = asyncio.run(podio.get_items_by_ids(10, [3, 7], datetime(2024, 1, 1), max_pages=3))
+    assert sorted(hydrated) == ['3', '7'] and pages == 1
+    assert podio.offsets == [0]
+    hydrated, pages = asyncio.run(podio.get_items_by_ids(10, [3, 700, 5000], datetime(2024, 1, 1), max_pages=2))
+    assert sorted(hydrated) == ['3', '700'] and pages == 2
+    assert podio.offsets == [0, 0, 500]
+
+class StubTokens:
+    '''
+    Hands out token-1, token-2, ... and records invalidations, instead of authenticating with Podio.
+    '''
+    def __init__(self):
+        self.issued = 0
+        self.invalidated = []
+
+    def get_token_sync(self, client):
+        if self.issued == 0 or self.invalidated:
+            self.issued += 1
+            self.invalidated = []
+        return f'token-{self.issued}'
+
+    def invalidate(self, client_id):
+        self.invalidated.append(client_id)
+
+class StubPool:
+    def __init__(self):
+        self.acquired = []
+        self.observed = []
+
+    def acquire_sync(self, kind):
+        self.acquired.append(kind)
+        return SimpleNamespace(username='user', password='password', client_id='client', client_secret='secret')
+
+    def observe(self, credential, kind, status_code, headers):
+        self.observed.append((kind, status_code))
+
+def sync_podio(monkeypatch, statuses, body):
+    '''
+    A PodioAPI whose HTTP requests answer with `statuses` in turn; returns (podio, pool, sent Authorization headers).
+    '''
+    responses = iter(statuses)
+    sent = []
+
+    def request(method, url, headers=None, **kwargs):
+        sent.append(headers['Authorization'])
+        status = next(responses)
+        return SimpleNamespace(status_code=status, content=b'{}', headers={}, json=lambda: body if status == 200 else {'error': 'unauthorized'})
+
+    monkeypatch.setattr(requests, 'request', request)
+    pool = StubPool()
+    podio = PodioAPI('https://api.podio.com/', 1, 'user', 'password', 'client', 'secret', credential_pool=pool, token_cache=StubTokens())
+    return podio, pool, sent
+
+@pytest.mark.parametrize('call, body', [
+    (lambda podio: podio.get_org(), [{'space_id': 1}]),
+    (lambda podio: podio.get_apps_in_space(1), []),
+    (lambda podio: podio.get_app_fields_data(10), {'fields': []}),
+    (lambda podio: podio.create_hook('https://gateway/item/update', 'app', 10, 'item.update'), {'hook_id': 5})
+])
+def test_sync_metadata_calls_are_charged_and_retry_a_401(monkeypatch, call, body):
+    podio, pool, sent = sync_podio(monkeypatch, [401, 200], body)
+    call(podio)
+    assert pool.acquired == ['standard']
+    assert pool.observed == [('standard', 200)]
+    assert sent == ['Bearer token-1', 'Bearer token-2']
+    assert podio.api_count == 2
+
+def test_sync_item_values_are_charged_as_rate_limited(monkeypatch):
+    podio, pool, sent = sync_podio(monkeypatch, [200], [])
+    assert podio.get_podio_item_values(7) == {'item_id': 7, 'data': {}}
+    assert pool.acquired == ['rate_limited'] and sent == ['Bearer token-1']
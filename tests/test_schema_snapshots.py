@@ -0,0 +1,24 @@
+from PodioSchemaSnapshots import diff_fields, schema_hash, stored_fields
+
+def info(label, field_type='text', return_type=None):
+    return {'field_label': label, 'type': field_type, 'return_type': return_type}
+
+
+def test_diff_fields_reports_each_kind_of_change():
+    old = {'1': info('Name'), '2': info('Total', 'calculation', 'number'), '3': info('Gone')}
+    new = {'1': info('Company'), '2': info('Total', 'calculation', 'date'), '4': info('New')}
+    assert diff_fields(old, new) == {
+        'added': {'4': 'New'},
+        'removed': {'3': 'Gone'},
+        'renamed': {'1': ['Name', 'Company']},
+        'type_changed': {'2': ['calculation/number', 'calculation/date']}
+    }
+
+def test_diff_fields_ignores_return_type_matching_type():
+    assert diff_fields({'1': info('Name', 'text')}, {'1': info('Name', 'text', 'text')}) == {}
+
+def test_schema_hash_is_stable_across_key_order():
+    fields = stored_fields({1: info('Name'), 2: info('Total')})
+    assert list(fields) == ['1', '2']
+    assert schema_hash(fields) == schema_hash(dict(reversed(list(fields.items()))))
+    assert schema_hash(fields) != schema_hash({'1': info('Name')})
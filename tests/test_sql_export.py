@@ -0,0 +1,45 @@
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+from PodioSqlExport import SqlExporter, app_key, field_value, value_kind
+
+def exporter():
+    sql = SqlExporter(SimpleNamespace(app_schemas=None), lambda: sqlite3.connect(':memory:'))
+    sql.open()
+    return sql
+
+
+def test_app_key_accepts_only_integer_ids():
+    assert app_key(123) == '123'
+    assert app_key('0042') == '42'
+    assert app_key('1; DROP TABLE podio_fields') is None
+    assert app_key('１２') is None
+    assert app_key(-1) is None
+    assert app_key(True) is None
+
+def test_app_of_rejects_invalid_app_id():
+    sql = exporter()
+    assert sql.app_of({'app_id': '12'}) == '12'
+    assert sql.app_of({'app_id': 'x"y'}) is None
+
+def test_quote_escapes_identifiers():
+    sql = exporter()
+    assert sql.quote('field_1') == '"field_1"'
+    assert sql.quote('a"b') == '"a""b"'
+    sql.dialect = dict(sql.dialect, quote='`')
+    assert sql.quote('a`b') == '`a``b`'
+
+def test_write_app_creates_table_and_upserts_rows():
+    sql = exporter()
+    infos = {'1': {'type': 'money', 'field_label': 'Amount'}, '2"x': {'type': 'text', 'field_label': 'Odd'}}
+    doc = {'item_id': '7', 'timestamp': datetime(2024, 1, 1), 'data': {'1': {'field_value': 5.0}, '2"x': {'field_value': 'a'}}}
+    sql.write_app('12', infos, [doc])
+    sql.write_app('12', infos, [dict(doc, data={'1': {'field_value': 6.0}})])
+    assert sql.execute('SELECT item_id, field_1, "field_2""x" FROM podio_app_12').fetchall() == [('7', 6.0, None)]
+    assert sql.execute('SELECT column_type FROM podio_fields WHERE field_id = ?', ('1',)).fetchone() == ('REAL',)
+
+def test_value_kind_and_field_value():
+    assert value_kind({'type': 'calculation', 'return_type': 'number'}, typed=True) == 'number'
+    assert value_kind({'type': 'date'}, typed=False) == 'text'
+    assert field_value({'field_value': 'a,b'}, typed=False) == 'a,b'
+    assert field_value(['a', 'b'], typed=True) == 'a,b'
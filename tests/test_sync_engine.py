@@ -0,0 +1,47 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from PodioSyncEngine import PodioSyncEngine
+from conftest import FakeDatabase
+
+class FakePodio:
+    '''
+    Serves `apps` ({ app_id: [page, ...] }) from iter_filtered_items and records the filters of each call.
+    An app whose pages are an exception raises it instead.
+    '''
+    credential_pool = None
+
+    def __init__(self, apps):
+        self.apps = apps
+        self.filters = []
+
+    async def iter_filtered_items(self, app_id, filters, pages=False):
+        self.filters.append((app_id, filters))
+        if isinstance(self.apps[app_id], Exception):
+            raise self.apps[app_id]
+        for page in self.apps[app_id]:
+            yield page
+
+
+def test_resync_of_unchanged_items_writes_nothing_and_advances_watermark():
+    db = FakeDatabase()
+    podio = FakePodio({'10': [{1: {'a': 1}, 2: {'a': 2}}, {3: {'a': 3}}]})
+    engine = PodioSyncEngine(podio, db)
+    assert asyncio.run(engine.run([10])) == {'10': 3}
+    first = asyncio.run(engine.watermark(10))
+    assert asyncio.run(engine.run([10])) == {'10': 0}
+    assert len(db.podio_items.docs) == 3
+    assert asyncio.run(engine.watermark(10)) >= first
+    assert podio.filters[0] == ('10', {})
+    assert podio.filters[1][1] == {'last_edit_on': {'from': (first - timedelta(seconds=300)).strftime('%Y-%m-%d %H:%M:%S')}}
+
+def test_failed_app_keeps_its_watermark():
+    db = FakeDatabase()
+    engine = PodioSyncEngine(FakePodio({'10': [{1: {'a': 1}}], '20': RuntimeError('page failed')}), db)
+    assert asyncio.run(engine.run([10, 20])) == {'10': 1, '20': None}
+    assert asyncio.run(engine.watermark(20)) is None
+
+def test_filters_since_applies_overlap():
+    engine = PodioSyncEngine(FakePodio({}), FakeDatabase(), overlap_seconds=60)
+    assert engine.filters_since(None) == {}
+    watermark = datetime(2024, 1, 1, 12, 0, 30, tzinfo=timezone.utc)
+    assert engine.filters_since(watermark) == {'last_edit_on': {'from': '2024-01-01 11:59:30'}}
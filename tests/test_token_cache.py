@@ -0,0 +1,70 @@
+import asyncio, json, os, stat, time
+from types import SimpleNamespace
+import requests
+from PodioTokenCache import TokenCache
+
+CREDENTIAL = SimpleNamespace(username='user', password='password', client_id='client', client_secret='secret')
+
+def reply(status, **payload):
+    return SimpleNamespace(status_code=status, json=lambda: payload, text=json.dumps(payload))
+
+
+def test_cached_token_is_refreshed_within_the_margin():
+    cache = TokenCache('https://api.podio.com/', refresh_margin=300)
+    cache.store('client', {'access_token': 'a', 'refresh_token': 'r', 'expires_in': 3600})
+    assert cache.cached('client') == 'a'
+    cache.store('client', {'access_token': 'b', 'refresh_token': 'r', 'expires_in': 200})
+    assert cache.cached('client') is None
+
+def test_invalidate_keeps_the_refresh_token():
+    cache = TokenCache('https://api.podio.com/')
+    cache.store('client', {'access_token': 'a', 'refresh_token': 'r', 'expires_in': 3600})
+    cache.invalidate('client')
+    assert cache.cached('client') is None
+    assert [grant['grant_type'] for grant in cache.grants(CREDENTIAL)] == ['refresh_token', 'password']
+
+def test_tokens_persist_privately_across_instances(tmp_path):
+    path = str(tmp_path / 'tokens.json')
+    TokenCache('https://api.podio.com/', path=path).store('client', {'access_token': 'a', 'expires_in': 3600})
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert os.listdir(tmp_path) == ['tokens.json']
+    assert TokenCache('https://api.podio.com/', path=path).cached('client') == 'a'
+
+def test_unreadable_cache_file_starts_empty(tmp_path):
+    path = tmp_path / 'tokens.json'
+    path.write_text('not json')
+    assert TokenCache('https://api.podio.com/', path=str(path)).tokens == {}
+
+def test_failed_refresh_falls_back_to_password_grant(monkeypatch):
+    grants = []
+
+    def post(url, data=None):
+        grants.append(data['grant_type'])
+        if data['grant_type'] == 'refresh_token':
+            return reply(400, error='invalid_grant')
+        return reply(200, access_token='fresh', refresh_token='r2', expires_in=3600)
+
+    monkeypatch.setattr(requests, 'post', post)
+    cache = TokenCache('https://api.podio.com/')
+    cache.tokens['client'] = {'access_token': 'old', 'refresh_token': 'r', 'expires_at': time.time() - 1}
+    assert cache.get_token_sync(CREDENTIAL) == 'fresh'
+    assert grants == ['refresh_token', 'password']
+    assert cache.tokens['client']['refresh_token'] == 'r2'
+    assert cache.get_token_sync(CREDENTIAL) == 'fresh' and cache.auth_count == 2
+
+def test_concurrent_callers_share_one_refresh():
+    class Client:
+        posts = 0
+
+        async def post(self, url, data=None):
+            self.posts += 1
+            await asyncio.sleep(0.01)
+            return reply(200, access_token='shared', expires_in=3600)
+
+    async def scenario():
+        cache = TokenCache('https://api.podio.com/')
+        client = Client()
+        tokens = await asyncio.gather(*[cache.get_token(client, CREDENTIAL) for _ in range(5)])
+        return tokens, client.posts
+
+    assert asyncio.run(scenario()) == (['shared'] * 5, 1)
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import timedelta
+from WorkerSharding import ShardCoordinator, assign_missing_shards, credential_slice, shard_for
+from conftest import FakeDatabase
+
+
+def test_shard_for_is_stable_across_key_types():
+    assert shard_for(12345, 16) == shard_for('12345', 16)
+    assert len({shard_for(item_id, 16) for item_id in range(1000)}) == 16
+
+def test_credential_slice():
+    keys = ['a', 'b', 'c', 'd', 'e']
+    assert [credential_slice(keys, index, 2) for index in range(2)] == [['a', 'c', 'e'], ['b', 'd']]
+    assert [credential_slice(keys[:2], index, 3) for index in range(3)] == [['a'], ['b'], ['a']]
+
+def test_workers_split_shards_and_rebalance_when_one_leaves():
+    async def scenario():
+        db = FakeDatabase()
+        first = ShardCoordinator(db, 'w1', 8)
+        second = ShardCoordinator(db, 'w2', 8)
+        await first.start()
+        assert first.owned == set(range(8))
+        await second.start()
+        await first.round()
+        await second.round()
+        assert first.owned.isdisjoint(second.owned) and first.owned | second.owned == set(range(8))
+        assert len(first.owned) == len(second.owned) == 4
+        await second.stop()
+        await first.round()
+        assert first.owned == set(range(8))
+    asyncio.run(scenario())
+
+def test_only_one_worker_runs_leader_jobs_and_they_are_restarted():
+    async def scenario():
+        db = FakeDatabase()
+        runs = []
+
+        async def job():
+            runs.append(len(runs))
+            if len(runs) == 1:
+                raise RuntimeError('job crashed')
+            await asyncio.Event().wait()
+
+        first = ShardCoordinator(db, 'w1', 2)
+        second = ShardCoordinator(db, 'w2', 2)
+        first.leader_job(job)
+        second.leader_job(job)
+        await first.start()
+        await second.start()
+        assert first.is_leader and not second.is_leader
+        await asyncio.sleep(0)
+        assert runs == [0] and first.leader_tasks[0].done()
+        await first.round()
+        await asyncio.sleep(0)
+        assert runs == [0, 1] and not first.leader_tasks[0].done()
+        await first.stop()
+    asyncio.run(scenario())
+
+def test_worker_that_cannot_renew_drops_leases_before_they_expire():
+    async def scenario():
+        db = FakeDatabase()
+        coordinator = ShardCoordinator(db, 'w1', 2, lease_seconds=30, heartbeat_seconds=10)
+
+        async def job():
+            await asyncio.Event().wait()
+
+        coordinator.leader_job(job)
+        await coordinator.start()
+        task = coordinator.leader_tasks[0]
+        renewed = coordinator.renewed_at
+        coordinator.drop_expiring_leases(renewed + timedelta(seconds=15))
+        assert coordinator.is_leader and coordinator.owned == {0, 1}
+        coordinator.drop_expiring_leases(renewed + timedelta(seconds=20))
+        await asyncio.sleep(0)
+        assert not coordinator.is_leader and coordinator.owned == set()
+        assert task.cancelled()
+        await coordinator.round()
+        assert coordinator.is_leader and coordinator.owned == {0, 1}
+        await coordinator.stop()
+    asyncio.run(scenario())
+
+def test_assign_missing_shards():
+    db = FakeDatabase()
+    db.to_do_event_queue.unique = None
+    db.to_do_event_queue.docs = [{'_id': 1, 'item_id': '7'}, {'_id': 2, 'app_id': '10'}, {'_id': 3, 'item_id': '8', 'shard': 0}]
+    assert asyncio.run(assign_missing_shards(db.to_do_event_queue, 16)) == 2
+    assert [doc['shard'] for doc in db.to_do_event_queue.docs] == [shard_for('7', 16), shard_for('10', 16), 0]